@@ -1,15 +1,39 @@
-import customtkinter as ctk
-from tkinter import scrolledtext, messagebox
 import threading
-import time
-from datetime import datetime
-import json
-import os
+import customtkinter as ctk
+from tkinter import filedialog, scrolledtext, messagebox
+from ap_attachments import parse_attachments
+from ap_bulk import read_channels
+from ap_core import PosterCore
+from ap_logging import LogPipeline
+from ap_templates import format_snippets, parse_snippets
+from ap_tokens import parse_tokens
+from ap_widgets import VirtualList
 
 # Set appearance mode and color theme
 ctk.set_appearance_mode("Dark")  # Modes: "System", "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue", "green", "dark-blue"
 
+# How often queued log lines are flushed to the Logs tab
+LOG_FLUSH_MS = 100
+# How often the Stats tab is refreshed
+STATS_REFRESH_MS = 1000
+# Channels listed in the Stats tab, slowest p95 first
+STATS_TOP_CHANNELS = 20
+# Row colours of the connection test results, by verdict
+PROBE_COLORS = {"ok": "green", "slow": "orange", "unreachable": "red"}
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def format_probe(result):
+    return ", ".join(
+        f"{phase} {format_ms(result[phase])}"
+        for phase in ("dns", "connect", "tls", "first_byte") if result[phase] is not None
+    )
+
+
 class DiscordAutoPoster(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -19,19 +43,31 @@ class DiscordAutoPoster(ctk.CTk):
         self.geometry("1000x700")
         self.minsize(800, 600)
         
-        # App data
-        self.bot_token = ""
-        self.channels = []
-        self.logs = []
+        # Log lines from any thread go through the pipeline and are flushed
+        # to the Logs tab in batches by pump_logs()
+        self.log_pipeline = LogPipeline()
+        
+        # App data (settings, channels and the posting engine live in the core)
+        self.core = PosterCore(log=self.log)
         self.auto_posting = False
-        self.posting_thread = None
+        self.selected_index = None
         
         # Load saved data if exists
         self.load_data()
+        self.log_pipeline.open_file(self.core.log_file)
         
         # Setup UI
         self.setup_ui()
+        self.pump_logs()
         
+    @property
+    def channels(self):
+        return self.core.channels
+    
+    @property
+    def logs(self):
+        return self.log_pipeline.lines
+    
     def setup_ui(self):
         # Create main grid
         self.grid_columnconfigure(0, weight=1)
@@ -51,9 +87,10 @@ class DiscordAutoPoster(ctk.CTk):
         self.tabview.add("Bot Settings")
         self.tabview.add("Channels")
         self.tabview.add("Logs")
+        self.tabview.add("Stats")
         
         # Configure tab grid
-        for tab_name in ["Bot Settings", "Channels", "Logs"]:
+        for tab_name in ["Bot Settings", "Channels", "Logs", "Stats"]:
             self.tabview.tab(tab_name).grid_columnconfigure(0, weight=1)
             self.tabview.tab(tab_name).grid_rowconfigure(1, weight=1)
         
@@ -66,6 +103,9 @@ class DiscordAutoPoster(ctk.CTk):
         # Logs tab
         self.setup_logs_tab()
         
+        # Stats tab
+        self.setup_stats_tab()
+        
         # Status bar
         self.setup_status_bar()
     
@@ -77,18 +117,58 @@ class DiscordAutoPoster(ctk.CTk):
         token_frame.grid(row=0, column=0, padx=20, pady=20, sticky="ew")
         token_frame.grid_columnconfigure(1, weight=1)
         
-        ctk.CTkLabel(token_frame, text="Bot Token:", font=ctk.CTkFont(weight="bold")).grid(
+        ctk.CTkLabel(token_frame, text="Bot Tokens:", font=ctk.CTkFont(weight="bold")).grid(
             row=0, column=0, padx=20, pady=20, sticky="w"
         )
         
         self.token_entry = ctk.CTkEntry(
             token_frame, 
-            placeholder_text="Enter your bot token here",
+            placeholder_text="One or more bot tokens, separated by commas",
             show="•"
         )
-        self.token_entry.insert(0, self.bot_token)
+        self.token_entry.insert(0, ", ".join(self.core.bot_tokens))
         self.token_entry.grid(row=0, column=1, padx=(0, 20), pady=20, sticky="ew")
         
+        ctk.CTkLabel(token_frame, text="Max Concurrent Posts:", font=ctk.CTkFont(weight="bold")).grid(
+            row=1, column=0, padx=20, pady=(0, 20), sticky="w"
+        )
+        
+        self.concurrency_entry = ctk.CTkEntry(token_frame)
+        self.concurrency_entry.insert(0, str(self.core.max_concurrency))
+        self.concurrency_entry.grid(row=1, column=1, padx=(0, 20), pady=(0, 20), sticky="ew")
+        
+        ctk.CTkLabel(token_frame, text="Worker Processes:", font=ctk.CTkFont(weight="bold")).grid(
+            row=2, column=0, padx=20, pady=(0, 20), sticky="w"
+        )
+        
+        self.workers_entry = ctk.CTkEntry(token_frame)
+        self.workers_entry.insert(0, str(self.core.worker_processes))
+        self.workers_entry.grid(row=2, column=1, padx=(0, 20), pady=(0, 20), sticky="ew")
+        
+        ctk.CTkLabel(token_frame, text="Log File (optional):", font=ctk.CTkFont(weight="bold")).grid(
+            row=3, column=0, padx=20, pady=(0, 20), sticky="w"
+        )
+        
+        self.log_file_entry = ctk.CTkEntry(token_frame, placeholder_text="e.g. discord_auto_poster.log")
+        self.log_file_entry.insert(0, self.core.log_file)
+        self.log_file_entry.grid(row=3, column=1, padx=(0, 20), pady=(0, 20), sticky="ew")
+        
+        ctk.CTkLabel(token_frame, text="Metrics Port (0 = off):", font=ctk.CTkFont(weight="bold")).grid(
+            row=4, column=0, padx=20, pady=(0, 20), sticky="w"
+        )
+        
+        self.metrics_port_entry = ctk.CTkEntry(token_frame)
+        self.metrics_port_entry.insert(0, str(self.core.metrics_port))
+        self.metrics_port_entry.grid(row=4, column=1, padx=(0, 20), pady=(0, 20), sticky="ew")
+        
+        ctk.CTkLabel(token_frame, text="Snippets (name: text):", font=ctk.CTkFont(weight="bold")).grid(
+            row=5, column=0, padx=20, pady=(0, 20), sticky="nw"
+        )
+        
+        self.snippets_text = ctk.CTkTextbox(token_frame, height=80)
+        self.snippets_text.insert("1.0", format_snippets(self.core.snippets))
+        self.snippets_text.grid(row=5, column=1, padx=(0, 20), pady=(0, 20), sticky="ew")
+        
         # Control buttons frame
         control_frame = ctk.CTkFrame(tab)
         control_frame.grid(row=1, column=0, padx=20, pady=(0, 20), sticky="ew")
@@ -108,11 +188,12 @@ class DiscordAutoPoster(ctk.CTk):
             command=self.save_settings
         ).grid(row=0, column=1, padx=20, pady=20)
         
-        ctk.CTkButton(
+        self.test_connection_btn = ctk.CTkButton(
             control_frame, 
             text="Test Connection", 
             command=self.test_connection
-        ).grid(row=0, column=2, padx=20, pady=20)
+        )
+        self.test_connection_btn.grid(row=0, column=2, padx=20, pady=20)
     
     def setup_channels_tab(self):
         tab = self.tabview.tab("Channels")
@@ -121,19 +202,28 @@ class DiscordAutoPoster(ctk.CTk):
         list_frame = ctk.CTkFrame(tab)
         list_frame.grid(row=0, column=0, padx=20, pady=20, sticky="nsew")
         list_frame.grid_columnconfigure(0, weight=1)
-        list_frame.grid_rowconfigure(1, weight=1)
+        list_frame.grid_rowconfigure(2, weight=1)
         
         ctk.CTkLabel(list_frame, text="Channels", font=ctk.CTkFont(weight="bold")).grid(
             row=0, column=0, padx=20, pady=(20, 10), sticky="w"
         )
         
-        # Channel listbox
-        self.channel_listbox = ctk.CTkScrollableFrame(list_frame)
-        self.channel_listbox.grid(row=1, column=0, padx=20, pady=(0, 20), sticky="nsew")
+        # Search by channel ID or user ID
+        self.channel_search_entry = ctk.CTkEntry(list_frame, placeholder_text="Search channel ID or user ID")
+        self.channel_search_entry.grid(row=1, column=0, padx=20, pady=(0, 10), sticky="ew")
+        self.channel_search_entry.bind("<KeyRelease>", lambda event: self.refresh_channel_list())
+        
+        # Channel listbox (only the visible rows exist as widgets)
+        self.channel_listbox = VirtualList(
+            list_frame,
+            label=self.channel_label,
+            on_select=self.select_channel
+        )
+        self.channel_listbox.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="nsew")
         
         # Buttons frame
         btn_frame = ctk.CTkFrame(list_frame)
-        btn_frame.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="ew")
+        btn_frame.grid(row=3, column=0, padx=20, pady=(0, 20), sticky="ew")
         
         ctk.CTkButton(
             btn_frame, 
@@ -149,11 +239,25 @@ class DiscordAutoPoster(ctk.CTk):
             hover_color="darkred"
         ).grid(row=0, column=1, padx=20, pady=10)
         
+        self.import_btn = ctk.CTkButton(
+            btn_frame, 
+            text="Import CSV/JSONL", 
+            command=self.import_channels
+        )
+        self.import_btn.grid(row=1, column=0, padx=20, pady=(0, 10))
+        
+        ctk.CTkButton(
+            btn_frame, 
+            text="Export CSV/JSONL", 
+            command=self.export_channels
+        ).grid(row=1, column=1, padx=20, pady=(0, 10))
+        
         # Channel editor
         self.setup_channel_editor(tab)
         
         # Refresh channel list
         self.refresh_channel_list()
+        self.select_channel(0)
     
     def setup_channel_editor(self, tab):
         editor_frame = ctk.CTkFrame(tab)
@@ -186,7 +290,11 @@ class DiscordAutoPoster(ctk.CTk):
         self.webhook_entry.grid(row=3, column=1, padx=(0, 20), pady=10, sticky="ew")
         
         # Message
-        ctk.CTkLabel(editor_frame, text="Message:").grid(
+        ctk.CTkLabel(
+            editor_frame,
+            text="Message:\n\n{mention} {counter}\n{time} {date}\n{snippet:name}",
+            justify="left"
+        ).grid(
             row=4, column=0, padx=20, pady=10, sticky="nw"
         )
         self.message_text = ctk.CTkTextbox(editor_frame, height=150)
@@ -200,19 +308,57 @@ class DiscordAutoPoster(ctk.CTk):
         self.interval_entry.insert(0, "3600")
         self.interval_entry.grid(row=5, column=1, padx=(0, 20), pady=10, sticky="ew")
         
+        # Attachments (files sent with every new post)
+        ctk.CTkLabel(editor_frame, text="Attachments:").grid(
+            row=6, column=0, padx=20, pady=10, sticky="w"
+        )
+        
+        attachments_frame = ctk.CTkFrame(editor_frame, fg_color="transparent")
+        attachments_frame.grid(row=6, column=1, padx=(0, 20), pady=10, sticky="ew")
+        attachments_frame.grid_columnconfigure(0, weight=1)
+        
+        self.attachments_entry = ctk.CTkEntry(attachments_frame, placeholder_text="File paths, separated by ;")
+        self.attachments_entry.grid(row=0, column=0, sticky="ew")
+        
+        ctk.CTkButton(
+            attachments_frame, 
+            text="Browse", 
+            width=70,
+            command=self.browse_attachments
+        ).grid(row=0, column=1, padx=(10, 0))
+        
+        # Channels without a webhook post with a bot token; 0 balances them
+        # across all tokens, N pins the channel to token N
+        ctk.CTkLabel(editor_frame, text="Bot Token # (0 = any):").grid(
+            row=7, column=0, padx=20, pady=10, sticky="w"
+        )
+        
+        self.token_pin_entry = ctk.CTkEntry(editor_frame)
+        self.token_pin_entry.insert(0, "0")
+        self.token_pin_entry.grid(row=7, column=1, padx=(0, 20), pady=10, sticky="ew")
+        
+        # Edit-in-place: keep editing the last message instead of posting anew
+        self.edit_in_place_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            editor_frame, 
+            text="Edit previous message instead of posting a new one", 
+            variable=self.edit_in_place_var
+        ).grid(row=8, column=0, columnspan=2, padx=20, pady=10, sticky="w")
+        
         # Save button
         ctk.CTkButton(
             editor_frame, 
             text="Save Channel", 
             command=self.save_channel
-        ).grid(row=6, column=0, columnspan=2, padx=20, pady=20)
+        ).grid(row=9, column=0, columnspan=2, padx=20, pady=20)
         
         # Test button
-        ctk.CTkButton(
+        self.test_post_btn = ctk.CTkButton(
             editor_frame, 
             text="Test Post", 
             command=self.test_post
-        ).grid(row=7, column=0, columnspan=2, padx=20, pady=(0, 20))
+        )
+        self.test_post_btn.grid(row=10, column=0, columnspan=2, padx=20, pady=(0, 20))
     
     def setup_logs_tab(self):
         tab = self.tabview.tab("Logs")
@@ -240,6 +386,32 @@ class DiscordAutoPoster(ctk.CTk):
             command=self.clear_logs
         ).grid(row=2, column=0, padx=20, pady=(0, 20))
     
+    def setup_stats_tab(self):
+        tab = self.tabview.tab("Stats")
+        
+        self.stats_label = ctk.CTkLabel(tab, text="", justify="left", font=ctk.CTkFont(family="Consolas"))
+        self.stats_label.grid(row=0, column=0, padx=20, pady=(20, 10), sticky="w")
+        
+        # Per-channel latency, slowest first
+        self.stats_text = scrolledtext.ScrolledText(
+            tab, 
+            wrap="none", 
+            bg="#2b2b2b", 
+            fg="white", 
+            font=("Consolas", 10)
+        )
+        self.stats_text.grid(row=1, column=0, padx=20, pady=(0, 20), sticky="nsew")
+        self.stats_text.config(state="disabled")
+        
+        ctk.CTkButton(
+            tab, 
+            text="Export Metrics", 
+            command=self.export_metrics
+        ).grid(row=2, column=0, padx=20, pady=(0, 20))
+        
+        self.stats_shown = None
+        self.update_stats()
+    
     def setup_status_bar(self):
         status_frame = ctk.CTkFrame(self)
         status_frame.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="ew")
@@ -255,23 +427,27 @@ class DiscordAutoPoster(ctk.CTk):
         self.next_post_label = ctk.CTkLabel(status_frame, text="")
         self.next_post_label.grid(row=0, column=1, padx=20, pady=10, sticky="e")
     
+    def channel_label(self, index):
+        channel = self.channels[index]
+        return f"Channel {index + 1}: {channel.get('channel_id') or 'No ID'}"
+    
     def refresh_channel_list(self):
-        # Clear the listbox
-        for widget in self.channel_listbox.winfo_children():
-            widget.destroy()
-        
-        # Add channels to the listbox
-        for i, channel in enumerate(self.channels):
-            btn = ctk.CTkButton(
-                self.channel_listbox,
-                text=f"Channel {i+1}: {channel.get('channel_id', 'No ID')}",
-                command=lambda idx=i: self.select_channel(idx),
-                anchor="w"
-            )
-            btn.grid(row=i, column=0, padx=10, pady=5, sticky="ew")
+        query = self.channel_search_entry.get().strip().lower()
+        if query:
+            rows = [
+                i for i, channel in enumerate(self.channels)
+                if query in str(channel.get("channel_id", "")).lower()
+                or query in str(channel.get("user_id", "")).lower()
+            ]
+        else:
+            rows = range(len(self.channels))
+        self.channel_listbox.set_rows(rows)
     
     def select_channel(self, index):
         if 0 <= index < len(self.channels):
+            self.selected_index = index
+            self.channel_listbox.select(index)
+            self.channel_listbox.see(index)
             channel = self.channels[index]
             self.channel_id_entry.delete(0, "end")
             self.channel_id_entry.insert(0, channel.get("channel_id", ""))
@@ -287,36 +463,44 @@ class DiscordAutoPoster(ctk.CTk):
             
             self.interval_entry.delete(0, "end")
             self.interval_entry.insert(0, str(channel.get("interval", 3600)))
+            
+            self.attachments_entry.delete(0, "end")
+            self.attachments_entry.insert(0, "; ".join(channel.get("attachments", [])))
+            
+            self.token_pin_entry.delete(0, "end")
+            self.token_pin_entry.insert(0, str(channel.get("token", 0)))
+            
+            self.edit_in_place_var.set(bool(channel.get("edit_in_place", False)))
     
     def add_channel(self):
-        self.channels.append({
-            "channel_id": "",
-            "user_id": "",
-            "webhook_url": "",
-            "message": "",
-            "interval": 3600
-        })
+        self.core.add_channel()
         self.refresh_channel_list()
         self.select_channel(len(self.channels) - 1)
         self.log("Added new channel")
     
     def remove_channel(self):
-        if not self.channels:
+        if self.selected_index is None or not 0 <= self.selected_index < len(self.channels):
             return
         
-        # In a real app, you'd want to select which channel to remove
-        # For simplicity, we'll remove the last one
-        self.channels.pop()
+        self.core.remove_channel(self.selected_index)
         self.refresh_channel_list()
+        self.select_channel(min(self.selected_index, len(self.channels) - 1))
+        if not self.channels:
+            self.selected_index = None
         self.log("Removed channel")
     
+    def browse_attachments(self):
+        paths = filedialog.askopenfilenames()
+        if paths:
+            current = parse_attachments(self.attachments_entry.get())
+            self.attachments_entry.delete(0, "end")
+            self.attachments_entry.insert(0, "; ".join(current + list(paths)))
+    
     def save_channel(self):
-        if not self.channels:
+        if self.selected_index is None or not 0 <= self.selected_index < len(self.channels):
             return
         
-        # Get the currently selected channel index (simplified)
-        # In a real app, you'd track the selected index
-        channel = self.channels[-1] if self.channels else {}
+        channel = self.channels[self.selected_index]
         
         channel["channel_id"] = self.channel_id_entry.get()
         channel["user_id"] = self.user_id_entry.get()
@@ -328,23 +512,160 @@ class DiscordAutoPoster(ctk.CTk):
         except ValueError:
             channel["interval"] = 3600
         
+        channel["attachments"] = parse_attachments(self.attachments_entry.get())
+        
+        try:
+            channel["token"] = max(0, int(self.token_pin_entry.get()))
+        except ValueError:
+            channel["token"] = 0
+        
+        channel["edit_in_place"] = self.edit_in_place_var.get()
+        
+        self.core.save_channel(channel)
+        self.channel_listbox.refresh()
         self.log("Saved channel settings")
-        self.save_data()
+    
+    def import_channels(self):
+        path = filedialog.askopenfilename(
+            filetypes=[("Channel lists", "*.csv *.jsonl *.ndjson"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        
+        # Parsing and validation run on a worker thread; only the merge into
+        # the channel list happens on the Tk thread, followed by one refresh
+        self.import_btn.configure(state="disabled")
+        self.log(f"Importing channels from {path}...")
+        job = {}
+        
+        def parse():
+            # Anything unexpected is reported too; finish() needs a result or
+            # an error to put the Import button back
+            try:
+                job["result"] = read_channels(path)
+            except Exception as e:
+                job["error"] = e
+        
+        thread = threading.Thread(target=parse, name="channel-import", daemon=True)
+        thread.start()
+        
+        def finish():
+            if thread.is_alive():
+                self.after(100, finish)
+                return
+            self.import_btn.configure(state="normal")
+            if "error" in job:
+                self.log(f"Import failed: {job['error']}")
+                messagebox.showerror("Import Channels", str(job["error"]))
+                return
+            result = job["result"]
+            added, updated = self.core.import_channels(result)
+            self.refresh_channel_list()
+            self.log(f"Imported {result.summary()}: {added} added, {updated} updated")
+            for error in result.errors[:10]:
+                self.log(f"Import skipped {error}")
+        
+        self.after(100, finish)
+    
+    def export_channels(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not path:
+            return
+        try:
+            count = self.core.export_channels(path)
+        except OSError as e:
+            messagebox.showerror("Export Channels", str(e))
+            return
+        self.log(f"Exported {count} channels to {path}")
     
     def save_settings(self):
-        self.bot_token = self.token_entry.get()
-        self.save_data()
+        self.core.set_tokens(parse_tokens(self.token_entry.get()))
+        self.core.set_concurrency(self.concurrency_entry.get())
+        self.core.set_workers(self.workers_entry.get())
+        self.core.set_snippets(parse_snippets(self.snippets_text.get("1.0", "end-1c")))
+        self.core.set_metrics_port(self.metrics_port_entry.get())
+        if self.log_file_entry.get().strip() != self.core.log_file:
+            self.core.log_file = self.log_file_entry.get().strip()
+            self.log_pipeline.open_file(self.core.log_file)
+        self.core.save_settings()
         self.log("Saved bot settings")
     
+    def wait_for(self, future, done):
+        # Polls a future from the delivery engine without blocking Tk
+        if not future.done():
+            self.after(100, lambda: self.wait_for(future, done))
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            result = e
+        done(result)
+    
     def test_connection(self):
         self.log("Testing connection to Discord...")
-        # Simulate connection test
-        self.after(1000, lambda: self.log("Connection test completed successfully"))
+        self.test_connection_btn.configure(state="disabled")
+        
+        def done(results):
+            self.test_connection_btn.configure(state="normal")
+            if isinstance(results, Exception):
+                self.log(f"Connection test failed: {results}")
+                return
+            if not results:
+                self.log("Connection test: no webhook URLs or bot tokens to test")
+                return
+            flagged = [result for result in results if result["verdict"] != "ok"]
+            for result in flagged:
+                self.log(f"Connection test: {result['name']} is {result['verdict']} ({result['error'] or format_probe(result)})")
+            self.log(f"Connection test completed: {len(results) - len(flagged)}/{len(results)} OK")
+            self.show_probe_results(results)
+        
+        self.wait_for(self.core.test_connection(), done)
+    
+    def show_probe_results(self, results):
+        window = ctk.CTkToplevel(self)
+        window.title("Connection Test")
+        window.transient(self)
+        
+        frame = ctk.CTkFrame(window)
+        frame.pack(fill="both", expand=True, padx=20, pady=20)
+        headings = ("Host", "DNS", "Connect", "TLS", "First byte", "Sockets", "Status")
+        for column, heading in enumerate(headings):
+            ctk.CTkLabel(frame, text=heading, font=ctk.CTkFont(weight="bold")).grid(
+                row=0, column=column, padx=10, pady=(10, 5), sticky="w"
+            )
+        for row, result in enumerate(results, 1):
+            values = [result["name"]]
+            values += [format_ms(result[phase]) for phase in ("dns", "connect", "tls", "first_byte")]
+            values.append(str(result["connections"]))
+            values.append(result["error"] or result["verdict"])
+            color = PROBE_COLORS.get(result["verdict"], PROBE_COLORS["unreachable"])
+            for column, value in enumerate(values):
+                ctk.CTkLabel(frame, text=value, text_color=color).grid(row=row, column=column, padx=10, pady=2, sticky="w")
+        
+        ctk.CTkButton(window, text="Close", command=window.destroy).pack(pady=(0, 20))
     
     def test_post(self):
-        self.log("Testing post to Discord...")
-        # Simulate post test
-        self.after(1000, lambda: self.log("Test post completed successfully"))
+        if self.selected_index is None or not 0 <= self.selected_index < len(self.channels):
+            messagebox.showerror("Error", "No channel selected")
+            return
+        
+        channel = self.channels[self.selected_index]
+        name = channel.get("channel_id") or "No ID"
+        self.log(f"Testing post to channel {name}...")
+        self.test_post_btn.configure(state="disabled")
+        
+        def done(response):
+            self.test_post_btn.configure(state="normal")
+            if isinstance(response, Exception):
+                self.log(f"Test post to channel {name} failed: {response}")
+            elif response is not None and response.ok:
+                self.log(f"Test post to channel {name} completed successfully")
+            # Failures have already been logged by the engine
+        
+        self.wait_for(self.core.test_post(channel), done)
     
     def toggle_auto_posting(self):
         self.auto_posting = not self.auto_posting
@@ -360,91 +681,121 @@ class DiscordAutoPoster(ctk.CTk):
         self.status_label.configure(text="Auto-posting enabled", text_color="red")
         self.log("Auto-posting started")
         
-        # Start auto-posting in a separate thread
-        self.posting_thread = threading.Thread(target=self.auto_posting_loop, daemon=True)
-        self.posting_thread.start()
+        # Every channel is due immediately, then again every `interval` seconds
+        self.core.start()
+        self.update_next_post_label()
     
     def stop_auto_posting(self):
         self.auto_posting = False
+        self.core.stop()
         self.start_btn.configure(text="Start Auto-Posting", fg_color="green", hover_color="darkgreen")
         self.status_label.configure(text="Ready", text_color="green")
         self.next_post_label.configure(text="")
         self.log("Auto-posting stopped")
     
-    def auto_posting_loop(self):
-        while self.auto_posting:
-            # Simulate posting to each channel
-            for i, channel in enumerate(self.channels):
-                if not self.auto_posting:
-                    break
-                    
-                # Simulate posting
-                self.log(f"Posted to channel {i+1}")
-                time.sleep(2)  # Simulate delay
+    def update_next_post_label(self):
+        if not self.auto_posting:
+            return
+        
+        self.status_label.configure(text=f"Auto-posting enabled ({self.core.status_text()})")
+        
+        remaining = self.core.next_due_in()
+        if remaining is None:
+            self.next_post_label.configure(text="")
+        else:
+            self.next_post_label.configure(text=f"Next post in: {int(remaining)}s")
+        self.after(1000, self.update_next_post_label)
+    
+    def update_stats(self):
+        # Only redraw while the tab is visible; the metrics themselves are
+        # collected on the engine thread regardless, and core.metrics() is a
+        # copy of them this thread can read at leisure
+        if self.tabview.get() == "Stats":
+            metrics = self.core.metrics()
+            latency = metrics.latency
+            counters = metrics.counters
+            
+            self.stats_label.configure(text="\n".join([
+                f"Posts: {counters['success']} ok, {counters['failure']} failed, "
+                f"{counters['dead_lettered']} dead-lettered, {counters['rate_limited']} rate limited, "
+                f"{counters['unchanged']} unchanged edits skipped",
+                f"Latency: p50 {format_ms(latency.percentile(0.5))}, p95 {format_ms(latency.percentile(0.95))}, "
+                f"p99 {format_ms(latency.percentile(0.99))}",
+                f"Outbox depth: {metrics.queue_depth}    Scheduler lag: {format_ms(metrics.scheduler_lag)} "
+                f"(max {format_ms(metrics.max_scheduler_lag)})"
+            ]))
             
-            # Wait for the next posting cycle
-            for i in range(60):  # Check every second for 60 seconds
-                if not self.auto_posting:
-                    break
-                    
-                remaining = 60 - i
-                self.after(0, lambda: self.next_post_label.configure(
-                    text=f"Next post in: {remaining}s"
-                ))
-                time.sleep(1)
+            slowest = sorted(
+                metrics.channels.items(),
+                key=lambda item: item[1].percentile(0.95) or 0,
+                reverse=True
+            )[:STATS_TOP_CHANNELS]
+            lines = [f"{'Channel':<24}{'Posts':>8}{'p50':>10}{'p95':>10}{'p99':>10}"]
+            for key, histogram in slowest:
+                lines.append(
+                    f"{str(metrics.labels.get(key, key))[:23]:<24}{histogram.count:>8}"
+                    f"{format_ms(histogram.percentile(0.5)):>10}{format_ms(histogram.percentile(0.95)):>10}"
+                    f"{format_ms(histogram.percentile(0.99)):>10}"
+                )
+            text = "\n".join(lines)
+            if text != self.stats_shown:
+                self.stats_shown = text
+                self.stats_text.config(state="normal")
+                self.stats_text.delete("1.0", "end")
+                self.stats_text.insert("1.0", text)
+                self.stats_text.config(state="disabled")
+        self.after(STATS_REFRESH_MS, self.update_stats)
+    
+    def export_metrics(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension=".prom",
+            filetypes=[("Prometheus text", "*.prom"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            self.core.export_metrics(path)
+            self.log(f"Exported metrics to {path}")
+        except OSError as e:
+            messagebox.showerror("Export Metrics", str(e))
     
     def log(self, message):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        self.logs.append(log_entry)
-        
-        # Update log text widget
-        self.log_text.config(state="normal")
-        self.log_text.insert("end", log_entry + "\n")
-        self.log_text.see("end")
-        self.log_text.config(state="disabled")
+        # Safe to call from any thread; the widget is only touched in pump_logs
+        self.log_pipeline.write(message)
+    
+    def pump_logs(self):
+        batch = self.log_pipeline.drain()
+        if batch:
+            self.log_text.config(state="normal")
+            self.log_text.insert("end", "\n".join(batch) + "\n")
+            
+            # Keep the widget to the same number of lines as the ring buffer
+            line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+            excess = line_count - self.log_pipeline.max_lines
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            
+            self.log_text.see("end")
+            self.log_text.config(state="disabled")
+        self.after(LOG_FLUSH_MS, self.pump_logs)
     
     def clear_logs(self):
-        self.logs = []
+        self.log_pipeline.clear()
         self.log_text.config(state="normal")
         self.log_text.delete("1.0", "end")
         self.log_text.config(state="disabled")
         self.log("Logs cleared")
     
     def save_data(self):
-        data = {
-            "bot_token": self.bot_token,
-            "channels": self.channels
-        }
-        
-        try:
-            with open("discord_auto_poster.json", "w") as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            self.log(f"Error saving data: {e}")
+        self.core.save_data()
     
     def load_data(self):
-        if os.path.exists("discord_auto_poster.json"):
-            try:
-                with open("discord_auto_poster.json", "r") as f:
-                    data = json.load(f)
-                    self.bot_token = data.get("bot_token", "")
-                    self.channels = data.get("channels", [])
-            except Exception as e:
-                self.log(f"Error loading data: {e}")
-        
-        # Ensure we have at least one channel
-        if not self.channels:
-            self.channels = [{
-                "channel_id": "",
-                "user_id": "",
-                "webhook_url": "",
-                "message": "",
-                "interval": 3600
-            }]
+        self.core.load_data()
     
     def on_closing(self):
         self.save_data()
+        self.core.close()
+        self.log_pipeline.close_file()
         self.destroy()
 
 if __name__ == "__main__":
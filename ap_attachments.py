@@ -0,0 +1,168 @@
+import hashlib
+import mimetypes
+import os
+import secrets
+import time
+
+# Bytes read from a file and handed to the socket per write; also the most
+# any one upload ever holds in Python memory at a time
+CHUNK_SIZE = 256 * 1024
+# Files nobody has posted for this long are forgotten
+IDLE_TIMEOUT = 300.0
+MAX_ATTACHMENTS = 10
+
+
+def parse_attachments(text):
+    # "a.png; b.pdf" as typed into the channel editor
+    return [path.strip() for path in (text or "").split(";") if path.strip()][:MAX_ATTACHMENTS]
+
+
+class AttachmentFile:
+    # One file as it was when it was hashed: size, mtime and a hash of its
+    # contents. Its part headers are encoded once per form field index and
+    # file name and reused by every post that sends the file (or a file
+    # with the same contents).
+    
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.headers = {}
+        digest = hashlib.sha256()
+        for chunk in self.chunks():
+            digest.update(chunk)
+        self.digest = digest.hexdigest()
+    
+    def matches(self, stat):
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime
+    
+    def part_header(self, boundary, index, name):
+        key = (boundary, index, name)
+        header = self.headers.get(key)
+        if header is None:
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            filename = name.replace('"', "%22").replace("\r", "").replace("\n", "")
+            header = self.headers[key] = (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="files[{index}]"; filename="{filename}"\r\n'
+                f"Content-Type: {content_type}\r\n\r\n"
+            ).encode("utf-8")
+        return header
+    
+    def chunks(self):
+        # Read, not memory-mapped: a mapped file truncated under an upload
+        # kills the process with SIGBUS. A file that is rewritten before or
+        # during the upload fails the post instead (to be retried with the
+        # new contents) rather than sending bytes that don't match the size
+        # already promised in Content-Length.
+        with open(self.path, "rb") as f:
+            if not self.matches(os.fstat(f.fileno())):
+                raise OSError(f"{self.path} changed since it was queued")
+            remaining = self.size
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise OSError(f"{self.path} was truncated while it was being sent")
+                remaining -= len(chunk)
+                yield chunk
+            if not self.matches(os.fstat(f.fileno())):
+                raise OSError(f"{self.path} changed while it was being sent")
+
+
+class AttachmentCache:
+    # AttachmentFiles by path. A file is re-hashed only when its size or
+    # mtime changes, and files whose contents hash the same share their part
+    # headers, so a picture posted by a thousand channels is hashed and has
+    # its part headers encoded exactly once.
+    
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        # One boundary for every body this cache builds, so part headers can
+        # be shared between posts
+        self.boundary = secrets.token_hex(16)
+        self.by_path = {}
+        self.by_digest = {}
+    
+    def get(self, path):
+        stat = os.stat(path)
+        attachment = self.by_path.get(path)
+        if attachment is not None and attachment.matches(stat):
+            attachment.last_used = time.monotonic()
+            return attachment
+        attachment = AttachmentFile(path, stat)
+        key = (attachment.digest, attachment.size)
+        headers = self.by_digest.get(key)
+        if headers is not None:
+            attachment.headers = headers
+        else:
+            self.by_digest[key] = attachment.headers
+        self.by_path[path] = attachment
+        return attachment
+    
+    def prune(self):
+        # Forgets files that are no longer posted (and not being uploaded)
+        cutoff = time.monotonic() - self.idle_timeout
+        in_use = set()
+        for path, attachment in list(self.by_path.items()):
+            if attachment.last_used < cutoff and not attachment.users:
+                del self.by_path[path]
+            else:
+                in_use.add((attachment.digest, attachment.size))
+        for key in list(self.by_digest):
+            if key not in in_use:
+                del self.by_digest[key]
+    
+    def close(self):
+        self.by_path.clear()
+        self.by_digest.clear()
+
+
+class MultipartBody:
+    # multipart/form-data request body for Discord: the JSON payload as
+    # payload_json followed by files[n]. It is never joined into one bytes
+    # object; the connection writes it chunk by chunk as the files are read.
+    
+    def __init__(self, payload, files, boundary):
+        # `files` is a list of (file name, AttachmentFile)
+        self.boundary = boundary
+        self.files = [attachment for _, attachment in files]
+        self.parts = []
+        self.parts.append((
+            f"--{self.boundary}\r\n"
+            'Content-Disposition: form-data; name="payload_json"\r\n'
+            "Content-Type: application/json\r\n\r\n"
+        ).encode("utf-8") + payload + b"\r\n")
+        for index, (name, attachment) in enumerate(files):
+            self.parts.append(attachment.part_header(self.boundary, index, name))
+            self.parts.append(attachment)
+            self.parts.append(b"\r\n")
+        self.parts.append(f"--{self.boundary}--\r\n".encode("utf-8"))
+        self.length = sum(part.size if isinstance(part, AttachmentFile) else len(part) for part in self.parts)
+        for attachment in self.files:
+            attachment.users += 1
+    
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+    
+    def __len__(self):
+        return self.length
+    
+    def chunks(self):
+        for part in self.parts:
+            if isinstance(part, AttachmentFile):
+                yield from part.chunks()
+            else:
+                yield part
+    
+    def release(self):
+        for attachment in self.files:
+            attachment.users -= 1
+        self.files = []
+
+
+def multipart_body(payload, paths, cache):
+    files = [(os.path.basename(path), cache.get(path)) for path in paths]
+    return MultipartBody(payload, files, cache.boundary)
@@ -0,0 +1,490 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Load test for the posting pipeline. A local stand-in for Discord's webhook
+# endpoint runs in this process; every channel-set size is posted by a fresh
+# child process that drives PosterCore exactly like start_auto_posting, so
+# CPU and peak RSS belong to the poster (and its worker processes) alone.
+# Every post carries the time it was queued, so the stub measures end-to-end
+# latency directly. Results are printed as JSON:
+#
+#   python ap_bench.py --channels 10,1000,100000 --duration 30 > bench_output.txt
+
+DEFAULT_SIZES = "10,100,1000,10000"
+STOP_TIMEOUT = 15.0
+QUEUED = re.compile(rb"queued (\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d+)")
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    # The poster hangs up mid-request when a run is stopped; that is no error
+    
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubWebhookServer:
+    # Answers POST /api/webhooks/<uid>/<token> like Discord would, after an
+    # optional delay. Every webhook is its own rate-limit bucket of
+    # `bucket_limit` requests per `bucket_window` seconds and says so in the
+    # X-RateLimit-* headers (channels in `throttled` get one request per
+    # `throttle_window`); past the limit it answers 429, as it does for
+    # everything over `global_limit` requests per second (0 = no global
+    # limit). `rate_429`/`error_rate` add random 429s and 5xx on top. Every
+    # request is recorded as (uid, arrival time, status, global 429, time the
+    # post was queued or None).
+    
+    def __init__(self, latency=0.02, jitter=0.01, rate_429=0.0, error_rate=0.0, retry_after=0.25,
+                 bucket_limit=5, bucket_window=2.0, global_limit=0, throttled=(), throttle_window=60.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.throttled = set(throttled)
+        self.throttle_window = throttle_window
+        self.requests = []
+        self.buckets = {}
+        self.global_window = (0.0, 0)
+        self._lock = threading.Lock()
+        self.server = None
+    
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/webhooks"
+    
+    def start(self):
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                delay = stub.latency + random.uniform(-stub.jitter, stub.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                status, headers, body = stub.respond(self.path, payload)
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 128
+        threading.Thread(target=self.server.serve_forever, name="stub-webhooks", daemon=True).start()
+    
+    def respond(self, path, payload=b""):
+        # Rate limits first (a request over the global limit doesn't count
+        # against its bucket), then the random failures
+        uid = self._uid(path)
+        queued = self._queued(payload)
+        now = time.time()
+        with self._lock:
+            window, count = self.global_window
+            if now >= window + 1:
+                window, count = now, 0
+            if self.global_limit and count >= self.global_limit:
+                retry_after = round(window + 1 - now, 3)
+                self.requests.append((uid, now, 429, True, queued))
+                return 429, [("Retry-After", str(retry_after)), ("X-RateLimit-Global", "true"),
+                             ("X-RateLimit-Scope", "global")], self._limited(retry_after, True)
+            self.global_window = (window, count + 1)
+            
+            if uid in self.throttled:
+                limit, length = 1, self.throttle_window
+            else:
+                limit, length = self.bucket_limit, self.bucket_window
+            remaining, reset_at = self.buckets.get(path, (limit, 0.0))
+            if now >= reset_at:
+                remaining, reset_at = limit, now + length
+            if remaining <= 0:
+                status = 429
+            else:
+                remaining -= 1
+                roll = random.random()
+                status = 429 if roll < self.rate_429 else 500 if roll < self.rate_429 + self.error_rate else 204
+            self.buckets[path] = (remaining, reset_at)
+            self.requests.append((uid, now, status, False, queued))
+        
+        reset_after = round(reset_at - now, 3)
+        headers = [
+            ("X-RateLimit-Bucket", f"{zlib.crc32(path.encode()):08x}"),
+            ("X-RateLimit-Limit", str(limit)),
+            ("X-RateLimit-Remaining", str(remaining)),
+            ("X-RateLimit-Reset", f"{reset_at:.3f}"),
+            ("X-RateLimit-Reset-After", str(reset_after))
+        ]
+        if status == 429:
+            retry_after = reset_after if remaining <= 0 else self.retry_after
+            headers += [("Retry-After", str(retry_after)), ("X-RateLimit-Scope", "user")]
+            return status, headers, self._limited(retry_after, False)
+        if status == 500:
+            return status, headers, b'{"message": "Internal Server Error"}'
+        return status, headers, b""
+    
+    @staticmethod
+    def _uid(path):
+        parts = path.split("/")
+        return int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else None
+    
+    @staticmethod
+    def _queued(payload):
+        match = QUEUED.search(payload)
+        return datetime.fromisoformat(match.group(1).decode()).timestamp() if match else None
+    
+    @staticmethod
+    def _limited(retry_after, is_global):
+        return json.dumps({"message": "You are being rate limited.", "retry_after": retry_after,
+                           "global": is_global}).encode("utf-8")
+    
+    def take(self):
+        with self._lock:
+            requests, self.requests = self.requests, []
+        return requests
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def synthetic_channels(count, base_url, interval):
+    return [
+        {
+            "uid": uid,
+            "channel_id": str(100000000000000000 + uid),
+            "user_id": "",
+            "webhook_url": f"{base_url}/{uid}/bench-token",
+            "message": "Benchmark post {counter} queued {timestamp}",
+            "interval": interval
+        }
+        for uid in range(1, count + 1)
+    ]
+
+
+def run_case(case):
+    # Runs in a child process: loads a synthetic config through the normal
+    # import path, starts posting and reports what the core measured
+    from ap_core import PosterCore
+    from ap_daemon import peak_rss_mb
+    
+    path = os.path.join(case["directory"], "bench.json")
+    with open(path, "w") as f:
+        json.dump({
+            "max_concurrency": case["concurrency"],
+            "worker_processes": case["workers"],
+            "channels": synthetic_channels(case["channels"], case["base_url"], case["interval"])
+        }, f)
+    
+    core = PosterCore(path=path, log=lambda message: None)
+    try:
+        loaded = time.perf_counter()
+        core.load_data()
+        load_seconds = time.perf_counter() - loaded
+        
+        cpu_start = time.process_time()
+        started = time.time()
+        # Worker processes inherit an ignored SIGINT, so a Ctrl-C doesn't
+        # kill them under the poster; close() below stops them instead
+        handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            core.start()
+        finally:
+            signal.signal(signal.SIGINT, handler)
+        time.sleep(case["duration"])
+        metrics = core.metrics()
+        core.stop()
+        stopped = time.time()
+        cpu_seconds = time.process_time() - cpu_start
+    finally:
+        core.close()
+    
+    # Worker processes have been joined by stop(), so their CPU time and
+    # peak RSS are in this process' RUSAGE_CHILDREN by now
+    workers = children_usage()
+    return {
+        "started": started,
+        "stopped": stopped,
+        "load_seconds": load_seconds,
+        "cpu_seconds": cpu_seconds + (workers[0] if workers else 0),
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_peak_rss_mb": workers[1] if workers and case["workers"] > 1 else None,
+        "counters": dict(metrics.counters),
+        "send_latency_p99": metrics.latency.percentile(0.99),
+        "scheduler_lag": metrics.scheduler_lag,
+        "max_scheduler_lag": metrics.max_scheduler_lag,
+        "outbox_depth": metrics.queue_depth
+    }
+
+
+def children_usage():
+    # (CPU seconds, largest peak RSS in MB) of the waited-for child processes
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    rss = usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+    return usage.ru_utime + usage.ru_stime, rss
+
+
+def run_case_child(case, connection):
+    # Entry point of the child process. A plain Process rather than a Pool
+    # worker: Pool workers are daemonic and may not start the worker
+    # processes a --workers run needs.
+    try:
+        connection.send(("ok", run_case(case)))
+    except KeyboardInterrupt:
+        # The parent got the Ctrl-C too and reports it
+        pass
+    except BaseException as e:
+        try:
+            connection.send(("error", f"{e.__class__.__name__}: {e}"))
+        except OSError:
+            pass
+        raise
+    finally:
+        connection.close()
+
+
+def run_isolated(context, case):
+    # The run's files live in a directory of ours, so they are gone even when
+    # the child is interrupted or killed
+    directory = tempfile.mkdtemp(prefix="ap_bench_")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case_child, args=(dict(case, directory=directory), sender))
+    try:
+        process.start()
+        # Only the child holds the sending end now, so recv() sees EOF if it dies
+        sender.close()
+        try:
+            outcome, value = receiver.recv()
+        except EOFError:
+            outcome, value = "error", None
+    finally:
+        receiver.close()
+        if process.pid is not None:
+            # A Ctrl-C reaches the child too; give it time to stop its workers
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        shutil.rmtree(directory, ignore_errors=True)
+    if outcome != "ok":
+        raise RuntimeError(f"Benchmark of {case['channels']} channels failed: {value or f'exit code {process.exitcode}'}")
+    return value
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+def to_ms(value):
+    return None if value is None else round(value * 1000, 2)
+
+
+def summarize(case, result, requests):
+    # End-to-end latency runs from the time a post was queued (stamped into
+    # its message) to the stub's answer that it was delivered
+    started = result["started"]
+    interval = case["interval"]
+    delivered = [request for request in requests if 200 <= request[2] < 300]
+    end_to_end = [arrival - queued for uid, arrival, status, is_global, queued in delivered if queued is not None]
+    delivered = [request[1] for request in delivered]
+    elapsed = result["stopped"] - started
+    first_round = sorted(arrival for arrival in delivered if arrival - started < interval)
+    return {
+        "channels": case["channels"],
+        "workers": case["workers"],
+        "concurrency": case["concurrency"],
+        "duration_s": round(elapsed, 3),
+        "requests": len(requests),
+        "delivered": len(delivered),
+        "rate_limited": sum(1 for request in requests if request[2] == 429 and not request[3]),
+        "global_rate_limited": sum(1 for request in requests if request[3]),
+        "server_errors": sum(1 for request in requests if request[2] >= 500),
+        "throughput_per_s": round(len(delivered) / elapsed, 2) if elapsed > 0 else None,
+        "first_round_drain_s": round(first_round[-1] - started, 3) if first_round else None,
+        "first_round_complete": len(first_round) >= case["channels"],
+        "e2e_latency_ms": {
+            "p50": to_ms(percentile(end_to_end, 0.5)),
+            "p95": to_ms(percentile(end_to_end, 0.95)),
+            "p99": to_ms(percentile(end_to_end, 0.99)),
+            "max": to_ms(max(end_to_end) if end_to_end else None)
+        },
+        "send_latency_p99_ms": to_ms(result["send_latency_p99"]),
+        "scheduler_drift_ms": {
+            "last": to_ms(result["scheduler_lag"]),
+            "max": to_ms(result["max_scheduler_lag"])
+        },
+        "outbox_depth_at_stop": result["outbox_depth"],
+        "load_s": round(result["load_seconds"], 3),
+        "cpu_s": round(result["cpu_seconds"], 3),
+        "cpu_percent": round(100 * result["cpu_seconds"] / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_mb": None if result["peak_rss_mb"] is None else round(result["peak_rss_mb"], 1),
+        "worker_peak_rss_mb": None if result["worker_peak_rss_mb"] is None else round(result["worker_peak_rss_mb"], 1),
+        "poster_counters": result["counters"],
+        "isolation": isolation(case, requests, elapsed) if case["throttled"] else None
+    }
+
+
+def isolation(case, requests, elapsed):
+    # With a few channels throttled to one post per throttle window, every
+    # other channel should still post on every slot (give or take the one in
+    # flight at stop); a limiter that lets one bucket stall the queue or the
+    # connection slots fails this. The throttled channels should wait out
+    # their bucket rather than run into 429s.
+    throttled = set(case["throttled"])
+    delivered = {uid: 0 for uid in range(1, case["channels"] + 1)}
+    throttled_429 = 0
+    for uid, arrival, status, is_global, queued in requests:
+        if 200 <= status < 300 and uid in delivered:
+            delivered[uid] += 1
+        elif status == 429 and uid in throttled:
+            throttled_429 += 1
+    others = [count for uid, count in delivered.items() if uid not in throttled]
+    expected = int(elapsed // case["interval"])
+    return {
+        "throttled_channels": sorted(throttled),
+        "throttled_delivered": sum(delivered[uid] for uid in throttled if uid in delivered),
+        "throttled_429": throttled_429,
+        "others_expected": expected,
+        "others_min_delivered": min(others) if others else None,
+        "ok": all(count >= expected for count in others)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the auto-poster against a local webhook stub")
+    parser.add_argument("--channels", default=DEFAULT_SIZES, help="comma-separated channel counts (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to post for at each size")
+    parser.add_argument("--interval", type=int, default=10, help="posting interval of every channel, in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="max concurrent posts")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="stub response delay")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="random +/- added to the delay")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--bucket-limit", type=int, default=5, help="requests per bucket window of every webhook")
+    parser.add_argument("--bucket-window", type=float, default=2.0, help="length of a webhook's bucket window, in seconds")
+    parser.add_argument("--global-limit", type=int, default=0, help="requests per second over all webhooks (0: no global limit)")
+    parser.add_argument("--throttle", type=int, default=0,
+                        help="throttle this many channels to one post per --throttle-window and check that the "
+                             "others still post on time (exit code 1 if not)")
+    parser.add_argument("--throttle-window", type=float, default=60.0, help="bucket window of throttled channels")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.channels.split(",") if size.strip()]
+    
+    stub = StubWebhookServer(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429,
+        error_rate=args.error_rate,
+        bucket_limit=args.bucket_limit,
+        bucket_window=args.bucket_window,
+        global_limit=args.global_limit,
+        throttled=range(1, args.throttle + 1),
+        throttle_window=args.throttle_window
+    )
+    stub.start()
+    context = multiprocessing.get_context("spawn")
+    
+    runs = []
+    try:
+        for size in sizes:
+            case = {
+                "channels": size,
+                "duration": args.duration,
+                "interval": args.interval,
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+                "throttled": list(range(1, min(args.throttle, size) + 1)),
+                "base_url": stub.base_url
+            }
+            print(f"Benchmarking {size} channels...", file=sys.stderr)
+            stub.take()
+            result = run_isolated(context, case)
+            runs.append(summarize(case, result, stub.take()))
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+        return 130
+    finally:
+        stub.stop()
+    
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stub": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "rate_429": args.rate_429,
+            "error_rate": args.error_rate,
+            "bucket_limit": args.bucket_limit,
+            "bucket_window_s": args.bucket_window,
+            "global_limit": args.global_limit,
+            "throttle_window_s": args.throttle_window
+        },
+        "runs": runs
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if any(run["isolation"] and not run["isolation"]["ok"] for run in runs):
+        print("A throttled channel held back the others", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
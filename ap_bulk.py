@@ -0,0 +1,161 @@
+import csv
+import itertools
+import json
+import os
+import re
+
+from ap_attachments import MAX_ATTACHMENTS, parse_attachments
+from ap_scheduler import MIN_INTERVAL
+
+# Columns of the CSV format (and keys of each JSONL object), in export order
+FIELDS = ("channel_id", "user_id", "webhook_url", "message", "interval", "edit_in_place", "token", "attachments")
+TRUE_VALUES = {"1", "true", "yes", "y"}
+BATCH_SIZE = 5000
+# Errors kept for the report; the rest are only counted
+MAX_ERRORS = 100
+
+SNOWFLAKE = re.compile(r"^\d{15,21}$")
+WEBHOOK_URL = re.compile(r"^https?://[^/\s]+(?:/api(?:/v\d+)?)?/webhooks/\d+/[\w-]+/?$")
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.channels = {}
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+    
+    def error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"line {line}: {message}")
+    
+    def summary(self):
+        text = f"{len(self.channels)} channels from {self.rows} rows"
+        if self.duplicates:
+            text += f", {self.duplicates} duplicates merged"
+        if self.invalid:
+            text += f", {self.invalid} invalid rows skipped"
+        return text
+
+
+def file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    return "csv"
+
+
+def iter_rows(path):
+    # Yields (line number, dict) one row at a time; the file is never read
+    # into memory as a whole
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if file_format(path) == "jsonl":
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, e
+                    continue
+                yield number, row if isinstance(row, dict) else ValueError("not a JSON object")
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def _attachments(value):
+    # A list in JSONL, "a.png;b.png" in CSV
+    if isinstance(value, list):
+        return [str(path) for path in value if path][:MAX_ATTACHMENTS]
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"invalid attachments {value!r}")
+    return parse_attachments(value)
+
+
+def _row(channel):
+    row = {field: channel.get(field, "") for field in FIELDS}
+    row["attachments"] = channel.get("attachments") or []
+    return row
+
+
+def _clean(row):
+    # Normalises one raw row into a channel dict, or raises ValueError
+    if isinstance(row, Exception):
+        raise ValueError(str(row))
+    channel_id = str(row.get("channel_id") or "").strip()
+    user_id = str(row.get("user_id") or "").strip()
+    webhook_url = str(row.get("webhook_url") or "").strip()
+    if not SNOWFLAKE.match(channel_id):
+        raise ValueError(f"invalid channel_id {channel_id!r}")
+    if user_id and not SNOWFLAKE.match(user_id):
+        raise ValueError(f"invalid user_id {user_id!r}")
+    if webhook_url and not WEBHOOK_URL.match(webhook_url):
+        raise ValueError("invalid webhook_url")
+    interval = row.get("interval")
+    try:
+        interval = int(interval) if interval not in (None, "") else 3600
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid interval {interval!r}")
+    if interval < MIN_INTERVAL:
+        raise ValueError(f"interval must be at least {MIN_INTERVAL}s")
+    token = row.get("token")
+    try:
+        token = int(token) if token not in (None, "") else 0
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid token number {token!r}")
+    return {
+        "channel_id": channel_id,
+        "user_id": user_id,
+        "webhook_url": webhook_url,
+        "message": str(row.get("message") or "").replace("\r\n", "\n"),
+        "interval": interval,
+        "edit_in_place": str(row.get("edit_in_place") or "").strip().lower() in TRUE_VALUES,
+        "token": max(token, 0),
+        "attachments": _attachments(row.get("attachments"))
+    }
+
+
+def read_channels(path, batch_size=BATCH_SIZE):
+    # Parses and validates a CSV/JSONL file in batches. Rows are keyed by
+    # channel_id, so a channel listed twice keeps its last row.
+    result = ImportResult()
+    rows = iter_rows(path)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        result.rows += len(batch)
+        for number, row in batch:
+            try:
+                channel = _clean(row)
+            except ValueError as e:
+                result.error(number, e)
+                continue
+            if channel["channel_id"] in result.channels:
+                result.duplicates += 1
+            result.channels[channel["channel_id"]] = channel
+    return result
+
+
+def write_channels(path, channels):
+    # Streams channels out row by row, to a temp file that replaces `path`
+    # only once it is complete
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as f:
+        if file_format(path) == "jsonl":
+            for channel in channels:
+                f.write(json.dumps(_row(channel)) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for channel in channels:
+                row = _row(channel)
+                row["attachments"] = ";".join(row["attachments"])
+                writer.writerow(row)
+    os.replace(temp_path, path)
+    return len(channels)
@@ -0,0 +1,358 @@
+import os
+
+from ap_store import ChannelStore, database_path
+from ap_templates import PayloadCache
+
+DATA_FILE = "discord_auto_poster.json"
+DEFAULT_INTERVAL = 3600
+DEFAULT_CONCURRENCY = 8
+DEFAULT_WORKERS = 1
+DEFAULT_METRICS_PORT = 0
+
+
+def new_channel():
+    return {
+        "channel_id": "",
+        "user_id": "",
+        "webhook_url": "",
+        "message": "",
+        "interval": DEFAULT_INTERVAL
+    }
+
+
+class PosterCore:
+    # Everything the auto-poster needs to run, without any UI: the saved
+    # settings, the channel list and the delivery engine. The Tk app and the
+    # headless daemon both drive one of these.
+    
+    def __init__(self, path=DATA_FILE, log=print, warn=None):
+        # `path` is the legacy JSON file; the live data sits next to it in
+        # an SQLite database and the JSON is only read once to import it.
+        # Problems are reported through `warn` (by default `log` too).
+        self.path = path
+        self.log = log
+        self.warn = warn or log
+        self.store = ChannelStore(database_path(path), log=log, warn=self.warn)
+        self.outbox_path = database_path(path)
+        self.bot_tokens = []
+        self.max_concurrency = DEFAULT_CONCURRENCY
+        self.worker_processes = DEFAULT_WORKERS
+        self.log_file = ""
+        self.snippets = {}
+        self.metrics_port = DEFAULT_METRICS_PORT
+        self.exporter = None
+        self.channels = []
+        self._by_uid = {}
+        self.payloads = PayloadCache()
+        self._engine = None
+        self.supervisor = None
+        # Totals of sharded runs that have been stopped (the single-process
+        # engine keeps its own), so exported counters never reset
+        self._past_metrics = None
+    
+    @property
+    def engine(self):
+        # asyncio/ssl are only pulled in once something is actually posted
+        if self._engine is None:
+            from ap_http import DeliveryEngine
+            from ap_outbox import Outbox
+            self._engine = DeliveryEngine(
+                log=self.log,
+                warn=self.warn,
+                concurrency=self.max_concurrency,
+                payloads=self.payloads,
+                outbox=Outbox(self.outbox_path),
+                on_message=self._on_message,
+                tokens=self.bot_tokens
+            )
+        return self._engine
+    
+    @property
+    def running(self):
+        if self.supervisor is not None:
+            return self.supervisor.running
+        return self._engine is not None and self._engine.running
+    
+    def set_concurrency(self, value):
+        try:
+            self.max_concurrency = max(1, int(value))
+        except (TypeError, ValueError):
+            self.max_concurrency = DEFAULT_CONCURRENCY
+        # Takes effect the next time auto-posting is started
+        if self._engine is not None:
+            self._engine.concurrency = self.max_concurrency
+    
+    def set_workers(self, value):
+        try:
+            workers = max(1, int(value))
+        except (TypeError, ValueError):
+            workers = DEFAULT_WORKERS
+        if workers == self.worker_processes:
+            return
+        self.worker_processes = workers
+        if not self.running:
+            return
+        if self.supervisor is not None and workers > 1:
+            # A running sharded poster only moves the channels whose shard changed
+            self.supervisor.resize(workers, self.channels)
+        else:
+            # Between one process and several: a restart, which hands the
+            # queued posts and due times over to the new mode
+            self.stop()
+            self.start()
+    
+    def add_channel(self):
+        channel = new_channel()
+        self.channels.append(channel)
+        self.store.put_channel(channel)
+        self.sync()
+        return channel
+    
+    def remove_channel(self, index=-1):
+        channel = self.channels.pop(index)
+        self._by_uid.pop(channel.get("uid"), None)
+        self.store.delete_channel(channel)
+        self.payloads.forget(channel)
+        self.sync()
+        return channel
+    
+    def save_channel(self, channel):
+        # Compile the message template now rather than on the first post
+        self.payloads.compile(channel)
+        self.store.put_channel(channel)
+        self.sync()
+    
+    def _on_message(self, uid, message_id, message_hash):
+        # Called from the delivery thread (or the supervisor's monitor) when
+        # an edit-in-place channel got a new message to edit; saving it with
+        # the channel means a restart edits that message instead of posting
+        channel = self._by_uid.get(uid)
+        if channel is None:
+            self._by_uid = {channel.get("uid"): channel for channel in self.channels}
+            channel = self._by_uid.get(uid)
+            if channel is None:
+                return
+        channel["message_id"] = message_id
+        channel["message_hash"] = message_hash
+        self.store.put_channel(channel)
+    
+    def import_channels(self, result):
+        # Merges an ap_bulk.ImportResult: channels whose channel_id already
+        # exists are updated in place (keeping their uid and schedule), the
+        # rest are appended. One store transaction and one scheduler sync.
+        existing = {channel.get("channel_id"): channel for channel in self.channels if channel.get("channel_id")}
+        changed = []
+        added = 0
+        for channel_id, row in result.channels.items():
+            channel = existing.get(channel_id)
+            if channel is None:
+                channel = row
+                self.channels.append(channel)
+                added += 1
+            else:
+                channel.update(row)
+            changed.append(channel)
+        self.store.put_channels(changed)
+        self.sync()
+        return added, len(changed) - added
+    
+    def export_channels(self, path):
+        from ap_bulk import write_channels
+        return write_channels(path, self.channels)
+    
+    def test_connection(self):
+        # Runs on the engine's loop, so the connections it opens are the
+        # ones auto-posting picks up when it is started. Returns a future
+        # of DeliveryEngine.probe results.
+        return self.engine.submit(self.engine.probe(self.channels))
+    
+    def test_post(self, channel):
+        # Posts `channel` once, now; returns a future of the response (None
+        # if it could not be sent)
+        return self.engine.submit(self.engine.deliver(channel))
+    
+    def settings(self):
+        return {
+            "bot_tokens": self.bot_tokens,
+            # Read by versions that only knew a single token
+            "bot_token": self.bot_tokens[0] if self.bot_tokens else "",
+            "max_concurrency": self.max_concurrency,
+            "worker_processes": self.worker_processes,
+            "log_file": self.log_file,
+            "snippets": self.snippets,
+            "metrics_port": self.metrics_port
+        }
+    
+    def apply_settings(self, data):
+        tokens = data.get("bot_tokens")
+        if tokens is None:
+            tokens = [data["bot_token"]] if data.get("bot_token") else []
+        self.set_tokens(tokens)
+        self.set_concurrency(data.get("max_concurrency", DEFAULT_CONCURRENCY))
+        self.set_workers(data.get("worker_processes", DEFAULT_WORKERS))
+        self.log_file = data.get("log_file", "")
+        self.set_snippets(data.get("snippets", {}))
+        self.set_metrics_port(data.get("metrics_port", DEFAULT_METRICS_PORT))
+    
+    def set_tokens(self, tokens):
+        self.bot_tokens = list(tokens)
+        if self._engine is not None:
+            self._engine.set_tokens(self.bot_tokens)
+        if self.supervisor is not None and self.supervisor.running:
+            self.supervisor.set_tokens(self.bot_tokens)
+    
+    def set_snippets(self, snippets):
+        self.snippets = dict(snippets)
+        self.payloads.set_snippets(self.snippets)
+        if self.supervisor is not None and self.supervisor.running:
+            self.supervisor.set_snippets(self.snippets)
+    
+    def set_metrics_port(self, value):
+        # 0 turns the Prometheus endpoint off
+        try:
+            port = max(0, int(value))
+        except (TypeError, ValueError):
+            port = DEFAULT_METRICS_PORT
+        if port == self.metrics_port and (self.exporter is not None or not port):
+            return
+        self.metrics_port = port
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
+        if port:
+            from ap_metrics import MetricsExporter
+            exporter = MetricsExporter(self.metrics, port)
+            try:
+                exporter.start()
+            except OSError as e:
+                self.warn(f"Could not serve metrics on port {port}: {e}")
+                return
+            self.exporter = exporter
+            self.log(f"Serving metrics on http://127.0.0.1:{exporter.port}/metrics")
+    
+    def metrics(self):
+        from ap_metrics import Metrics
+        if self.supervisor is not None:
+            metrics = self.supervisor.metrics()
+            if self._past_metrics is not None:
+                metrics.add(self._past_metrics.snapshot(full=True))
+            return metrics
+        if self._engine is not None:
+            # A copy built on the engine loop; the live one keeps changing
+            # while the UI or the exporter reads it
+            snapshot = self._engine.metrics_snapshot(full=True)
+            return Metrics.merged([snapshot], self._past_metrics)
+        return Metrics.merged([], self._past_metrics)
+    
+    def export_metrics(self, path):
+        from ap_metrics import write_prometheus_file
+        write_prometheus_file(path, self.metrics())
+    
+    def save_settings(self):
+        self.store.put_settings(self.settings())
+    
+    def start(self):
+        if self.worker_processes > 1:
+            from ap_outbox import read_schedule
+            from ap_supervisor import Supervisor
+            # Whatever the single-process engine still has queued goes to
+            # the shards that own those channels
+            rows = self.engine.hand_off()
+            settings = dict(self.settings(), outbox_path=self.outbox_path)
+            self.supervisor = Supervisor(self.worker_processes, settings, log=self.log, on_message=self._on_message,
+                                         warn=self.warn)
+            self.supervisor.start(self.channels, rows, read_schedule(self.outbox_path))
+        else:
+            from ap_outbox import drain_outbox, merge_schedule, shard_paths
+            # Posts and due times a sharded run left in its shard files
+            rows, schedule = [], {}
+            for path in shard_paths(self.outbox_path).values():
+                shard_rows, shard_due = drain_outbox(path)
+                rows += shard_rows
+                merge_schedule(schedule, shard_due)
+            self.engine.start(self.channels, schedule)
+            if rows:
+                self.engine.adopt(rows)
+    
+    def stop(self):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+            self._past_metrics = self.metrics()
+            self.supervisor = None
+        if self._engine is not None:
+            self._engine.stop()
+    
+    def sync(self):
+        # Only a running poster keeps a schedule; starting rebuilds it anyway
+        if not self.running:
+            return
+        if self.supervisor is not None:
+            self.supervisor.sync(self.channels)
+        else:
+            self._engine.sync(self.channels)
+    
+    def status_text(self):
+        if self.supervisor is not None:
+            status = self.supervisor.status()
+            text = f"{status['alive']}/{status['workers']} workers, {status['channels']} channels"
+            if status["restarts"]:
+                text += f", {status['restarts']} restarts"
+            return text + self._token_text(status["tokens"])
+        text = f"{len(self.channels)} channels"
+        if self._engine is not None:
+            text += self._token_text(self._engine.tokens.distribution())
+        return text
+    
+    @staticmethod
+    def _token_text(distribution):
+        # Posts per bot token, e.g. " | #1: 120, #2: 118, #3: off"
+        if len(distribution) < 2 and not any(disabled for _, _, disabled in distribution):
+            return ""
+        parts = [
+            f"{label.replace('token ', '')}: {'off' if disabled else sent}"
+            for label, sent, disabled in distribution
+        ]
+        return " | tokens " + ", ".join(parts)
+    
+    def next_due_in(self):
+        if not self.running:
+            return None
+        if self.supervisor is not None:
+            return self.supervisor.status()["next_due_in"]
+        scheduler = self._engine.scheduler
+        next_due = scheduler.next_due()
+        if next_due is None:
+            return None
+        return max(next_due - scheduler.clock(), 0)
+    
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self._engine is not None:
+            self._engine.close()
+        self.store.close()
+    
+    def save_data(self):
+        # Writes whatever is still waiting for the debounced background commit
+        self.store.flush()
+    
+    def load_data(self):
+        try:
+            self.store.open()
+            if self.store.is_empty() and os.path.exists(self.path):
+                settings, channels = self.store.import_json(self.path)
+                self.log(f"Imported {len(channels)} channels from {self.path}")
+            else:
+                settings, channels = self.store.load()
+            self.apply_settings(settings)
+            self.channels = channels
+        except Exception as e:
+            self.warn(f"Error loading data: {e}")
+        
+        # Ensure we have at least one channel
+        if not self.channels:
+            self.channels = [new_channel()]
+            self.store.put_channel(self.channels[0])
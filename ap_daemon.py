@@ -0,0 +1,112 @@
+import time
+
+# Taken before the other imports on purpose: the startup time logged once
+# posting has started includes importing them
+STARTED = time.perf_counter()
+
+import argparse
+import logging
+import signal
+import sys
+import threading
+
+from ap_core import DATA_FILE, PosterCore
+from ap_logging import rotating_file_handler
+
+# Headless entry point for the auto-poster: same data file and engine as the
+# GUI, but no Tk. Nothing in here (or in ap_core) imports customtkinter, so
+# instances start fast and run on display-less servers.
+
+# Seconds between rewrites of --metrics-file
+METRICS_FILE_INTERVAL = 15
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Discord auto-poster without a GUI")
+    parser.add_argument("--config", default=DATA_FILE, help="channel/settings file (default: %(default)s)")
+    parser.add_argument("--log-file", help="write logs to this (rotated) file instead of stdout")
+    parser.add_argument("--concurrency", type=int, help="override the saved max concurrent posts")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-file", help="rewrite Prometheus metrics to this file every few seconds")
+    parser.add_argument("--import", dest="import_path", help="merge channels from a CSV/JSONL file before starting")
+    parser.add_argument("--export", dest="export_path", help="write all channels to a CSV/JSONL file and exit")
+    parser.add_argument("--quiet", action="store_true", help="only log warnings and errors")
+    return parser.parse_args(argv)
+
+
+def setup_logging(args):
+    handler = rotating_file_handler(args.log_file) if args.log_file else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    logger = logging.getLogger("ap")
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+    return logger
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger = setup_logging(args)
+    
+    core = PosterCore(path=args.config, log=logger.info, warn=logger.warning)
+    core.load_data()
+    if args.concurrency:
+        core.set_concurrency(args.concurrency)
+    if args.import_path:
+        from ap_bulk import read_channels
+        result = read_channels(args.import_path)
+        added, updated = core.import_channels(result)
+        logger.info(f"Imported {result.summary()}: {added} added, {updated} updated")
+        for error in result.errors:
+            logger.warning(f"Import skipped {error}")
+    if args.export_path:
+        count = core.export_channels(args.export_path)
+        logger.info(f"Exported {count} channels to {args.export_path}")
+        core.close()
+        return 0
+    if args.metrics_port is not None:
+        core.set_metrics_port(args.metrics_port)
+    
+    stopping = threading.Event()
+    
+    def request_stop(signum, frame):
+        stopping.set()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+    
+    core.start()
+    rss = peak_rss_mb()
+    logger.info(
+        f"Auto-posting started: {len(core.channels)} channels, "
+        f"startup {(time.perf_counter() - STARTED) * 1000:.0f} ms"
+        + (f", peak RSS {rss:.1f} MB" if rss is not None else "")
+    )
+    
+    # Wake up regularly so signals are handled promptly on every platform
+    ticks = 0
+    while not stopping.wait(1):
+        ticks += 1
+        if args.metrics_file and ticks % METRICS_FILE_INTERVAL == 0:
+            try:
+                core.export_metrics(args.metrics_file)
+            except OSError as e:
+                logger.warning(f"Could not write metrics file: {e}")
+    
+    logger.info("Auto-posting stopped")
+    core.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
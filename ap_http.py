@@ -0,0 +1,894 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import re
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from ap_attachments import AttachmentCache, multipart_body
+from ap_metrics import Metrics
+from ap_outbox import Outbox, merge_schedule
+from ap_ratelimit import RateLimiter, route_for
+from ap_scheduler import ChannelScheduler, channel_key
+from ap_templates import PayloadCache
+from ap_tokens import API_BASE, TokenPool, channel_messages_url, is_bot_url
+
+USER_AGENT = "DiscordBot (https://github.com/Leonia990/premscript, 1.0)"
+MAX_RATE_LIMIT_RETRIES = 5
+# Hosts whose cold connection (DNS + connect + TLS + first byte) takes
+# longer than this are flagged as slow by probe()
+SLOW_PROBE = 0.75
+# Most connections Test Connection pre-warms per host
+MAX_WARM = 8
+# Seconds before a failed outbox commit is tried again
+COMMIT_RETRY = 1.0
+JSON_HEADERS = {"Content-Type": "application/json"}
+MESSAGE_PATH = re.compile(r"/messages/\d+$")
+MESSAGE_ID = re.compile(r"/messages/(\d+)$")
+
+
+class HTTPError(Exception):
+    pass
+
+
+class HTTPResponse:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+    
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+    
+    def json(self):
+        return json.loads(self.body or b"null")
+
+
+class HTTPConnection:
+    # One HTTP/1.1 keep-alive socket. Requests on a connection are strictly
+    # sequential; the pool hands each connection to one caller at a time.
+    
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.first_byte_at = None
+        self.requests = 0
+    
+    @property
+    def usable(self):
+        return not self.reader.at_eof() and not self.writer.is_closing()
+    
+    async def request(self, method, host, target, headers, body):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, (bytes, bytearray)):
+            if body:
+                self.writer.write(body)
+        else:
+            # Streamed bodies (attachments): one chunk in flight at a time
+            for chunk in body.chunks():
+                self.writer.write(chunk)
+                await self.writer.drain()
+        await self.writer.drain()
+        
+        status_line = await self.reader.readline()
+        self.first_byte_at = time.perf_counter()
+        if not status_line:
+            raise ConnectionResetError("connection closed before response")
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise HTTPError(f"malformed status line: {status_line!r}")
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+        
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            response_body = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            response_body = await self._read_chunked()
+        elif "content-length" in response_headers:
+            response_body = await self.reader.readexactly(int(response_headers["content-length"]))
+        else:
+            response_body = await self.reader.read()
+            keep_alive = False
+        
+        self.last_used = time.monotonic()
+        self.requests += 1
+        return HTTPResponse(status, reason, response_headers, response_body), keep_alive
+    
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size_line = await self.reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip optional trailers up to the terminating blank line
+                while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+    
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    # Keeps warm HTTP/1.1 connections per (scheme, host, port) so that many
+    # webhooks on the same host share a handful of sockets instead of paying a
+    # TCP + TLS handshake for every post.
+    
+    def __init__(self, max_per_host=4, idle_timeout=60.0, connect_timeout=10.0):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = {}
+        self._slots = {}
+        self._ssl_context = None
+        self.opened = 0
+    
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        return slot
+    
+    def _ssl(self):
+        if self._ssl_context is None:
+            import ssl
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+    
+    async def _open(self, key):
+        scheme, host, port = key
+        ssl_context = self._ssl() if scheme == "https" else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host if ssl_context else None),
+            self.connect_timeout
+        )
+        self.opened += 1
+        return HTTPConnection(key, reader, writer)
+    
+    def _take_idle(self, key):
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            if conn.usable and now - conn.last_used < self.idle_timeout:
+                return conn
+            conn.close()
+        return None
+    
+    def _put_idle(self, conn):
+        idle = self._idle.setdefault(conn.key, [])
+        idle.append(conn)
+        # Probes can open more sockets than are ever in use at once; keep
+        # only the most recently used ones
+        while len(idle) > self.max_per_host:
+            idle.pop(0).close()
+    
+    @staticmethod
+    def _split(url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise HTTPError(f"unsupported URL: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        host = parts.netloc.rpartition("@")[2]
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        return key, host, target
+    
+    async def probe(self, url, headers=None, timeout=None):
+        # Opens a fresh connection to url's host, timing each phase (DNS,
+        # TCP connect, TLS handshake, first response byte of a GET of `url`),
+        # and leaves the connection in the pool for the next request.
+        # Returns a dict of phase -> seconds plus status or error.
+        timeout = timeout or self.connect_timeout
+        result = {"dns": None, "connect": None, "tls": None, "first_byte": None, "status": None, "error": None}
+        loop = asyncio.get_running_loop()
+        try:
+            key, host, target = self._split(url)
+            scheme, hostname, port = key
+            result["host"] = host
+            async with self._slot(key):
+                started = time.perf_counter()
+                addresses = await asyncio.wait_for(
+                    loop.getaddrinfo(hostname, port, type=socket.SOCK_STREAM), timeout
+                )
+                result["dns"] = time.perf_counter() - started
+                
+                family, kind, proto, _, address = addresses[0]
+                sock = socket.socket(family, kind, proto)
+                sock.setblocking(False)
+                try:
+                    started = time.perf_counter()
+                    await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+                    result["connect"] = time.perf_counter() - started
+                    
+                    ssl_context = self._ssl() if scheme == "https" else None
+                    started = time.perf_counter()
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(
+                            sock=sock, ssl=ssl_context, server_hostname=hostname if ssl_context else None
+                        ),
+                        timeout
+                    )
+                    if ssl_context is not None:
+                        result["tls"] = time.perf_counter() - started
+                except BaseException:
+                    sock.close()
+                    raise
+                conn = HTTPConnection(key, reader, writer)
+                self.opened += 1
+                
+                request_headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+                request_headers.update(headers or {})
+                started = time.perf_counter()
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        conn.request("GET", host, target, request_headers, b""), timeout
+                    )
+                except BaseException:
+                    conn.close()
+                    raise
+                result["first_byte"] = conn.first_byte_at - started
+                result["status"] = response.status
+                if keep_alive:
+                    self._put_idle(conn)
+                else:
+                    conn.close()
+        except asyncio.TimeoutError:
+            result["error"] = "timed out"
+        except (OSError, HTTPError, ValueError, asyncio.IncompleteReadError) as e:
+            result["error"] = str(e) or e.__class__.__name__
+        return result
+    
+    async def request(self, method, url, body=b"", headers=None, timeout=30.0, limit=None):
+        # `limit` is an extra semaphore (the engine's concurrency) that is
+        # only taken once the host slot is ours, so waiting for a busy host
+        # doesn't hold one of its permits
+        key, host, target = self._split(url)
+        request_headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+        request_headers.update(headers or {})
+        
+        async with self._slot(key):
+            if limit is None:
+                return await self._request(key, host, target, method, request_headers, body, timeout)
+            async with limit:
+                return await self._request(key, host, target, method, request_headers, body, timeout)
+    
+    def set_max_per_host(self, max_per_host):
+        # Requests already waiting keep the old slots; new ones use the new limit
+        if max_per_host != self.max_per_host:
+            self.max_per_host = max_per_host
+            self._slots = {}
+    
+    async def _request(self, key, host, target, method, headers, body, timeout):
+        conn = self._take_idle(key)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = await self._open(key)
+            try:
+                response, keep_alive = await asyncio.wait_for(
+                    conn.request(method, host, target, headers, body), timeout
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                # The server may have dropped an idle keep-alive socket
+                # just before we reused it; retry once on a fresh one.
+                if reused:
+                    conn, reused = None, False
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            break
+        
+        if keep_alive:
+            self._put_idle(conn)
+        else:
+            conn.close()
+        return response
+    
+    def idle_connections(self):
+        return sum(len(conns) for conns in self._idle.values())
+    
+    def close(self):
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.close()
+        self._idle.clear()
+
+
+def wait_url(url):
+    # ?wait=true makes Discord return the created message (and its ID)
+    parts = urlsplit(url)
+    query = "&".join(filter(None, [parts.query, "wait=true"]))
+    return urlunsplit(parts._replace(query=query))
+
+
+def message_url(url, message_id):
+    # PATCH target for a message sent through the webhook (or the bot API's
+    # .../messages); the query string (e.g. thread_id) is kept
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/")
+    if not path.endswith("/messages"):
+        path += "/messages"
+    return urlunsplit(parts._replace(path=f"{path}/{message_id}"))
+
+
+def post_url_of(url):
+    # The URL that creates a new message, from a message's PATCH URL
+    parts = urlsplit(url)
+    if is_bot_url(url):
+        return urlunsplit(parts._replace(path=MESSAGE_PATH.sub("/messages", parts.path)))
+    query = "&".join(part for part in parts.query.split("&") if part and part != "wait=true")
+    return wait_url(urlunsplit(parts._replace(path=MESSAGE_PATH.sub("", parts.path), query=query)))
+
+
+def content_hash(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class DeliveryEngine:
+    # Runs the scheduler and webhook deliveries on a private asyncio loop in a
+    # background thread. The loop and its connection pool live as long as the
+    # engine, so stopping and restarting auto-posting keeps sockets warm.
+    
+    def __init__(self, log=print, concurrency=8, max_per_host=None, timeout=30.0, scheduler=None, payloads=None,
+                 outbox=None, on_message=None, tokens=None, warn=None):
+        # Problems (failed posts, dead letters, disabled tokens) go to `warn`
+        # so a host logger can give them their own level
+        self.log = log
+        self.warn = warn or log
+        # Edit-in-place channels: on_message(uid, message_id, content_hash)
+        # is called whenever the message a channel edits changes, so the
+        # owner can persist it with the channel
+        self.on_message = on_message
+        self.messages = {}
+        self.editing = set()
+        # Channels without a webhook post through the bot API
+        self.tokens = TokenPool(tokens or ())
+        self.pins = {}
+        self.attachments = AttachmentCache()
+        self._pruned = time.monotonic()
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.scheduler = scheduler if scheduler is not None else ChannelScheduler()
+        self.payloads = payloads or PayloadCache()
+        self.outbox = outbox if outbox is not None else Outbox()
+        # Every webhook shares discord.com, so unless set the per-host limit
+        # follows the concurrency setting rather than capping it
+        self.max_per_host = max_per_host
+        self.pool = ConnectionPool(max_per_host=max_per_host or self.concurrency)
+        self.ratelimiter = RateLimiter()
+        self.metrics = Metrics()
+        self.loop = None
+        self.thread = None
+        # Outbox transactions run here, one at a time, off the loop
+        self._committer = None
+        self._commit_lock = None
+        self._runner = None
+        self._stopping = False
+        self._wakeup = None
+        self._slots = None
+        self._inflight = set()
+        self._commit_error = None
+        self.scheduler.listeners.append(self._on_schedule_change)
+    
+    @property
+    def running(self):
+        return self._runner is not None and not self._runner.done()
+    
+    def _ensure_loop(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self._wakeup = asyncio.Event()
+            self._commit_lock = asyncio.Lock()
+            ready.set()
+            self.loop.run_forever()
+        
+        self._committer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-commit")
+        self.thread = threading.Thread(target=run, name="delivery-engine", daemon=True)
+        self.thread.start()
+        ready.wait()
+    
+    def call(self, coro, timeout=None):
+        # Runs a coroutine on the engine loop from any thread and waits for it
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+    
+    def submit(self, coro):
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def metrics_snapshot(self, full=False):
+        # Metrics are only ever touched on the loop, so the snapshot is taken
+        # there too; from any other thread this waits for it
+        if self.loop is None or not self.loop.is_running() or threading.current_thread() is self.thread:
+            return self.metrics.snapshot(full)
+        return self.call(self._metrics_snapshot(full))
+    
+    async def _metrics_snapshot(self, full):
+        return self.metrics.snapshot(full)
+    
+    def start(self, channels, schedule=None):
+        # `schedule` adds due times saved elsewhere, e.g. by the shards of a
+        # sharded run, keyed by uid
+        self._ensure_loop()
+        self.call(self._open_outbox())
+        
+        # Channels keep the phase they had before a restart instead of all
+        # posting at once; anything already due goes out immediately
+        saved = merge_schedule(self.outbox.load_schedule(), schedule or {})
+        self.scheduler.clear()
+        self.scheduler.sync(channels, self._first_delay(saved))
+        self.call(self._start(schedule))
+    
+    def stop(self):
+        if self.loop is not None:
+            self.call(self._stop())
+    
+    def hand_off(self):
+        # Stops and empties the outbox, returning what was queued for another
+        # engine to adopt()
+        self.stop()
+        return self.call(self._hand_off())
+    
+    def adopt(self, rows):
+        self.call(self._adopt(rows))
+    
+    def sync(self, channels, schedule=None):
+        # Channels new to this engine start at their due time in `schedule`
+        # if they have one (they moved here from another shard)
+        if self.running:
+            self.scheduler.sync(channels, self._first_delay(schedule) if schedule else None)
+            if schedule:
+                self.call(self._save_schedule(schedule))
+    
+    @staticmethod
+    def _first_delay(schedule):
+        now = time.time()
+        
+        def first_delay(channel):
+            due = schedule.get(channel.get("uid"))
+            return 0 if due is None else max(due - now, 0)
+        
+        return first_delay
+    
+    def set_tokens(self, tokens):
+        # Swapping the pool is atomic; posts already in flight finish with
+        # the token they picked
+        if not self.tokens.same_tokens(tokens):
+            self.tokens = TokenPool(tokens)
+    
+    def close(self):
+        if self.loop is None:
+            return
+        self.stop()
+        self.call(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+        self.loop = None
+        self._committer.shutdown()
+        self._committer = None
+    
+    def _on_schedule_change(self):
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+    
+    async def _start(self, schedule=None):
+        await self._save_schedule(schedule)
+        if not self.running:
+            self._stopping = False
+            self._runner = asyncio.ensure_future(self._run())
+    
+    async def _stop(self):
+        if self._runner is not None:
+            # wait_for() can swallow a cancel that lands as the wakeup fires
+            # (bpo-42130), so the runner also checks a flag before every pass
+            self._stopping = True
+            self._wakeup.set()
+            self._runner.cancel()
+            tasks = [self._runner, *self._inflight]
+            for task in self._inflight:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._runner = None
+            self.outbox.requeue_inflight()
+            await self._commit()
+    
+    async def _save_schedule(self, schedule):
+        # Due times that came from elsewhere are only written here when the
+        # channel next posts, so save them now; another move or a restart
+        # before then would post the channel again
+        for uid, due in (schedule or {}).items():
+            self.outbox.save_schedule(uid, due)
+    
+    async def _hand_off(self):
+        # The outbox may never have been opened if the engine never ran
+        self.outbox.open()
+        rows = self.outbox.take_all()
+        await self._commit()
+        return rows
+    
+    async def _adopt(self, rows):
+        self.outbox.adopt(rows)
+        self._wakeup.set()
+    
+    async def _open_outbox(self):
+        self.outbox.open()
+        if len(self.outbox):
+            self.log(f"Resuming {len(self.outbox)} undelivered posts from the outbox")
+    
+    async def _close(self):
+        self.pool.close()
+        self.outbox.close()
+        self.attachments.close()
+    
+    async def _commit(self):
+        # The transaction runs on the committer thread: the outbox can share
+        # its database file with the channel store, whose flushes may keep it
+        # locked for seconds, and deliveries must not wait for that.
+        # Returns False if the batch couldn't be written; it stays queued in
+        # the outbox and goes out with the next commit.
+        async with self._commit_lock:
+            writes = self.outbox.take_writes()
+            if not writes:
+                return True
+            future = self.loop.run_in_executor(self._committer, self.outbox.write, writes)
+            try:
+                try:
+                    await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # Stopping: let the write finish first, so the final
+                    # commit can't overtake it
+                    try:
+                        await future
+                    except sqlite3.Error:
+                        self.outbox.keep_writes(writes)
+                    raise
+            except sqlite3.Error as e:
+                self.outbox.keep_writes(writes)
+                # Logged once per kind of error, not on every retry
+                if str(e) != self._commit_error:
+                    self._commit_error = str(e)
+                    self.warn(f"Could not save the outbox, will retry: {e}")
+                return False
+        if self._commit_error is not None:
+            self._commit_error = None
+            self.log("Outbox saved again")
+        return True
+    
+    async def _run(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.pool.set_max_per_host(self.max_per_host or self.concurrency)
+        while not self._stopping:
+            self._wakeup.clear()
+            # Lag is how late we woke for the earliest due channel, and back
+            # to 0 once nothing is overdue
+            now = self.scheduler.clock()
+            next_due = self.scheduler.next_due()
+            if next_due is not None and next_due <= now:
+                self.metrics.set_lag(now - next_due)
+            else:
+                self.metrics.set_lag(0.0)
+            for channel in self.scheduler.pop_due(now):
+                self.enqueue(channel)
+            
+            # New items, acks and retries hit the disk in one transaction
+            # before any of the requests below is started
+            committed = await self._commit()
+            
+            # Deliveries run concurrently, so one slow or throttled webhook
+            # no longer holds up every channel scheduled after it.
+            for item in self.outbox.take_ready():
+                task = asyncio.ensure_future(self._deliver_item(item))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+            self.metrics.queue_depth = len(self.outbox)
+            if time.monotonic() - self._pruned > 60:
+                self._pruned = time.monotonic()
+                self.attachments.prune()
+            
+            next_due = self.scheduler.next_due()
+            timeout = None if next_due is None else max(next_due - self.scheduler.clock(), 0)
+            retry_in = self.outbox.next_retry_in()
+            if retry_in is not None:
+                timeout = retry_in if timeout is None else min(timeout, retry_in)
+            if not committed:
+                timeout = COMMIT_RETRY if timeout is None else min(timeout, COMMIT_RETRY)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    def enqueue(self, channel):
+        key = channel_key(channel)
+        due = self.scheduler.due(key)
+        if due is not None and channel.get("uid"):
+            self.outbox.save_schedule(channel["uid"], time.time() + due - self.scheduler.clock())
+        
+        name = channel.get("channel_id") or "No ID"
+        url = self.post_url(channel)
+        if not url:
+            self.warn(f"Skipped channel {name}: no webhook URL or bot token")
+            return None
+        # A channel whose previous post is still queued or retrying is not
+        # queued twice
+        if self.outbox.pending(key):
+            return None
+        self._track_channel(key, channel)
+        body = self.payloads.payload(channel)
+        if channel.get("edit_in_place"):
+            message_id, last_hash = self.messages.get(key) or (channel.get("message_id"), channel.get("message_hash"))
+            if message_id:
+                if content_hash(body) == last_hash:
+                    self.metrics.count("unchanged")
+                    return None
+                # Edits keep the attachments of the original message, so they
+                # aren't uploaded again; the item only carries them in case
+                # the message is gone and has to be posted anew
+                return self.outbox.enqueue(key, name, "PATCH", message_url(url, message_id), body,
+                                           channel.get("attachments"))
+            if not is_bot_url(url):
+                url = wait_url(url)
+        return self.outbox.enqueue(key, name, "POST", url, body, channel.get("attachments"))
+    
+    def post_url(self, channel):
+        url = channel.get("webhook_url", "")
+        if not url and channel.get("channel_id") and len(self.tokens):
+            url = channel_messages_url(channel["channel_id"])
+        return url
+    
+    def _track_channel(self, key, channel):
+        # Per-channel options the delivery needs but the outbox doesn't store
+        if channel.get("edit_in_place"):
+            self.editing.add(key)
+        else:
+            self.editing.discard(key)
+        try:
+            pin = int(channel.get("token") or 0)
+        except (TypeError, ValueError):
+            pin = 0
+        if pin:
+            self.pins[key] = pin
+        else:
+            self.pins.pop(key, None)
+    
+    async def _deliver_item(self, item):
+        started = time.perf_counter()
+        try:
+            if item.files and item.method == "POST":
+                body = multipart_body(item.body, item.files, self.attachments)
+            else:
+                body = item.body
+        except OSError as e:
+            # A missing or unreadable attachment won't fix itself on retry
+            self._failed(item, f"attachment: {e}", permanent=True)
+            self._wakeup.set()
+            return
+        try:
+            response = await self.send_item(item.method, item.url, body, self.pins.get(item.uid))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.metrics.observe(item.uid, item.label, time.perf_counter() - started, False)
+            self._failed(item, e)
+        else:
+            self.metrics.observe(item.uid, item.label, time.perf_counter() - started, response.ok)
+            if response.ok:
+                self.outbox.ack(item)
+                if item.method == "PATCH":
+                    self._remember_message(item.uid, MESSAGE_ID.search(urlsplit(item.url).path).group(1), item.body)
+                    self.log(f"Edited message in channel {item.label}")
+                else:
+                    if "wait=true" in item.url or (item.uid in self.editing and is_bot_url(item.url)):
+                        self._remember_message(item.uid, self._message_id(response), item.body)
+                    self.log(f"Posted to channel {item.label}")
+            elif item.method == "PATCH" and response.status == 404:
+                # The message we were editing is gone; post a new one instead
+                self.outbox.ack(item)
+                self._remember_message(item.uid, None, None)
+                self.outbox.enqueue(item.uid, item.label, "POST", post_url_of(item.url), item.body, files=item.files)
+                self.log(f"Message in channel {item.label} was deleted, posting a new one")
+            else:
+                # Rate limits that outlasted our retries and server errors are
+                # worth retrying; other 4xx (bad webhook, bad payload) are not
+                error = f"HTTP {response.status} {response.body[:200]!r}"
+                self._failed(item, error, permanent=response.status < 500 and response.status != 429)
+        finally:
+            if body is not item.body:
+                body.release()
+        self._wakeup.set()
+    
+    @staticmethod
+    def _message_id(response):
+        try:
+            return str(response.json()["id"])
+        except (ValueError, KeyError, TypeError):
+            return None
+    
+    def _remember_message(self, key, message_id, body):
+        state = (message_id, content_hash(body) if message_id else None)
+        if self.messages.get(key) == state:
+            return
+        self.messages[key] = state
+        if self.on_message is not None:
+            self.on_message(key, *state)
+    
+    def _failed(self, item, error, permanent=False):
+        if self.outbox.fail(item, error, permanent):
+            retry_in = max(item.not_before - time.time(), 0)
+            self.warn(f"Failed to post to channel {item.label}: {error} (retry {item.attempts} in {retry_in:.1f}s)")
+        else:
+            self.metrics.count("dead_lettered")
+            self.warn(f"Failed to post to channel {item.label}: {error} (moved to dead letters after {item.attempts} attempts)")
+    
+    async def send_item(self, method, url, body, pin=None):
+        # Webhooks carry their own credentials; bot-API posts pick a token
+        # from the pool and fail over to the next one if Discord rejects it
+        # (401: bad token, disabled) or it lacks access to the channel (403)
+        headers = JSON_HEADERS if isinstance(body, bytes) else {"Content-Type": body.content_type}
+        if not is_bot_url(url):
+            return await self.send(method, url, body, headers)
+        route = route_for(method, url)
+        tried = []
+        response = None
+        while True:
+            token = self.tokens.choose(route, pin, tried)
+            if token is None:
+                if response is None:
+                    raise HTTPError("no usable bot token")
+                return response
+            tried.append(token)
+            token.inflight += 1
+            try:
+                response = await self.send(method, url, body, dict(headers, **token.headers), token.ratelimiter)
+            finally:
+                token.inflight -= 1
+            if response.status == 401:
+                self.tokens.disable(token, "rejected (HTTP 401)")
+                self.warn(f"Discord rejected bot {token.label}, disabling it")
+            elif response.status != 403:
+                if response.ok:
+                    token.sent += 1
+                return response
+    
+    async def send(self, method, url, body, headers, ratelimiter=None):
+        # Waits for the route's bucket (without holding a concurrency slot),
+        # sends the request and retries after 429s as Discord asks.
+        if ratelimiter is None:
+            ratelimiter = self.ratelimiter
+        route = route_for(method, url)
+        for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+            bucket = await ratelimiter.acquire(route)
+            try:
+                response = await self.pool.request(method, url, body, headers, timeout=self.timeout, limit=self._slots)
+            except BaseException:
+                ratelimiter.release(bucket)
+                raise
+            retry_after = ratelimiter.update(route, response)
+            if retry_after is None:
+                return response
+            self.metrics.count("rate_limited")
+            self.log(f"Rate limited by Discord, retrying in {retry_after:.2f}s")
+        return response
+    
+    async def probe(self, channels, warm=None):
+        # Test Connection: opens `warm` pooled connections to every distinct
+        # webhook host (GETting one of its webhooks, which also checks that
+        # the webhook exists) and checks each bot token. The connections stay
+        # in the pool, so auto-posting started afterwards reuses them.
+        warm = warm or min(self.pool.max_per_host, MAX_WARM)
+        targets = {}
+        for channel in channels:
+            url = channel.get("webhook_url", "")
+            if not url:
+                continue
+            try:
+                key = ConnectionPool._split(url)[0]
+            except HTTPError:
+                continue
+            targets.setdefault(key, urlunsplit(urlsplit(url)._replace(query="")))
+        
+        hosts = list(targets.values())
+        probes = await asyncio.gather(*[self.pool.probe(url) for url in hosts for _ in range(warm)])
+        results = []
+        for index, url in enumerate(hosts):
+            results.append(self._probe_summary(urlsplit(url).netloc, probes[index * warm:(index + 1) * warm]))
+        
+        for token in self.tokens:
+            started = time.perf_counter()
+            result = {"name": f"bot {token.label}", "dns": None, "connect": None, "tls": None, "first_byte": None,
+                      "status": None, "error": None, "connections": 0}
+            try:
+                response = await self.send("GET", f"{API_BASE}/users/@me", b"", token.headers, token.ratelimiter)
+                result["first_byte"] = time.perf_counter() - started
+                result["status"] = response.status
+                if response.status == 401:
+                    self.tokens.disable(token, "rejected (HTTP 401)")
+            except (OSError, HTTPError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                result["error"] = str(e) or e.__class__.__name__
+            result["verdict"] = self._verdict(result)
+            results.append(result)
+        return results
+    
+    @staticmethod
+    def _probe_summary(name, probes):
+        # Median of each phase over the connections that worked
+        ok = [probe for probe in probes if probe["error"] is None]
+        result = {"name": name, "connections": len(ok), "status": None, "error": None}
+        for phase in ("dns", "connect", "tls", "first_byte"):
+            values = sorted(probe[phase] for probe in ok if probe[phase] is not None)
+            result[phase] = values[len(values) // 2] if values else None
+        if ok:
+            result["status"] = ok[0]["status"]
+        else:
+            result["error"] = probes[0]["error"] if probes else "no connection"
+        result["verdict"] = DeliveryEngine._verdict(result)
+        return result
+    
+    @staticmethod
+    def _verdict(result):
+        if result["error"]:
+            return "unreachable"
+        if result["status"] is not None and result["status"] >= 400:
+            return f"HTTP {result['status']}"
+        total = sum(result[phase] or 0 for phase in ("dns", "connect", "tls", "first_byte"))
+        return "slow" if total > SLOW_PROBE else "ok"
+    
+    async def deliver(self, channel):
+        name = channel.get("channel_id") or "No ID"
+        url = self.post_url(channel)
+        if not url:
+            self.warn(f"Skipped channel {name}: no webhook URL or bot token")
+            return None
+        self._track_channel(channel_key(channel), channel)
+        body = self.payloads.payload(channel)
+        try:
+            if channel.get("attachments"):
+                body = multipart_body(body, channel["attachments"], self.attachments)
+            response = await self.send_item("POST", url, body, self.pins.get(channel_key(channel)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.warn(f"Failed to post to channel {name}: {e}")
+            return None
+        finally:
+            if not isinstance(body, bytes):
+                body.release()
+        if response.ok:
+            self.log(f"Posted to channel {name}")
+        else:
+            self.warn(f"Failed to post to channel {name}: HTTP {response.status} {response.body[:200]!r}")
+        return response
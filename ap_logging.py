@@ -0,0 +1,85 @@
+import logging
+import logging.handlers
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+MAX_LOG_LINES = 2000
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+def rotating_file_handler(path, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS):
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+class LogPipeline:
+    # Thread-safe log sink for the GUI. Any thread may call write(); lines are
+    # queued and the Tk thread drains them in batches. Only the newest
+    # max_lines are kept in memory, in the queue as well as after draining
+    # (a burst that outruns the Tk thread drops its oldest lines and says how
+    # many), and the optional rotating file is written by a QueueListener
+    # thread so disk I/O never runs on the UI thread.
+    
+    def __init__(self, max_lines=MAX_LOG_LINES):
+        self.max_lines = max_lines
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+        self._queue = deque(maxlen=max_lines)
+        self._unreported = 0
+        self._lock = threading.Lock()
+        self._file_logger = None
+        self._listener = None
+    
+    def write(self, message):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entry = f"[{timestamp}] {message}"
+        with self._lock:
+            if len(self._queue) == self.max_lines:
+                self.dropped += 1
+                self._unreported += 1
+            self._queue.append(entry)
+        if self._file_logger is not None:
+            self._file_logger.info(entry)
+    
+    def drain(self, limit=None):
+        with self._lock:
+            if limit is None or limit >= len(self._queue):
+                batch = list(self._queue)
+                self._queue.clear()
+            else:
+                batch = [self._queue.popleft() for _ in range(limit)]
+            dropped, self._unreported = self._unreported, 0
+        if dropped:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            batch.insert(0, f"[{timestamp}] ({dropped} older log lines dropped)")
+        self.lines.extend(batch)
+        return batch
+    
+    def clear(self):
+        self.lines.clear()
+    
+    def open_file(self, path):
+        self.close_file()
+        if not path:
+            return
+        file_queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(file_queue, rotating_file_handler(path))
+        self._listener.start()
+        logger = logging.getLogger(f"ap.pipeline.{id(self)}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(logging.handlers.QueueHandler(file_queue))
+        self._file_logger = logger
+    
+    def close_file(self):
+        if self._file_logger is not None:
+            for handler in list(self._file_logger.handlers):
+                self._file_logger.removeHandler(handler)
+            self._file_logger = None
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,229 @@
+import bisect
+import os
+import threading
+import time
+
+# Latency bucket upper bounds in seconds (Prometheus style, +Inf implied)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5,
+    0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+COUNTERS = ("success", "failure", "rate_limited", "dead_lettered", "unchanged")
+
+
+class Histogram:
+    # Fixed buckets allocated up front; observe() is a bisect and two adds.
+    
+    __slots__ = ("counts", "count", "sum")
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def merge(self, counts, count, total):
+        for i, value in enumerate(counts):
+            self.counts[i] += value
+        self.count += count
+        self.sum += total
+    
+    def percentile(self, q):
+        # Linear interpolation inside the bucket that holds the q-th value
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = LATENCY_BUCKETS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    # Delivery instrumentation. All updates happen on the engine's event loop
+    # thread, so there are no locks on the hot path; other threads read a
+    # snapshot() taken on that thread (DeliveryEngine.metrics_snapshot) or a
+    # Metrics built from one, never the live object.
+    
+    def __init__(self):
+        self.latency = Histogram()
+        self.channels = {}
+        self.labels = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.queue_depth = 0
+        self.scheduler_lag = 0.0
+        self.max_scheduler_lag = 0.0
+        self.started = time.time()
+        self._dirty = set()
+    
+    def observe(self, key, label, seconds, ok):
+        self.latency.observe(seconds)
+        histogram = self.channels.get(key)
+        if histogram is None:
+            histogram = self.channels[key] = Histogram()
+            self.labels[key] = label
+        histogram.observe(seconds)
+        self._dirty.add(key)
+        self.counters["success" if ok else "failure"] += 1
+    
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+    
+    def set_lag(self, seconds):
+        self.scheduler_lag = seconds
+        if seconds > self.max_scheduler_lag:
+            self.max_scheduler_lag = seconds
+    
+    def add(self, snapshot):
+        # Adds the counters and histograms of a snapshot (e.g. of a worker
+        # that has exited) to these; gauges are left alone
+        self.latency.merge(*snapshot["latency"])
+        for name, value in snapshot["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for key, (label, counts, count, total) in snapshot["channels"].items():
+            histogram = self.channels.get(key)
+            if histogram is None:
+                histogram = self.channels[key] = Histogram()
+            histogram.merge(counts, count, total)
+            self.labels[key] = label
+        self.max_scheduler_lag = max(self.max_scheduler_lag, snapshot["max_scheduler_lag"])
+    
+    def snapshot(self, full=False):
+        # Plain data for shipping from worker processes (or for other
+        # threads to read); call it on the loop thread that owns the metrics.
+        # Per-channel histograms are only included when they changed since
+        # the last partial snapshot, or all of them with `full`.
+        keys = self.channels.keys() if full else self._dirty
+        snapshot = {
+            "latency": (list(self.latency.counts), self.latency.count, self.latency.sum),
+            "channels": {
+                key: (self.labels[key], list(self.channels[key].counts), self.channels[key].count, self.channels[key].sum)
+                for key in keys
+            },
+            "counters": dict(self.counters),
+            "queue_depth": self.queue_depth,
+            "scheduler_lag": self.scheduler_lag,
+            "max_scheduler_lag": self.max_scheduler_lag
+        }
+        if not full:
+            self._dirty = set()
+        return snapshot
+    
+    @classmethod
+    def merged(cls, snapshots, past=None):
+        # Builds one Metrics out of the latest full snapshot of every running
+        # worker on top of `past`, the totals of workers that have exited, so
+        # counters never go backwards when a worker restarts
+        metrics = cls()
+        if past is not None:
+            metrics.add(past.snapshot(full=True))
+        for snapshot in snapshots:
+            metrics.add(snapshot)
+            metrics.queue_depth += snapshot["queue_depth"]
+            metrics.scheduler_lag = max(metrics.scheduler_lag, snapshot["scheduler_lag"])
+        return metrics
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _histogram_lines(name, histogram, labels=""):
+    lines = []
+    cumulative = 0
+    separator = "," if labels else ""
+    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+def prometheus_text(metrics):
+    lines = [
+        "# HELP ap_posts_total Webhook posts by result (unchanged: edit skipped, same content).",
+        "# TYPE ap_posts_total counter"
+    ]
+    for name in ("success", "failure", "dead_lettered", "unchanged"):
+        lines.append(f'ap_posts_total{{result="{name}"}} {metrics.counters.get(name, 0)}')
+    lines += [
+        "# HELP ap_rate_limited_total Responses with HTTP 429.",
+        "# TYPE ap_rate_limited_total counter",
+        f"ap_rate_limited_total {metrics.counters.get('rate_limited', 0)}",
+        "# HELP ap_outbox_depth Posts waiting in the outbox.",
+        "# TYPE ap_outbox_depth gauge",
+        f"ap_outbox_depth {metrics.queue_depth}",
+        "# HELP ap_scheduler_lag_seconds How far the scheduler is behind the earliest due post (0 when caught up).",
+        "# TYPE ap_scheduler_lag_seconds gauge",
+        f"ap_scheduler_lag_seconds {metrics.scheduler_lag:.6f}",
+        "# HELP ap_post_latency_seconds Webhook post latency.",
+        "# TYPE ap_post_latency_seconds histogram"
+    ]
+    lines += _histogram_lines("ap_post_latency_seconds", metrics.latency)
+    lines += [
+        "# HELP ap_channel_post_latency_seconds Webhook post latency per channel.",
+        "# TYPE ap_channel_post_latency_seconds histogram"
+    ]
+    for key, histogram in list(metrics.channels.items()):
+        labels = f'uid="{_escape(key)}",channel="{_escape(metrics.labels.get(key, ""))}"'
+        lines += _histogram_lines("ap_channel_post_latency_seconds", histogram, labels)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path, metrics):
+    # Written to a temp file and renamed so scrapers never read half a file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(metrics))
+    os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    # Serves /metrics on a local port from a daemon thread. `source` is a
+    # callable returning the current Metrics.
+    
+    def __init__(self, source, port, host="127.0.0.1"):
+        self.source = source
+        self.port = port
+        self.host = host
+        self.server = None
+    
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        exporter = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(exporter.source()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="metrics-exporter", daemon=True).start()
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
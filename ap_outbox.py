@@ -0,0 +1,360 @@
+import heapq
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+
+MAX_ATTEMPTS = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 300.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER,
+    label TEXT NOT NULL,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    body BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    files TEXT
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    uid INTEGER,
+    label TEXT NOT NULL,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    body BLOB NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL,
+    files TEXT
+);
+CREATE TABLE IF NOT EXISTS schedule (
+    uid INTEGER PRIMARY KEY,
+    due REAL NOT NULL
+);
+"""
+
+
+def shard_path(path, shard):
+    # Outbox file of one worker process of a sharded poster
+    return f"{os.path.splitext(path)[0]}.shard{shard}.db"
+
+
+def shard_paths(path):
+    # Shard outbox files that exist next to `path`, by shard number
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(os.path.splitext(path)[0]) + ".shard"
+    shards = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return shards
+    for name in names:
+        number = name[len(prefix):-len(".db")]
+        if name.startswith(prefix) and name.endswith(".db") and number.isdigit():
+            shards[int(number)] = os.path.join(directory, name)
+    return shards
+
+
+def read_schedule(path):
+    # Saved due times of an outbox file, read without taking it over (its
+    # engine may be running)
+    if not path or not os.path.exists(path):
+        return {}
+    db = sqlite3.connect(path)
+    try:
+        return dict(db.execute("SELECT uid, due FROM schedule"))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        db.close()
+
+
+def drain_outbox(path):
+    # Empties an outbox file that no engine has open, e.g. of a shard that
+    # no longer exists; returns its posts as adopt() rows and its due times
+    outbox = Outbox(path)
+    outbox.open()
+    try:
+        schedule = outbox.load_schedule()
+        rows = outbox.take_all()
+        outbox.clear_schedule()
+        outbox.commit()
+    finally:
+        outbox.close()
+    return rows, schedule
+
+
+def merge_schedule(schedule, other):
+    # Due times only ever move forward, so the later one is the newer
+    for uid, due in other.items():
+        if due > schedule.get(uid, 0):
+            schedule[uid] = due
+    return schedule
+
+
+class OutboxItem:
+    __slots__ = ("id", "uid", "label", "method", "url", "body", "attempts", "not_before", "files")
+    
+    def __init__(self, id, uid, label, method, url, body, attempts=0, not_before=0.0, files=None):
+        self.id = id
+        self.uid = uid
+        self.label = label
+        self.method = method
+        self.url = url
+        self.body = body
+        self.attempts = attempts
+        self.not_before = not_before
+        # Attachment paths; the files are read when the post is sent, never
+        # copied into the outbox
+        self.files = files
+    
+    def __lt__(self, other):
+        return self.not_before < other.not_before
+
+
+def backoff(attempts, base=BASE_DELAY, cap=MAX_DELAY):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempts))
+
+
+class Outbox:
+    # Durable queue of posts that have been scheduled but not yet delivered.
+    # Items are enqueued when their channel comes due and deleted once the
+    # webhook accepts them; failures come back after a backoff and give up
+    # into dead_letters. Everything is mirrored in memory (a deque of ready
+    # items and a heap of delayed retries), and SQLite only sees one batched
+    # transaction per commit(), so queue operations stay O(1)/O(log n) even
+    # with 100k items pending. Times are wall clock so they survive restarts.
+    #
+    # path=None keeps the outbox in memory only.
+    
+    def __init__(self, path=None, max_attempts=MAX_ATTEMPTS, clock=time.time):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.items = {}
+        self.ready = deque()
+        self.delayed = []
+        self.inflight = set()
+        self.by_uid = {}
+        self._next_id = 1
+        self._db = None
+        self._writes = []
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def open(self):
+        if self._db is not None:
+            return
+        self._db = sqlite3.connect(self.path or ":memory:", check_same_thread=False, isolation_level=None)
+        if self.path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        for table in ("outbox", "dead_letters"):
+            columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            if "files" not in columns:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN files TEXT")
+        now = self.clock()
+        rows = self._db.execute(
+            "SELECT id, uid, label, method, url, body, attempts, not_before, files FROM outbox ORDER BY id"
+        )
+        for row in rows:
+            item = OutboxItem(*row[:8], files=json.loads(row[8]) if row[8] else None)
+            self._track(item)
+            if item.not_before <= now:
+                self.ready.append(item)
+            else:
+                heapq.heappush(self.delayed, item)
+        row = self._db.execute("SELECT MAX(id) FROM outbox").fetchone()
+        self._next_id = (row[0] or 0) + 1
+    
+    def close(self):
+        if self._db is None:
+            return
+        self.commit()
+        self._db.close()
+        self._db = None
+    
+    def pending(self, uid):
+        return self.by_uid.get(uid, 0) > 0
+    
+    def enqueue(self, uid, label, method, url, body, files=None):
+        item = OutboxItem(self._next_id, uid, label, method, url, body, files=files or None)
+        self._next_id += 1
+        self._track(item)
+        self.ready.append(item)
+        self._writes.append((
+            "INSERT INTO outbox (id, uid, label, method, url, body, attempts, not_before, files) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (item.id, uid, label, method, url, body, 0, 0.0, json.dumps(item.files) if item.files else None)
+        ))
+        return item
+    
+    def take_ready(self, limit=None):
+        # Moves retries whose backoff has expired to the ready queue, then
+        # hands out ready items; they stay in the outbox until ack/fail
+        now = self.clock()
+        while self.delayed and self.delayed[0].not_before <= now:
+            self.ready.append(heapq.heappop(self.delayed))
+        taken = []
+        while self.ready and (limit is None or len(taken) < limit):
+            item = self.ready.popleft()
+            if item.id in self.items:
+                self.inflight.add(item.id)
+                taken.append(item)
+        return taken
+    
+    def next_retry_in(self):
+        if self.ready:
+            return 0
+        if not self.delayed:
+            return None
+        return max(self.delayed[0].not_before - self.clock(), 0)
+    
+    def ack(self, item):
+        if self._untrack(item):
+            self._writes.append(("DELETE FROM outbox WHERE id = ?", (item.id,)))
+    
+    def fail(self, item, error, permanent=False):
+        # Returns True if the item will be retried, False if it was dead-lettered
+        if item.id not in self.items:
+            return False
+        self.inflight.discard(item.id)
+        item.attempts += 1
+        if permanent or item.attempts >= self.max_attempts:
+            self._untrack(item)
+            self._writes.append(("DELETE FROM outbox WHERE id = ?", (item.id,)))
+            self._writes.append((
+                "INSERT INTO dead_letters (uid, label, method, url, body, attempts, error, failed_at, files) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item.uid, item.label, item.method, item.url, item.body, item.attempts, str(error), self.clock(),
+                 json.dumps(item.files) if item.files else None)
+            ))
+            return False
+        item.not_before = self.clock() + backoff(item.attempts)
+        heapq.heappush(self.delayed, item)
+        self._writes.append((
+            "UPDATE outbox SET attempts = ?, not_before = ? WHERE id = ?",
+            (item.attempts, item.not_before, item.id)
+        ))
+        return True
+    
+    def requeue_inflight(self):
+        # Puts items that were being sent back in front of the queue (e.g.
+        # the engine was stopped mid-delivery); they count as not attempted
+        for item_id in self.inflight:
+            item = self.items.get(item_id)
+            if item is not None:
+                self.ready.appendleft(item)
+        self.inflight.clear()
+    
+    def take_all(self):
+        # Empties the outbox (nothing may be in flight) and returns its items,
+        # oldest first, as rows for another outbox's adopt()
+        rows = [
+            (item.uid, item.label, item.method, item.url, item.body, item.attempts, item.not_before, item.files)
+            for item in sorted(self.items.values(), key=lambda item: item.id)
+        ]
+        self.items.clear()
+        self.ready.clear()
+        self.delayed.clear()
+        self.inflight.clear()
+        self.by_uid.clear()
+        self._writes.append(("DELETE FROM outbox", ()))
+        return rows
+    
+    def adopt(self, rows):
+        # Takes over items from take_all(); retries keep their attempts and
+        # backoff. Like enqueue() in the engine, a channel that already has a
+        # post queued here doesn't get a second one.
+        now = self.clock()
+        for uid, label, method, url, body, attempts, not_before, files in rows:
+            if self.pending(uid):
+                continue
+            item = OutboxItem(self._next_id, uid, label, method, url, body, attempts, not_before, files)
+            self._next_id += 1
+            self._track(item)
+            if not_before <= now:
+                self.ready.append(item)
+            else:
+                heapq.heappush(self.delayed, item)
+            self._writes.append((
+                "INSERT INTO outbox (id, uid, label, method, url, body, attempts, not_before, files) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item.id, uid, label, method, url, body, attempts, not_before, json.dumps(files) if files else None)
+            ))
+    
+    def save_schedule(self, uid, due):
+        self._writes.append(("INSERT OR REPLACE INTO schedule (uid, due) VALUES (?, ?)", (uid, due)))
+    
+    def clear_schedule(self):
+        self._writes.append(("DELETE FROM schedule", ()))
+    
+    def load_schedule(self):
+        return dict(self._db.execute("SELECT uid, due FROM schedule"))
+    
+    def dead_letters(self, limit=100):
+        rows = self._db.execute(
+            "SELECT id, uid, label, attempts, error, failed_at, files FROM dead_letters ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+        return [row[:6] + (json.loads(row[6]) if row[6] else None,) for row in rows]
+    
+    def commit(self):
+        writes = self.take_writes()
+        try:
+            self.write(writes)
+        except BaseException:
+            self.keep_writes(writes)
+            raise
+    
+    # commit() in steps, for callers that write on another thread (the
+    # database can be busy for seconds): take_writes() and keep_writes() on
+    # the thread that queues writes, write() on any one thread at a time
+    
+    def take_writes(self):
+        writes, self._writes = self._writes, []
+        return writes
+    
+    def keep_writes(self, writes):
+        # Puts a batch that failed back in front of anything queued since
+        self._writes = writes + self._writes
+    
+    def write(self, writes):
+        # One transaction. BEGIN and COMMIT fail too when the database is
+        # locked or the disk is full; nothing of the batch is written then.
+        if not writes or self._db is None:
+            return
+        try:
+            self._db.execute("BEGIN")
+            for sql, parameters in writes:
+                self._db.execute(sql, parameters)
+            self._db.execute("COMMIT")
+        except BaseException:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            raise
+    
+    def _track(self, item):
+        self.items[item.id] = item
+        self.by_uid[item.uid] = self.by_uid.get(item.uid, 0) + 1
+    
+    def _untrack(self, item):
+        if self.items.pop(item.id, None) is None:
+            return False
+        self.inflight.discard(item.id)
+        count = self.by_uid.get(item.uid, 0) - 1
+        if count > 0:
+            self.by_uid[item.uid] = count
+        else:
+            self.by_uid.pop(item.uid, None)
+        return True
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+# How long a request waits for an unknown bucket's first response before it
+# goes ahead anyway (covers responses that never carry rate-limit headers).
+DISCOVERY_TIMEOUT = 5.0
+
+
+def route_for(method, url):
+    # Discord keys buckets by route *and* major parameter (webhook ID/token,
+    # channel ID), so the path without the API version prefix is a good key.
+    path = urlsplit(url).path
+    parts = path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] == "api" and parts[1].startswith("v"):
+        parts = parts[2:]
+    elif parts and parts[0] == "api":
+        parts = parts[1:]
+    return f"{method} /" + "/".join(parts)
+
+
+class Bucket:
+    def __init__(self, key):
+        self.key = key
+        self.limit = None
+        self.remaining = 1
+        self.reset_at = 0.0
+        self.changed = asyncio.Event()
+    
+    def reserve(self, now):
+        # Returns 0 when a request may go out now, otherwise how long to wait
+        # (None = wait for the first response to tell us the real limits).
+        if self.limit is not None and self.remaining <= 0 and now >= self.reset_at:
+            # New window: its real reset time arrives with the next response
+            self.remaining = self.limit
+            self.reset_at = now + DISCOVERY_TIMEOUT
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 0
+        if self.limit is None and now >= self.reset_at:
+            return None
+        return max(self.reset_at - now, 0.001)
+    
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class RateLimiter:
+    # Tracks Discord's per-route buckets and the global limit from the
+    # X-RateLimit-* headers. Requests only wait on their own bucket, so one
+    # throttled webhook never holds up the others; a global 429 pauses all.
+    
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self.routes = {}
+        self.global_reset = 0.0
+        self.hits = 0
+    
+    def bucket(self, route):
+        key = self.routes.get(route, route)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(key)
+        return bucket
+    
+    async def acquire(self, route):
+        while True:
+            now = self.clock()
+            if now < self.global_reset:
+                await asyncio.sleep(self.global_reset - now)
+                continue
+            bucket = self.bucket(route)
+            delay = bucket.reserve(now)
+            if delay == 0:
+                return bucket
+            try:
+                await asyncio.wait_for(bucket.changed.wait(), delay or DISCOVERY_TIMEOUT)
+            except asyncio.TimeoutError:
+                if delay is None:
+                    # No headers ever arrived for this route; stop guessing
+                    bucket.remaining += 1
+    
+    def release(self, bucket):
+        # A request that never got a response gives its slot back
+        bucket.remaining += 1
+        bucket.notify()
+    
+    def update(self, route, response):
+        # Feeds a response back in. Returns the number of seconds to wait
+        # before retrying when the request was rate limited, else None.
+        now = self.clock()
+        headers = response.headers
+        bucket = self.bucket(route)
+        
+        bucket_hash = headers.get("x-ratelimit-bucket")
+        if bucket_hash:
+            key = f"{bucket_hash}:{route}"
+            if bucket.key != key:
+                # First time we learn the real bucket for this route
+                self.routes[route] = key
+                old = bucket
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = Bucket(key)
+                self.buckets.pop(old.key, None)
+                old.notify()
+        
+        if "x-ratelimit-limit" in headers:
+            try:
+                remaining = int(headers.get("x-ratelimit-remaining", 0))
+                # Our own count already includes requests still in flight, so
+                # a response can only ever lower it within the same window
+                if bucket.limit is None:
+                    bucket.remaining = remaining
+                else:
+                    bucket.remaining = min(bucket.remaining, remaining)
+                bucket.limit = int(headers["x-ratelimit-limit"])
+                if "x-ratelimit-reset-after" in headers:
+                    bucket.reset_at = now + float(headers["x-ratelimit-reset-after"])
+            except ValueError:
+                pass
+        elif bucket.limit is None:
+            # Route without rate-limit headers: treat it as unlimited
+            bucket.remaining = max(bucket.remaining, 1)
+        
+        retry_after = None
+        if response.status == 429:
+            self.hits += 1
+            retry_after, is_global = self._parse_429(response)
+            if is_global:
+                self.global_reset = max(self.global_reset, now + retry_after)
+            else:
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, now + retry_after)
+                if bucket.limit is None:
+                    bucket.limit = 1
+        
+        bucket.notify()
+        return retry_after
+    
+    def _parse_429(self, response):
+        headers = response.headers
+        retry_after = None
+        is_global = headers.get("x-ratelimit-global", "").lower() == "true"
+        try:
+            data = json.loads(response.body or b"{}")
+            if isinstance(data, dict):
+                retry_after = data.get("retry_after")
+                is_global = is_global or bool(data.get("global"))
+        except ValueError:
+            pass
+        if retry_after is None:
+            retry_after = headers.get("retry-after") or headers.get("x-ratelimit-reset-after") or 1
+        try:
+            retry_after = float(retry_after)
+        except ValueError:
+            retry_after = 1.0
+        return max(retry_after, 0.0), is_global
+    
+    def headroom(self, route):
+        # Requests `route` could send right now without waiting (1 for a
+        # bucket we know nothing about yet)
+        now = self.clock()
+        if now < self.global_reset:
+            return 0
+        bucket = self.buckets.get(self.routes.get(route, route))
+        if bucket is None:
+            return 1
+        if bucket.limit is not None and bucket.remaining <= 0 and now >= bucket.reset_at:
+            return bucket.limit
+        return max(bucket.remaining, 0)
+    
+    def throttled(self):
+        now = self.clock()
+        return sum(1 for bucket in self.buckets.values() if bucket.remaining <= 0 and bucket.reset_at > now)
@@ -0,0 +1,148 @@
+import heapq
+import itertools
+import threading
+import time
+
+MIN_INTERVAL = 1
+
+
+def channel_interval(channel, default=3600):
+    try:
+        interval = float(channel.get("interval", default))
+    except (TypeError, ValueError):
+        interval = default
+    return max(interval, MIN_INTERVAL)
+
+
+def channel_key(channel):
+    # Channels from the store carry a uid; anything else falls back to identity
+    return channel.get("uid") or id(channel)
+
+
+class ChannelScheduler:
+    # Min-heap keyed by each channel's next due time. Entries that are removed
+    # or rescheduled stay in the heap and are skipped lazily when popped, so
+    # add/remove/pop are all O(log n) no matter how many channels there are.
+    
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.listeners = []
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def add(self, key, item, interval, delay=0):
+        with self._lock:
+            self._discard(key)
+            self._push(key, item, interval, self.clock() + delay)
+        self._notify()
+    
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+        self._notify()
+    
+    def clear(self):
+        with self._lock:
+            self._heap = []
+            self._entries = {}
+        self._notify()
+    
+    def sync(self, channels, first_delay=None):
+        # Bring the schedule in line with the channel list: new channels are
+        # due immediately (or after first_delay(channel) seconds), removed
+        # ones are dropped and changed intervals keep their phase (next due =
+        # last due + new interval).
+        wanted = {channel_key(channel): channel for channel in channels}
+        with self._lock:
+            for key in list(self._entries):
+                if key not in wanted:
+                    self._discard(key)
+            now = self.clock()
+            for key, channel in wanted.items():
+                interval = channel_interval(channel)
+                entry = self._entries.get(key)
+                if entry is None:
+                    delay = first_delay(channel) if first_delay is not None else 0
+                    self._push(key, channel, interval, now + delay)
+                elif entry[3] != interval:
+                    due = entry[0] - entry[3] + interval
+                    self._discard(key)
+                    self._push(key, channel, interval, due)
+                else:
+                    entry[4] = channel
+        self._notify()
+    
+    def due(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[0]
+    
+    def next_due(self):
+        with self._lock:
+            self._prune()
+            return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now=None):
+        # Returns every item whose due time has passed and schedules its next
+        # run from the *scheduled* time rather than from now, so a slow post
+        # or a late wakeup does not push the whole cadence back. Slots missed
+        # entirely (e.g. after a suspend) are skipped instead of replayed.
+        if now is None:
+            now = self.clock()
+        due_items = []
+        with self._lock:
+            while True:
+                self._prune()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, _, key, interval, _ = heapq.heappop(self._heap)
+                item = self._entries.pop(key)[4]
+                next_due = due + interval
+                if next_due <= now:
+                    next_due += ((now - next_due) // interval + 1) * interval
+                self._push(key, item, interval, next_due)
+                due_items.append(item)
+        return due_items
+    
+    def wait(self, timeout=None):
+        # Sleeps until the next post is due, the schedule changes or wake()
+        # is called, whichever comes first.
+        self._wakeup.clear()
+        next_due = self.next_due()
+        if next_due is not None:
+            delay = max(next_due - self.clock(), 0)
+            timeout = delay if timeout is None else min(timeout, delay)
+        self._wakeup.wait(timeout)
+    
+    def wake(self):
+        self._notify()
+    
+    def _notify(self):
+        # Threaded waiters use the event; an asyncio engine registers a
+        # listener that forwards the wakeup into its own loop.
+        self._wakeup.set()
+        for listener in self.listeners:
+            listener()
+    
+    def _push(self, key, item, interval, due):
+        entry = [due, next(self._counter), key, interval, item]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+    
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[2] = None
+    
+    def _prune(self):
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
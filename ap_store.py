@@ -0,0 +1,212 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SAVE_DELAY = 0.5
+# Upper bound on how long a steady stream of edits can postpone a commit
+MAX_SAVE_DELAY = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    uid INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class ChannelStore:
+    # SQLite (WAL) backed store for settings and channels. Every change is
+    # recorded per channel and committed by a background thread once edits
+    # have been quiet for SAVE_DELAY seconds, in a single transaction, so a
+    # crash leaves either the old or the new state on disk, never half a file.
+    # Channels are identified by a "uid" the store assigns and keeps in the
+    # channel dict.
+    
+    def __init__(self, path, delay=SAVE_DELAY, log=print, warn=None):
+        self.path = path
+        self.delay = delay
+        self.log = log
+        self.warn = warn or log
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending_channels = {}
+        self._pending_settings = {}
+        self._next_uid = 1
+        self._dirty = threading.Event()
+        self._closing = False
+        self._writer = None
+    
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        row = self._db.execute("SELECT MAX(uid) FROM channels").fetchone()
+        self._next_uid = (row[0] or 0) + 1
+        self._writer = threading.Thread(target=self._write_loop, name="channel-store", daemon=True)
+        self._writer.start()
+    
+    def is_empty(self):
+        with self._db_lock:
+            channels = self._db.execute("SELECT 1 FROM channels LIMIT 1").fetchone()
+            settings = self._db.execute("SELECT 1 FROM settings LIMIT 1").fetchone()
+        return channels is None and settings is None
+    
+    def load(self):
+        with self._db_lock:
+            settings = {key: json.loads(value) for key, value in self._db.execute("SELECT key, value FROM settings")}
+            channels = []
+            for uid, data in self._db.execute("SELECT uid, data FROM channels ORDER BY uid"):
+                channel = json.loads(data)
+                channel["uid"] = uid
+                channels.append(channel)
+        return settings, channels
+    
+    def import_json(self, path):
+        # One-off migration from the old whole-file discord_auto_poster.json
+        with open(path, "r") as f:
+            data = json.load(f)
+        channels = data.pop("channels", [])
+        self.replace_all(data, channels)
+        return data, channels
+    
+    def replace_all(self, settings, channels):
+        for channel in channels:
+            self.assign_uid(channel)
+        with self._db_lock:
+            with self._transaction():
+                self._db.execute("DELETE FROM settings")
+                self._db.execute("DELETE FROM channels")
+                self._db.executemany(
+                    "INSERT INTO settings (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value)) for key, value in settings.items()]
+                )
+                self._db.executemany(
+                    "INSERT INTO channels (uid, data) VALUES (?, ?)",
+                    [(channel["uid"], self._encode(channel)) for channel in channels]
+                )
+    
+    def assign_uid(self, channel):
+        with self._lock:
+            if not channel.get("uid"):
+                channel["uid"] = self._next_uid
+            self._next_uid = max(self._next_uid, channel["uid"] + 1)
+        return channel["uid"]
+    
+    def put_channel(self, channel):
+        # The channel is serialised now, on the caller's thread, so later
+        # edits to the dict can't race with the background commit
+        uid = self.assign_uid(channel)
+        data = self._encode(channel)
+        with self._lock:
+            self._pending_channels[uid] = data
+        self._dirty.set()
+    
+    def put_channels(self, channels):
+        # Bulk upsert written straight away in one transaction instead of
+        # through the debounced queue (used by imports of many thousands)
+        rows = []
+        for channel in channels:
+            rows.append((self.assign_uid(channel), self._encode(channel)))
+        # Holding _db_lock from the pop to the write keeps a flush() from
+        # writing older queued data for these channels after ours
+        with self._db_lock:
+            with self._lock:
+                # Anything queued for these channels is older than what we write now
+                dropped = {uid: self._pending_channels.pop(uid) for uid, _ in rows if uid in self._pending_channels}
+            try:
+                with self._transaction():
+                    self._db.executemany("INSERT OR REPLACE INTO channels (uid, data) VALUES (?, ?)", rows)
+            except sqlite3.Error:
+                with self._lock:
+                    for uid, data in dropped.items():
+                        self._pending_channels.setdefault(uid, data)
+                raise
+    
+    def delete_channel(self, channel):
+        uid = channel.get("uid")
+        if not uid:
+            return
+        with self._lock:
+            self._pending_channels[uid] = None
+        self._dirty.set()
+    
+    def put_settings(self, settings):
+        with self._lock:
+            self._pending_settings.update((key, json.dumps(value)) for key, value in settings.items())
+        self._dirty.set()
+    
+    def flush(self):
+        # Swapped out and written under _db_lock, so the writes of flush()
+        # and put_channels() land in the order their data was taken
+        with self._db_lock:
+            with self._lock:
+                channels, self._pending_channels = self._pending_channels, {}
+                settings, self._pending_settings = self._pending_settings, {}
+            if not channels and not settings:
+                return
+            upserts = [(uid, data) for uid, data in channels.items() if data is not None]
+            deletes = [(uid,) for uid, data in channels.items() if data is None]
+            try:
+                with self._transaction():
+                    self._db.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", settings.items())
+                    self._db.executemany("INSERT OR REPLACE INTO channels (uid, data) VALUES (?, ?)", upserts)
+                    self._db.executemany("DELETE FROM channels WHERE uid = ?", deletes)
+            except sqlite3.Error as e:
+                # Put the changes back so the next flush retries them, unless
+                # something newer has been queued for the same key meanwhile
+                with self._lock:
+                    for uid, data in channels.items():
+                        self._pending_channels.setdefault(uid, data)
+                    for key, value in settings.items():
+                        self._pending_settings.setdefault(key, value)
+                self.warn(f"Error saving data: {e}")
+    
+    def close(self):
+        if self._db is None:
+            return
+        self._closing = True
+        self._dirty.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+        self._db = None
+    
+    def _write_loop(self):
+        while not self._closing:
+            self._dirty.wait()
+            # Debounce: keep waiting while edits keep coming in
+            deadline = time.monotonic() + MAX_SAVE_DELAY
+            while not self._closing and time.monotonic() < deadline:
+                self._dirty.clear()
+                if not self._dirty.wait(self.delay):
+                    break
+            self.flush()
+    
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+    
+    @staticmethod
+    def _encode(channel):
+        return json.dumps({key: value for key, value in channel.items() if key != "uid"}, separators=(",", ":"))
+
+
+def database_path(json_path):
+    return os.path.splitext(json_path)[0] + ".db"
@@ -0,0 +1,410 @@
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+RING_REPLICAS = 64
+STATUS_INTERVAL = 1.0
+RESTART_DELAY = 1.0
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shard_key(channel):
+    # Channels that share a webhook share a rate-limit bucket, so keep them
+    # in the same process; otherwise shard by the store's uid
+    return channel.get("webhook_url") or f"uid:{channel.get('uid')}"
+
+
+class HashRing:
+    # Consistent hash ring: adding or removing a node only moves the keys
+    # that land on that node's arcs, everything else stays put.
+    
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+    
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+    
+    def remove(self, node):
+        keep = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in keep]
+        self._owners = [owner for _, owner in keep]
+    
+    def node_for(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def run_worker(shard, channels, settings, commands, events, schedule=None):
+    # Entry point of a worker process: an ordinary DeliveryEngine for one
+    # shard. Logs and status go back to the supervisor on `events`.
+    # `schedule` has due times of channels saved by other shards.
+    from ap_http import DeliveryEngine
+    from ap_outbox import Outbox, shard_path
+    from ap_templates import PayloadCache
+    
+    def log(message):
+        events.put(("log", shard, message))
+    
+    def warn(message):
+        events.put(("warn", shard, message))
+    
+    def on_message(uid, message_id, message_hash):
+        events.put(("message", shard, (uid, message_id, message_hash)))
+    
+    payloads = PayloadCache(settings.get("snippets"))
+    # Each shard keeps its own outbox file so workers never contend on one
+    # database; a restarted worker resumes exactly where it died
+    outbox_path = settings.get("outbox_path")
+    if outbox_path:
+        outbox_path = shard_path(outbox_path, shard)
+    engine = DeliveryEngine(
+        log=log,
+        warn=warn,
+        concurrency=settings.get("max_concurrency", 8),
+        payloads=payloads,
+        outbox=Outbox(outbox_path),
+        on_message=on_message,
+        tokens=settings.get("bot_tokens")
+    )
+    by_uid = {channel["uid"]: channel for channel in channels}
+    engine.start(list(by_uid.values()), schedule)
+    # Due times of channels about to move here, sent ahead of their "put"
+    moved = {}
+    
+    try:
+        while True:
+            try:
+                command, argument = commands.get(timeout=STATUS_INTERVAL)
+            except queue.Empty:
+                command = None
+            if command == "stop":
+                break
+            elif command == "retire":
+                # The worker count shrank: posts still queued here go to the
+                # shards that own their channels now
+                events.put(("handoff", shard, engine.hand_off()))
+                break
+            elif command == "adopt":
+                engine.adopt(argument)
+            elif command == "due":
+                moved.update(argument)
+            elif command == "put":
+                channel = by_uid.get(argument["uid"])
+                if channel is None:
+                    by_uid[argument["uid"]] = argument
+                else:
+                    # Update in place so the scheduler keeps the channel's phase
+                    channel.clear()
+                    channel.update(argument)
+                engine.sync(list(by_uid.values()), moved)
+                moved.clear()
+            elif command == "remove":
+                if by_uid.pop(argument, None) is not None:
+                    engine.sync(list(by_uid.values()))
+            elif command == "snippets":
+                payloads.set_snippets(argument)
+            elif command == "tokens":
+                engine.set_tokens(argument)
+            
+            next_due = engine.scheduler.next_due()
+            events.put(("status", shard, {
+                "pid": os.getpid(),
+                "channels": len(by_uid),
+                "next_due_in": None if next_due is None else max(next_due - engine.scheduler.clock(), 0),
+                "rate_limited": engine.ratelimiter.hits,
+                "tokens": engine.tokens.distribution(),
+                "metrics": engine.metrics_snapshot()
+            }))
+    finally:
+        engine.close()
+
+
+class Supervisor:
+    # Shards the channel list across worker processes by consistent hash,
+    # restarts workers that die and funnels their logs and status back
+    # through `log` and status(). Message IDs of edit-in-place channels are
+    # passed to `on_message` like DeliveryEngine does.
+    
+    def __init__(self, workers, settings, log=print, on_message=None, warn=None):
+        self.workers = max(1, int(workers))
+        self.settings = dict(settings)
+        self.log = log
+        self.warn = warn or log
+        self.on_message = on_message
+        self.ring = HashRing(range(self.workers))
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.processes = {}
+        self.commands = {}
+        self.assignment = {}
+        self.sent = {}
+        self.statuses = {}
+        # Per worker process (by pid), the latest data of every channel it
+        # has posted for; workers only ship histograms that changed
+        self.channel_metrics = {}
+        # Counters and histograms of workers that have exited, so the totals
+        # keep growing across restarts and resizes
+        from ap_metrics import Metrics
+        self.past_metrics = Metrics()
+        self._exited = set()
+        self.restarts = 0
+        self._stopping = False
+        self._monitor = None
+        self._lock = threading.Lock()
+        # Guards statuses and the metrics between the monitor thread and
+        # readers such as the UI and the metrics exporter
+        self._metrics_lock = threading.Lock()
+    
+    @property
+    def running(self):
+        return self._monitor is not None and not self._stopping
+    
+    def start(self, channels, rows=(), schedule=None):
+        # `rows` and `schedule` are the posts and due times a single-process
+        # run left behind; shard files of a run with more workers are taken
+        # over here too, so nothing queued is lost when the count changes
+        from ap_outbox import drain_outbox, merge_schedule, read_schedule, shard_paths
+        
+        self._stopping = False
+        rows = list(rows)
+        due = dict(schedule or {})
+        path = self.settings.get("outbox_path")
+        for shard, shard_file in shard_paths(path).items() if path else ():
+            if shard < self.workers:
+                merge_schedule(due, read_schedule(shard_file))
+            else:
+                shard_rows, shard_due = drain_outbox(shard_file)
+                rows += shard_rows
+                merge_schedule(due, shard_due)
+        with self._lock:
+            for channel in channels:
+                self._remember(channel, self.ring.node_for(shard_key(channel)))
+            for shard in range(self.workers):
+                self._spawn(shard, due)
+            self._adopt(rows)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="shard-supervisor", daemon=True)
+        self._monitor.start()
+    
+    def stop(self):
+        self._stopping = True
+        with self._lock:
+            for shard, commands in self.commands.items():
+                commands.put(("stop", None))
+            for shard, process in self.processes.items():
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+                self._exit(shard)
+            self.processes.clear()
+            self.commands.clear()
+        if self._monitor is not None:
+            self._monitor.join(timeout=5)
+            self._monitor = None
+    
+    def sync(self, channels):
+        # Only channels that were added, edited or removed are sent, and only
+        # to the shard that owns them
+        with self._lock:
+            seen = set()
+            moved_due = None
+            for channel in channels:
+                uid = channel.get("uid")
+                seen.add(uid)
+                fingerprint = json.dumps(channel, sort_keys=True)
+                shard = self.ring.node_for(shard_key(channel))
+                previous = self.assignment.get(uid)
+                if previous == shard and self.sent.get(uid) == fingerprint:
+                    continue
+                if previous is not None and previous != shard:
+                    self._send(previous, "remove", uid)
+                    # The new owner picks the channel up where the old one
+                    # left off instead of posting it again right away
+                    if moved_due is None:
+                        moved_due = self._saved_due()
+                    if uid in moved_due:
+                        self._send(shard, "due", {uid: moved_due[uid]})
+                self._remember(channel, shard, fingerprint)
+                self._send(shard, "put", channel)
+            for uid in [uid for uid in self.assignment if uid not in seen]:
+                self._send(self.assignment.pop(uid), "remove", uid)
+                self.sent.pop(uid, None)
+    
+    def set_snippets(self, snippets):
+        self.settings["snippets"] = dict(snippets)
+        with self._lock:
+            for shard in self.commands:
+                self._send(shard, "snippets", self.settings["snippets"])
+    
+    def set_tokens(self, tokens):
+        self.settings["bot_tokens"] = list(tokens)
+        with self._lock:
+            for shard in self.commands:
+                self._send(shard, "tokens", self.settings["bot_tokens"])
+    
+    def resize(self, workers, channels):
+        # Changing the worker count only moves the channels whose ring
+        # position now belongs to a different worker. Retired workers hand
+        # their queued and retrying posts to the new owners (see _adopt).
+        workers = max(1, int(workers))
+        with self._lock:
+            for shard in range(self.workers, workers):
+                self.ring.add(shard)
+            for shard in range(workers, self.workers):
+                self.ring.remove(shard)
+            old_workers, self.workers = self.workers, workers
+            for shard in range(old_workers, workers):
+                self._spawn(shard)
+            for shard in range(workers, old_workers):
+                self.commands.pop(shard).put(("retire", None))
+                self.processes[shard].join(timeout=5)
+                self._exit(shard)
+                del self.processes[shard]
+        # Channels of retired shards still have them as their previous owner,
+        # so sync() moves them, due times included
+        self.sync(channels)
+    
+    def status(self):
+        with self._metrics_lock:
+            statuses = list(self.statuses.values())
+        due = [status["next_due_in"] for status in statuses if status.get("next_due_in") is not None]
+        # Every worker has its own pool over the same token list
+        tokens = {}
+        for status in statuses:
+            for label, sent, disabled in status.get("tokens", ()):
+                total, was_disabled = tokens.get(label, (0, None))
+                tokens[label] = (total + sent, was_disabled or disabled)
+        return {
+            "workers": len(self.processes),
+            "alive": sum(1 for process in self.processes.values() if process.is_alive()),
+            "channels": sum(status.get("channels", 0) for status in statuses),
+            "next_due_in": min(due) if due else None,
+            "restarts": self.restarts,
+            "tokens": [(label, sent, disabled) for label, (sent, disabled) in tokens.items()]
+        }
+    
+    def metrics(self):
+        from ap_metrics import Metrics
+        
+        with self._metrics_lock:
+            snapshots = [
+                dict(status["metrics"], channels=self.channel_metrics.get(status["pid"], {}))
+                for status in self.statuses.values() if "metrics" in status
+            ]
+            return Metrics.merged(snapshots, self.past_metrics)
+    
+    def _exit(self, shard):
+        # Moves the last reported totals of a shard's worker process, which
+        # has exited, into past_metrics; anything it still sends is dropped
+        pid = self.processes[shard].pid
+        with self._metrics_lock:
+            status = self.statuses.pop(shard, None)
+            channels = self.channel_metrics.pop(pid, {})
+            if status is not None and "metrics" in status:
+                self.past_metrics.add(dict(status["metrics"], channels=channels))
+            self._exited.add(pid)
+    
+    def _remember(self, channel, shard, fingerprint=None):
+        uid = channel.get("uid")
+        self.assignment[uid] = shard
+        self.sent[uid] = fingerprint or json.dumps(channel, sort_keys=True)
+    
+    def _send(self, shard, command, argument):
+        commands = self.commands.get(shard)
+        if commands is not None:
+            commands.put((command, argument))
+    
+    def _shard_channels(self, shard):
+        return [json.loads(self.sent[uid]) for uid, owner in self.assignment.items() if owner == shard]
+    
+    def _adopt(self, rows):
+        # Sends outbox rows of a retired worker to the shards that own their
+        # channels now; rows of channels that were removed meanwhile go by uid
+        by_shard = {}
+        for row in rows:
+            sent = self.sent.get(row[0])
+            key = shard_key(json.loads(sent)) if sent else f"uid:{row[0]}"
+            by_shard.setdefault(self.ring.node_for(key), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            self._send(shard, "adopt", shard_rows)
+    
+    def _saved_due(self):
+        from ap_outbox import merge_schedule, read_schedule, shard_paths
+        
+        due = {}
+        path = self.settings.get("outbox_path")
+        for shard_file in shard_paths(path).values() if path else ():
+            merge_schedule(due, read_schedule(shard_file))
+        return due
+    
+    def _spawn(self, shard, due=None):
+        channels = self._shard_channels(shard)
+        if due:
+            due = {channel["uid"]: due[channel["uid"]] for channel in channels if channel.get("uid") in due}
+        commands = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker,
+            args=(shard, channels, self.settings, commands, self.events, due),
+            name=f"ap-worker-{shard}",
+            daemon=True
+        )
+        process.start()
+        self.processes[shard] = process
+        self.commands[shard] = commands
+    
+    def _monitor_loop(self):
+        last_restart = {}
+        while not self._stopping:
+            try:
+                kind, shard, payload = self.events.get(timeout=0.5)
+                if kind == "log":
+                    self.log(f"[worker {shard}] {payload}")
+                elif kind == "warn":
+                    self.warn(f"[worker {shard}] {payload}")
+                elif kind == "message":
+                    if self.on_message is not None:
+                        self.on_message(*payload)
+                elif kind == "handoff":
+                    with self._lock:
+                        self._adopt(payload)
+                elif kind == "status":
+                    with self._metrics_lock:
+                        # A status can still be queued from a worker that
+                        # has exited since; its totals are in past_metrics
+                        if payload["pid"] not in self._exited:
+                            self.statuses[shard] = payload
+                            self.channel_metrics.setdefault(payload["pid"], {}).update(
+                                payload.get("metrics", {}).get("channels", {})
+                            )
+            except queue.Empty:
+                pass
+            
+            with self._lock:
+                if self._stopping:
+                    break
+                now = time.monotonic()
+                for shard, process in list(self.processes.items()):
+                    if process.is_alive() or now - last_restart.get(shard, 0) < RESTART_DELAY:
+                        continue
+                    self.warn(f"Worker {shard} exited with code {process.exitcode}, restarting")
+                    last_restart[shard] = now
+                    self.restarts += 1
+                    self._exit(shard)
+                    self._spawn(shard)
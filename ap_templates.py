@@ -0,0 +1,169 @@
+import json
+import re
+from datetime import datetime
+
+# {name} placeholders; {{ and }} are literal braces
+TOKEN = re.compile(r"\{\{|\}\}|\{([a-z_]+(?::[\w-]+)?)\}")
+MAX_SNIPPET_DEPTH = 5
+
+# Values that depend on the clock, with the format that decides how often
+# they change (a template using only {date} re-renders once a day)
+CLOCK_FIELDS = {
+    "time": "%H:%M",
+    "date": "%Y-%m-%d",
+    "datetime": "%Y-%m-%d %H:%M",
+    # When the post was queued, to the microsecond (changes every post)
+    "timestamp": "%Y-%m-%dT%H:%M:%S.%f"
+}
+CHANNEL_FIELDS = {"mention", "user_id", "channel_id"}
+
+
+class Template:
+    # A message compiled once into literal text and placeholder names.
+    # Unknown placeholders are kept as written so plain text with braces in
+    # it still posts unchanged.
+    
+    def __init__(self, source, snippets=None, depth=0):
+        self.source = source
+        self.parts = []
+        self.fields = set()
+        position = 0
+        literal = []
+        for match in TOKEN.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+            token = match.group(0)
+            name = match.group(1)
+            if token in ("{{", "}}"):
+                literal.append(token[0])
+            elif name.startswith("snippet:") and snippets is not None and depth < MAX_SNIPPET_DEPTH:
+                snippet = snippets.get(name.split(":", 1)[1])
+                if snippet is None:
+                    literal.append(token)
+                    continue
+                inner = Template(snippet, snippets, depth + 1)
+                for part in inner.parts:
+                    if isinstance(part, str):
+                        literal.append(part)
+                    else:
+                        self._flush(literal)
+                        self.parts.append(part)
+                self.fields |= inner.fields
+            elif name in CLOCK_FIELDS or name in CHANNEL_FIELDS or name == "counter":
+                self._flush(literal)
+                self.parts.append((name,))
+                self.fields.add(name)
+            else:
+                literal.append(token)
+        literal.append(source[position:])
+        self._flush(literal)
+    
+    def _flush(self, literal):
+        text = "".join(literal)
+        literal.clear()
+        if text:
+            self.parts.append(text)
+    
+    @property
+    def static(self):
+        return not self.fields
+    
+    def render(self, values):
+        return "".join(part if isinstance(part, str) else values[part[0]] for part in self.parts)
+
+
+class PayloadCache:
+    # Compiled template and last serialized request body per channel. The
+    # body is only rebuilt when the template, the snippets or one of the
+    # values the template actually uses has changed; otherwise the exact
+    # same bytes are reused for every post.
+    
+    def __init__(self, snippets=None):
+        self.snippets = dict(snippets or {})
+        self.version = 0
+        self.entries = {}
+        self.counters = {}
+    
+    def set_snippets(self, snippets):
+        snippets = dict(snippets or {})
+        if snippets != self.snippets:
+            self.snippets = snippets
+            self.version += 1
+    
+    def compile(self, channel):
+        entry = {
+            "message": channel.get("message", ""),
+            "user_id": channel.get("user_id", ""),
+            "channel_id": channel.get("channel_id", ""),
+            "version": self.version,
+            "key": None,
+            "body": None
+        }
+        entry["template"] = Template(entry["message"], self.snippets)
+        self.entries[id(channel)] = entry
+        return entry
+    
+    def forget(self, channel):
+        self.entries.pop(id(channel), None)
+        self.counters.pop(id(channel), None)
+    
+    def _entry(self, channel):
+        entry = self.entries.get(id(channel))
+        if (entry is None or entry["version"] != self.version
+                or entry["message"] != channel.get("message", "")
+                or entry["user_id"] != channel.get("user_id", "")
+                or entry["channel_id"] != channel.get("channel_id", "")):
+            entry = self.compile(channel)
+        return entry
+    
+    def render(self, channel, now=None):
+        # Returns the message text for the next post of this channel
+        return self._render(channel, now)[0]
+    
+    def payload(self, channel, now=None):
+        return self._render(channel, now)[1]
+    
+    def _render(self, channel, now):
+        entry = self._entry(channel)
+        template = entry["template"]
+        counter = self.counters.get(id(channel), 0) + 1
+        self.counters[id(channel)] = counter
+        
+        values = {}
+        for name in template.fields:
+            if name in CLOCK_FIELDS:
+                if now is None:
+                    now = datetime.now()
+                values[name] = now.strftime(CLOCK_FIELDS[name])
+            elif name == "counter":
+                values[name] = str(counter)
+            elif name == "mention":
+                values[name] = f"<@{entry['user_id']}>" if entry["user_id"] else ""
+            else:
+                values[name] = str(entry[name])
+        
+        key = tuple(sorted(values.items()))
+        if entry["key"] != key or entry["body"] is None:
+            content = template.render(values)
+            data = {"content": content}
+            if "mention" in template.fields and entry["user_id"]:
+                # Only ping the configured user, never @everyone/roles
+                data["allowed_mentions"] = {"parse": [], "users": [entry["user_id"]]}
+            entry["content"] = content
+            entry["body"] = json.dumps(data).encode("utf-8")
+            entry["key"] = key
+        return entry["content"], entry["body"]
+
+
+def parse_snippets(text):
+    # "name: text" per line, as typed into Bot Settings
+    snippets = {}
+    for line in text.splitlines():
+        name, sep, value = line.partition(":")
+        if sep and name.strip():
+            snippets[name.strip()] = value.strip().replace("\\n", "\n")
+    return snippets
+
+
+def format_snippets(snippets):
+    return "\n".join(f"{name}: {value}".replace("\n", "\\n") for name, value in snippets.items())
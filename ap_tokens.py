@@ -0,0 +1,90 @@
+import re
+from urllib.parse import urlsplit
+
+from ap_ratelimit import RateLimiter
+
+# Channels without a webhook post through the bot API with one of the
+# configured tokens instead
+API_BASE = "https://discord.com/api/v10"
+TOKEN_SEPARATORS = re.compile(r"[\s,]+")
+
+
+def parse_tokens(text):
+    # Tokens as typed into Bot Settings: separated by commas or whitespace,
+    # duplicates dropped, order kept (it defines each token's number)
+    tokens = []
+    for token in TOKEN_SEPARATORS.split(text or ""):
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def channel_messages_url(channel_id, base=API_BASE):
+    return f"{base}/channels/{channel_id}/messages"
+
+
+def is_bot_url(url):
+    return "/webhooks/" not in urlsplit(url).path
+
+
+class BotToken:
+    # One identity in the pool. Discord rate limits (including the global
+    # one) are per token, so every token has its own RateLimiter.
+    
+    __slots__ = ("index", "token", "ratelimiter", "sent", "inflight", "disabled")
+    
+    def __init__(self, index, token):
+        self.index = index
+        self.token = token
+        self.ratelimiter = RateLimiter()
+        self.sent = 0
+        self.inflight = 0
+        self.disabled = None
+    
+    @property
+    def label(self):
+        # Never log the token itself
+        return f"token #{self.index + 1}"
+    
+    @property
+    def headers(self):
+        return {"Authorization": f"Bot {self.token}"}
+
+
+class TokenPool:
+    # Hands out bot tokens for bot-API posts. A channel pinned to a token
+    # ("token": N, 1-based) always uses it while it works; everything else
+    # goes to the token with the most headroom in that route's bucket, so
+    # adding tokens adds rate-limit budget. Tokens Discord rejects are
+    # disabled until the token list is changed.
+    
+    def __init__(self, tokens=()):
+        self.tokens = [BotToken(index, token) for index, token in enumerate(tokens)]
+    
+    def __len__(self):
+        return len(self.tokens)
+    
+    def __iter__(self):
+        return iter(self.tokens)
+    
+    def same_tokens(self, tokens):
+        return [token.token for token in self.tokens] == list(tokens)
+    
+    def usable(self):
+        return [token for token in self.tokens if token.disabled is None]
+    
+    def choose(self, route, pin=None, exclude=()):
+        candidates = [token for token in self.tokens if token.disabled is None and token not in exclude]
+        if not candidates:
+            return None
+        if pin:
+            for token in candidates:
+                if token.index == pin - 1:
+                    return token
+        return max(candidates, key=lambda token: (token.ratelimiter.headroom(route), -token.inflight, -token.sent))
+    
+    def disable(self, token, reason):
+        token.disabled = reason
+    
+    def distribution(self):
+        return [(token.label, token.sent, token.disabled) for token in self.tokens]
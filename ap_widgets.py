@@ -0,0 +1,145 @@
+import customtkinter as ctk
+
+
+class VirtualList(ctk.CTkFrame):
+    # Scrollable list that only creates enough row buttons to fill the
+    # visible area and re-labels them as you scroll, so it costs the same
+    # whether it shows ten channels or ten thousand.
+    #
+    # `rows` is a sequence of opaque keys (e.g. channel indexes); `label(key)`
+    # returns the text for a row and `on_select(key)` is called on click.
+    
+    def __init__(self, master, label, on_select, row_height=36, **kwargs):
+        super().__init__(master, **kwargs)
+        self.label = label
+        self.on_select = on_select
+        self.row_height = row_height
+        self.rows = []
+        self.selected = None
+        self.offset = 0
+        self.pool = []
+        self.shown = []
+        
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        
+        self.body = ctk.CTkFrame(self, fg_color="transparent")
+        self.body.grid(row=0, column=0, sticky="nsew")
+        self.body.grid_columnconfigure(0, weight=1)
+        # The pool is sized from the body's height, so the body must not grow
+        # to fit the pool
+        self.body.grid_propagate(False)
+        
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        
+        self.body.bind("<Configure>", self.on_resize)
+        for widget in (self, self.body):
+            widget.bind("<MouseWheel>", self.on_mousewheel)
+            widget.bind("<Button-4>", lambda event: self.scroll_by(-1))
+            widget.bind("<Button-5>", lambda event: self.scroll_by(1))
+    
+    @property
+    def visible_rows(self):
+        return len(self.pool)
+    
+    def set_rows(self, rows):
+        self.rows = rows
+        self.offset = min(self.offset, self.max_offset())
+        self.refresh()
+    
+    def refresh(self):
+        # Row labels may have changed underneath us (e.g. a channel was edited)
+        self.shown = [None if state is None else () for state in self.shown]
+        self.render()
+    
+    def select(self, key):
+        self.selected = key
+        self.render()
+    
+    def see(self, key):
+        # Scrolls just enough to bring `key` into view
+        try:
+            position = self.rows.index(key)
+        except ValueError:
+            return
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + self.visible_rows:
+            self.offset = position - self.visible_rows + 1
+        self.offset = max(0, min(self.offset, self.max_offset()))
+        self.render()
+    
+    def max_offset(self):
+        return max(len(self.rows) - self.visible_rows, 0)
+    
+    def scroll_by(self, rows):
+        offset = max(0, min(self.offset + rows, self.max_offset()))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+    
+    def on_mousewheel(self, event):
+        # Windows/macOS report wheel deltas in multiples of 120 (or 1 on macOS)
+        step = -1 if event.delta > 0 else 1
+        self.scroll_by(step * max(1, abs(event.delta) // 120))
+    
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = max(0, min(int(float(value) * len(self.rows)), self.max_offset()))
+            self.render()
+        elif action == "scroll":
+            amount = int(value) * (self.visible_rows if unit == "pages" else 1)
+            self.scroll_by(amount)
+    
+    def on_resize(self, event):
+        wanted = max(1, event.height // self.row_height)
+        if wanted == len(self.pool):
+            return
+        while len(self.pool) < wanted:
+            slot = len(self.pool)
+            button = ctk.CTkButton(self.body, text="", anchor="w", height=self.row_height - 8,
+                                   command=lambda slot=slot: self.on_click(slot))
+            button.bind("<MouseWheel>", self.on_mousewheel)
+            button.bind("<Button-4>", lambda event: self.scroll_by(-1))
+            button.bind("<Button-5>", lambda event: self.scroll_by(1))
+            self.pool.append(button)
+            self.shown.append(None)
+        while len(self.pool) > wanted:
+            self.pool.pop().destroy()
+            self.shown.pop()
+        self.offset = min(self.offset, self.max_offset())
+        self.render()
+    
+    def on_click(self, slot):
+        position = self.offset + slot
+        if position < len(self.rows):
+            self.on_select(self.rows[position])
+    
+    def render(self):
+        default_color = ctk.ThemeManager.theme["CTkButton"]["fg_color"]
+        for slot, button in enumerate(self.pool):
+            position = self.offset + slot
+            if position >= len(self.rows):
+                if self.shown[slot] is not None:
+                    button.grid_remove()
+                    self.shown[slot] = None
+                continue
+            key = self.rows[position]
+            state = (self.label(key), key == self.selected)
+            # Reconfiguring a CTk widget redraws it, so skip unchanged rows
+            if state == self.shown[slot]:
+                continue
+            button.configure(
+                text=state[0],
+                fg_color=("gray40", "gray30") if state[1] else default_color
+            )
+            if self.shown[slot] is None:
+                button.grid(row=slot, column=0, padx=10, pady=4, sticky="ew")
+            self.shown[slot] = state
+        
+        total = len(self.rows)
+        if total == 0 or total <= self.visible_rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.visible_rows) / total)
@@ -1,18 +1,80 @@
+import argparse
 import customtkinter as ctk
 import psutil
-import platform
-import socket
-from datetime import datetime
-import threading
-import time
 from tkinter import messagebox
+from menu_disks import DiskMonitor
+from menu_history import TOP_PROCESSES
+from menu_hosts import AgentClient, Host
+from menu_processes import ProcessTable
+from menu_sampler import Sampler, host_facts, sample_system
+from menu_widgets import Sparkline, VirtualTable
 
 # Set appearance mode and default color theme
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 
+# How often the Tk thread picks up new snapshots from the sampler
+SAMPLE_POLL_MS = 250
+# Pause in typing before the process search runs
+SEARCH_DEBOUNCE_MS = 150
+# System stats are sampled every second for the finest history tier;
+# processes less often while the Process Manager isn't open
+SYSTEM_SAMPLE_INTERVAL = 1.0
+PROCESS_BACKGROUND_INTERVAL = 10.0
+# History range choices: tier of menu_history.TIERS and the point kind
+# drawn (the peak of each bucket for the coarse tiers, so spikes stay visible)
+HISTORY_RANGES = {"5 min": (0, "avg"), "1 hour": (1, "max"), "24 hours": (2, "max")}
+CORE_COLUMNS = 4
+# Name of this machine in the host menu; menu_agent hosts go by address
+LOCAL_HOST = "This Machine"
+# System Info host facts: label and menu_sampler.HostFacts field
+HOST_FACTS = [
+    ("System", "system"),
+    ("Node Name", "node"),
+    ("Release", "release"),
+    ("Version", "version"),
+    ("Machine", "machine"),
+    ("Processor", "processor"),
+    ("Boot Time", "boot_time"),
+    ("IP Address", "ip_address")
+]
+# Disk Info status text and colour by menu_disks.MountInfo state
+DISK_STATES = {
+    "ok": ("OK", ("gray10", "gray90")),
+    "probing": ("Probing...", "gray"),
+    "hung": ("Not responding", "red"),
+    "denied": ("Permission denied", "orange")
+}
+
+# Process table columns: heading, width and sort key
+PROCESS_COLUMNS = [
+    ("PID", 70, lambda proc: proc.pid),
+    ("Name", 220, lambda proc: proc.name.lower()),
+    ("User", 110, lambda proc: proc.username.lower()),
+    ("CPU %", 80, lambda proc: proc.cpu_percent or 0),
+    ("Memory %", 90, lambda proc: proc.memory_percent or 0),
+    ("Status", 100, lambda proc: proc.status or "")
+]
+
+def format_rate(bytes_per_second):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.1f} {unit}"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GB/s"
+
+def process_cells(proc):
+    return (
+        str(proc.pid),
+        proc.name,
+        proc.username,
+        f"{proc.cpu_percent or 0:.1f}%",
+        f"{proc.memory_percent or 0:.1f}%",
+        proc.status or ""
+    )
+
 class SystemInfoApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, agents=()):
         super().__init__()
         
         # Configure window
@@ -47,21 +109,32 @@ class SystemInfoApp(ctk.CTk):
                                            command=self.show_process_manager)
         self.process_button.grid(row=3, column=0, padx=20, pady=10)
         
+        # Host option menu: this machine and any menu_agent subscribed to
+        self.host_label = ctk.CTkLabel(self.sidebar_frame, text="Host:", anchor="w")
+        self.host_label.grid(row=5, column=0, padx=20, pady=(10, 0))
+        self.host_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, values=[LOCAL_HOST],
+                                                  command=self.change_host_event)
+        self.host_optionemenu.grid(row=6, column=0, padx=20, pady=(10, 0))
+        self.host_status_label = ctk.CTkLabel(self.sidebar_frame, text="", text_color="gray", wraplength=160)
+        self.host_status_label.grid(row=7, column=0, padx=20, pady=(5, 0))
+        self.add_agent_button = ctk.CTkButton(self.sidebar_frame, text="Add Agent...", command=self.add_agent)
+        self.add_agent_button.grid(row=8, column=0, padx=20, pady=(5, 10))
+        
         # Appearance mode option menu
         self.appearance_mode_label = ctk.CTkLabel(self.sidebar_frame, text="Appearance Mode:", anchor="w")
-        self.appearance_mode_label.grid(row=5, column=0, padx=20, pady=(10, 0))
+        self.appearance_mode_label.grid(row=9, column=0, padx=20, pady=(10, 0))
         self.appearance_mode_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, 
                                                             values=["Light", "Dark", "System"],
                                                             command=self.change_appearance_mode_event)
-        self.appearance_mode_optionemenu.grid(row=6, column=0, padx=20, pady=(10, 10))
+        self.appearance_mode_optionemenu.grid(row=10, column=0, padx=20, pady=(10, 10))
         
         # Scaling option menu
         self.scaling_label = ctk.CTkLabel(self.sidebar_frame, text="UI Scaling:", anchor="w")
-        self.scaling_label.grid(row=7, column=0, padx=20, pady=(10, 0))
+        self.scaling_label.grid(row=11, column=0, padx=20, pady=(10, 0))
         self.scaling_optionemenu = ctk.CTkOptionMenu(self.sidebar_frame, 
                                                     values=["80%", "90%", "100%", "110%", "120%"],
                                                     command=self.change_scaling_event)
-        self.scaling_optionemenu.grid(row=8, column=0, padx=20, pady=(10, 20))
+        self.scaling_optionemenu.grid(row=12, column=0, padx=20, pady=(10, 20))
         
         # Set default values
         self.appearance_mode_optionemenu.set("System")
@@ -84,15 +157,48 @@ class SystemInfoApp(ctk.CTk):
         self.content_frame.grid_columnconfigure(0, weight=1)
         
         # Initialize data
-        self.process_list = []
-        self.update_thread = None
-        self.stop_thread = False
+        self.process_table = None
+        self.search_entry = None
+        self.search_job = None
+        # Kept across refreshes (and views) so CPU % are real deltas
+        self.process_cache = ProcessTable()
+        self.sampler = Sampler()
+        self.poll_job = None
+        # Every host keeps its own snapshots, history and search index; the
+        # views show the selected one
+        self.host = Host(LOCAL_HOST, self.sampler)
+        self.hosts = {LOCAL_HOST: self.host}
+        self.host_status = None
+        self.update_host_status()
+        # Probe results wake the sampler so they show up straight away
+        self.disk_monitor = DiskMonitor(on_result=lambda: self.sampler.refresh("disks"))
+        self.disk_snapshot = None
+        self.disk_info_frame = None
+        self.disk_layout = None
+        self.history_range = "5 min"
+        # Views are built once and then hidden and shown; each has its own
+        # live widgets by key and the value each shows
+        self.views = {}
+        self.view_bindings = {}
+        self.current_view = None
+        # Live widgets of the visible view (an empty dict while switching)
+        self.view_widgets = {}
+        self.view_values = {}
+        # Sparklines of the System Info view: by series name, and the top
+        # process rows in order
+        self.history_sparklines = {}
+        self.top_sparklines = []
+        # Per-core sparklines are laid out for the selected host's core count
+        self.cores_frame = None
+        self.core_count = None
+        
+        # Start sampling
+        self.start_sampler()
+        for address in agents:
+            self.add_agent(address, select=False)
         
         # Show system info by default
         self.show_system_info()
-        
-        # Start update thread
-        self.start_update_thread()
     
     def change_appearance_mode_event(self, new_appearance_mode):
         ctk.set_appearance_mode(new_appearance_mode)
@@ -101,172 +207,337 @@ class SystemInfoApp(ctk.CTk):
         new_scaling_float = int(new_scaling.replace("%", "")) / 100
         ctk.set_widget_scaling(new_scaling_float)
     
-    def clear_content_frame(self):
-        for widget in self.content_frame.winfo_children():
-            widget.destroy()
+    def change_host_event(self, name):
+        self.select_host(self.hosts[name])
+    
+    def add_agent(self, address=None, select=True):
+        # Subscribes to a menu_agent; its host is watched from then on,
+        # whether it is selected or not
+        if address is None:
+            dialog = ctk.CTkInputDialog(text="Agent address (host:port or unix:/path):", title="Add Agent")
+            address = (dialog.get_input() or "").strip()
+            if not address:
+                return
+        host = self.hosts.get(address)
+        if host is None:
+            try:
+                client = AgentClient(address)
+            except ValueError as e:
+                messagebox.showerror("Error", f"Invalid agent address {address}: {e}")
+                return
+            client.start()
+            host = self.hosts[address] = Host(address, client, remote=True)
+            self.host_optionemenu.configure(values=list(self.hosts))
+        if select:
+            self.select_host(host)
+    
+    def select_host(self, host):
+        if host is self.host:
+            return
+        self.host = host
+        self.host_optionemenu.set(host.name)
+        self.update_host_status()
+        # Disks are only probed (and processes only ended) on this machine
+        self.disk_button.configure(state="disabled" if host.remote else "normal")
+        # Show the same view again, now with this host's figures
+        view = self.current_view
+        self.leave_view()
+        if view == "processes":
+            self.show_process_manager()
+        else:
+            self.show_system_info()
+    
+    def update_host_status(self):
+        status = self.host.source.status if self.host.remote else "Local"
+        if status != self.host_status:
+            self.host_status = status
+            self.host_status_label.configure(text=status)
+    
+    def show_view(self, name, title, build):
+        # Builds the view the first time it is shown; after that switching
+        # only hides one frame and shows another
+        if name == self.current_view:
+            return
+        self.leave_view()
+        self.title_label.configure(text=title)
+        self.view_widgets, self.view_values = self.view_bindings.setdefault(name, ({}, {}))
+        frame = self.views.get(name)
+        if frame is None:
+            frame = self.views[name] = ctk.CTkFrame(self.content_frame, fg_color="transparent")
+            frame.grid_columnconfigure(0, weight=1)
+            build(frame)
+        frame.grid(row=0, column=0, sticky="nsew")
+        self.current_view = name
+    
+    def leave_view(self):
+        if self.current_view is None:
+            return
+        self.views[self.current_view].grid_remove()
+        self.current_view = None
+        # Hidden widgets keep their values and are caught up when shown
+        self.view_widgets = {}
+        self.view_values = {}
+        self.sampler.remove("disks")
+        # Processes keep being sampled for their history, just less often
+        self.sampler.add("processes", self.process_cache.snapshot, PROCESS_BACKGROUND_INTERVAL)
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+            self.search_job = None
+    
+    def bind_widget(self, key, widget):
+        # Registers a widget of the visible view for update_widget()
+        self.view_widgets[key] = widget
+        return widget
+    
+    def update_widget(self, key, value):
+        # Labels get text, progress bars a fraction; nothing is redrawn
+        # unless the value changed or the widget isn't on screen
+        widget = self.view_widgets.get(key)
+        if widget is None or self.view_values.get(key) == value:
+            return
+        self.view_values[key] = value
+        if isinstance(widget, ctk.CTkProgressBar):
+            widget.set(value)
+        else:
+            widget.configure(text=value)
     
     def show_system_info(self):
-        self.clear_content_frame()
-        self.title_label.configure(text="System Information")
-        
-        # Get system information
-        uname = platform.uname()
-        boot_time = datetime.fromtimestamp(psutil.boot_time())
-        
+        self.show_view("system", "System Information", self.build_system_info)
+        
+        # Show the last known values straight away rather than zeros (or
+        # another host's values)
+        self.apply_host_facts(self.host.facts)
+        if self.host.system is not None:
+            self.apply_system_snapshot(self.host.system)
+        else:
+            for key in ("cpu_percent", "memory_percent", "memory_total", "memory_available", "memory_used"):
+                self.update_widget(key, "-")
+            self.update_widget("cpu_progress", 0)
+            self.update_widget("memory_progress", 0)
+        self.update_history_view()
+    
+    def build_system_info(self, frame):
         # Create system info frame
-        sys_info_frame = ctk.CTkFrame(self.content_frame)
+        sys_info_frame = ctk.CTkFrame(frame)
         sys_info_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
         sys_info_frame.grid_columnconfigure(1, weight=1)
         
-        # System information labels
-        info_labels = [
-            ("System", uname.system),
-            ("Node Name", uname.node),
-            ("Release", uname.release),
-            ("Version", uname.version),
-            ("Machine", uname.machine),
-            ("Processor", uname.processor),
-            ("Boot Time", boot_time.strftime("%Y-%m-%d %H:%M:%S")),
-            ("IP Address", socket.gethostbyname(socket.gethostname()))
-        ]
-        
-        for i, (label, value) in enumerate(info_labels):
+        # System information labels, filled in once the host facts have
+        # been looked up in the background (the IP lookup can take seconds)
+        for i, (label, key) in enumerate(HOST_FACTS):
             ctk.CTkLabel(sys_info_frame, text=f"{label}:", font=ctk.CTkFont(weight="bold")).grid(
                 row=i, column=0, sticky="w", padx=10, pady=5)
-            ctk.CTkLabel(sys_info_frame, text=value).grid(
+            self.bind_widget(f"host_{key}", ctk.CTkLabel(sys_info_frame, text="...")).grid(
                 row=i, column=1, sticky="w", padx=10, pady=5)
         
         # CPU usage frame
-        cpu_frame = ctk.CTkFrame(self.content_frame)
+        cpu_frame = ctk.CTkFrame(frame)
         cpu_frame.grid(row=1, column=0, sticky="ew", padx=10, pady=10)
         cpu_frame.grid_columnconfigure(1, weight=1)
         
         ctk.CTkLabel(cpu_frame, text="CPU Usage:", font=ctk.CTkFont(weight="bold")).grid(
             row=0, column=0, sticky="w", padx=10, pady=5)
-        self.cpu_usage_label = ctk.CTkLabel(cpu_frame, text="0%")
-        self.cpu_usage_label.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+        self.bind_widget("cpu_percent", ctk.CTkLabel(cpu_frame, text="0%")).grid(
+            row=0, column=1, sticky="w", padx=10, pady=5)
         
         # CPU usage progress bar
-        self.cpu_progress = ctk.CTkProgressBar(cpu_frame)
-        self.cpu_progress.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
-        self.cpu_progress.set(0)
+        cpu_progress = self.bind_widget("cpu_progress", ctk.CTkProgressBar(cpu_frame))
+        cpu_progress.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
+        cpu_progress.set(0)
         
         # Memory usage frame
-        mem_frame = ctk.CTkFrame(self.content_frame)
+        mem_frame = ctk.CTkFrame(frame)
         mem_frame.grid(row=2, column=0, sticky="ew", padx=10, pady=10)
         mem_frame.grid_columnconfigure(1, weight=1)
         
         ctk.CTkLabel(mem_frame, text="Memory Usage:", font=ctk.CTkFont(weight="bold")).grid(
             row=0, column=0, sticky="w", padx=10, pady=5)
-        self.mem_usage_label = ctk.CTkLabel(mem_frame, text="0%")
-        self.mem_usage_label.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+        self.bind_widget("memory_percent", ctk.CTkLabel(mem_frame, text="0%")).grid(
+            row=0, column=1, sticky="w", padx=10, pady=5)
         
         # Memory usage progress bar
-        self.mem_progress = ctk.CTkProgressBar(mem_frame)
-        self.mem_progress.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
-        self.mem_progress.set(0)
-        
-        # Memory details
-        mem = psutil.virtual_memory()
-        mem_details = [
-            ("Total", f"{mem.total / (1024**3):.2f} GB"),
-            ("Available", f"{mem.available / (1024**3):.2f} GB"),
-            ("Used", f"{mem.used / (1024**3):.2f} GB")
-        ]
-        
-        for i, (label, value) in enumerate(mem_details):
+        mem_progress = self.bind_widget("memory_progress", ctk.CTkProgressBar(mem_frame))
+        mem_progress.grid(row=1, column=0, columnspan=2, sticky="ew", padx=10, pady=5)
+        mem_progress.set(0)
+        
+        # Memory details, filled in from the sampler's snapshots
+        mem_details = [("Total", "memory_total"), ("Available", "memory_available"), ("Used", "memory_used")]
+        
+        for i, (label, key) in enumerate(mem_details):
             ctk.CTkLabel(mem_frame, text=f"{label}:", font=ctk.CTkFont(weight="bold")).grid(
                 row=i+2, column=0, sticky="w", padx=10, pady=2)
-            ctk.CTkLabel(mem_frame, text=value).grid(
+            self.bind_widget(key, ctk.CTkLabel(mem_frame, text="")).grid(
                 row=i+2, column=1, sticky="w", padx=10, pady=2)
-    
-    def show_disk_info(self):
-        self.clear_content_frame()
-        self.title_label.configure(text="Disk Information")
         
-        # Get disk information
-        disk_partitions = psutil.disk_partitions()
+        # History frame
+        history_frame = ctk.CTkFrame(frame)
+        history_frame.grid(row=3, column=0, sticky="ew", padx=10, pady=10)
+        history_frame.grid_columnconfigure(1, weight=1)
         
+        ctk.CTkLabel(history_frame, text="History:", font=ctk.CTkFont(weight="bold")).grid(
+            row=0, column=0, sticky="w", padx=10, pady=5)
+        range_button = ctk.CTkSegmentedButton(history_frame, values=list(HISTORY_RANGES),
+                                              command=self.set_history_range)
+        range_button.set(self.history_range)
+        range_button.grid(row=0, column=1, sticky="w", padx=10, pady=5)
+        
+        for i, (label, name) in enumerate([("CPU", "cpu"), ("Memory", "memory")]):
+            ctk.CTkLabel(history_frame, text=f"{label}:").grid(row=i+1, column=0, sticky="w", padx=10, pady=2)
+            self.history_sparklines[name] = Sparkline(history_frame, height=48)
+            self.history_sparklines[name].grid(row=i+1, column=1, sticky="ew", padx=10, pady=2)
+            self.bind_widget(f"{name}_peak", ctk.CTkLabel(history_frame, text="", width=90)).grid(
+                row=i+1, column=2, sticky="w", padx=10, pady=2)
+        
+        # One small sparkline per core, added once the host's core count
+        # is known (build_core_sparklines)
+        self.cores_frame = ctk.CTkFrame(history_frame, fg_color="transparent")
+        self.cores_frame.grid(row=3, column=0, columnspan=3, sticky="ew", padx=10, pady=5)
+        for column in range(CORE_COLUMNS):
+            self.cores_frame.grid_columnconfigure(column, weight=1)
+        
+        # CPU history of the busiest processes
+        ctk.CTkLabel(history_frame, text="Top Processes:", font=ctk.CTkFont(weight="bold")).grid(
+            row=4, column=0, sticky="w", padx=10, pady=(10, 2))
+        for i in range(TOP_PROCESSES):
+            self.bind_widget(f"top{i}_name", ctk.CTkLabel(history_frame, text="", anchor="w")).grid(
+                row=i+5, column=0, sticky="w", padx=10, pady=2)
+            sparkline = Sparkline(history_frame, height=28)
+            sparkline.grid(row=i+5, column=1, sticky="ew", padx=10, pady=2)
+            self.top_sparklines.append(sparkline)
+            self.bind_widget(f"top{i}_cpu", ctk.CTkLabel(history_frame, text="", width=90)).grid(
+                row=i+5, column=2, sticky="w", padx=10, pady=2)
+    
+    def build_core_sparklines(self, count):
+        for widget in self.cores_frame.winfo_children():
+            widget.destroy()
+        for name in [name for name in self.history_sparklines if name.startswith("cpu") and name != "cpu"]:
+            del self.history_sparklines[name]
+        self.core_count = count
+        for core in range(count):
+            row, column = divmod(core, CORE_COLUMNS)
+            core_frame = ctk.CTkFrame(self.cores_frame, fg_color="transparent")
+            core_frame.grid(row=row, column=column, sticky="ew", padx=5, pady=2)
+            core_frame.grid_columnconfigure(1, weight=1)
+            ctk.CTkLabel(core_frame, text=f"Core {core}", width=50).grid(row=0, column=0, sticky="w")
+            self.history_sparklines[f"cpu{core}"] = Sparkline(core_frame, height=28)
+            self.history_sparklines[f"cpu{core}"].grid(row=0, column=1, sticky="ew", padx=5)
+    
+    def show_disk_info(self):
+        if self.host.remote:
+            return
+        self.show_view("disks", "Disk Information", self.build_disk_info)
+        
+        # Disks are probed on worker threads; a mount that doesn't answer
+        # is flagged instead of freezing the window
+        if self.disk_snapshot is not None:
+            self.apply_disk_snapshot(self.disk_snapshot)
+        self.sampler.add("disks", self.disk_monitor.snapshot)
+    
+    def build_disk_info(self, frame):
         # Create disk info frame
-        disk_info_frame = ctk.CTkFrame(self.content_frame)
-        disk_info_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
-        disk_info_frame.grid_columnconfigure(1, weight=1)
+        self.disk_info_frame = ctk.CTkFrame(frame)
+        self.disk_info_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
+        self.disk_info_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(self.disk_info_frame, text="Probing disks...").grid(
+            row=0, column=0, sticky="w", padx=10, pady=10)
+    
+    def build_disk_rows(self, mounts):
+        for widget in self.disk_info_frame.winfo_children():
+            widget.destroy()
+        # Forget the old rows' bindings with them
+        self.view_widgets.clear()
+        self.view_values.clear()
         
         # Disk information labels
         row = 0
-        for partition in disk_partitions:
-            try:
-                usage = psutil.disk_usage(partition.mountpoint)
-                
-                # Device label
-                ctk.CTkLabel(disk_info_frame, text=f"Device: {partition.device}", 
-                            font=ctk.CTkFont(weight="bold")).grid(
-                    row=row, column=0, sticky="w", padx=10, pady=(10, 2))
-                row += 1
-                
-                # Mount point
-                ctk.CTkLabel(disk_info_frame, text="Mountpoint:").grid(
-                    row=row, column=0, sticky="w", padx=10, pady=2)
-                ctk.CTkLabel(disk_info_frame, text=partition.mountpoint).grid(
-                    row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # File system type
-                ctk.CTkLabel(disk_info_frame, text="File System:").grid(
-                    row=row, column=0, sticky="w", padx=10, pady=2)
-                ctk.CTkLabel(disk_info_frame, text=partition.fstype).grid(
-                    row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # Total size
-                ctk.CTkLabel(disk_info_frame, text="Total Size:").grid(
-                    row=row, column=0, sticky="w", padx=10, pady=2)
-                ctk.CTkLabel(disk_info_frame, text=f"{usage.total / (1024**3):.2f} GB").grid(
-                    row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # Used space
-                ctk.CTkLabel(disk_info_frame, text="Used Space:").grid(
-                    row=row, column=0, sticky="w", padx=10, pady=2)
-                ctk.CTkLabel(disk_info_frame, text=f"{usage.used / (1024**3):.2f} GB").grid(
-                    row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # Free space
-                ctk.CTkLabel(disk_info_frame, text="Free Space:").grid(
-                    row=row, column=0, sticky="w", padx=10, pady=2)
-                ctk.CTkLabel(disk_info_frame, text=f"{usage.free / (1024**3):.2f} GB").grid(
-                    row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # Usage percentage
-                ctk.CTkLabel(disk_info_frame, text="Usage:").grid(
+        for mount in mounts:
+            key = f"disk:{mount.mountpoint}"
+            
+            # Device label
+            ctk.CTkLabel(self.disk_info_frame, text=f"Device: {mount.device}", 
+                        font=ctk.CTkFont(weight="bold")).grid(
+                row=row, column=0, sticky="w", padx=10, pady=(10, 2))
+            row += 1
+            
+            # Static details, then the live ones
+            details = [
+                ("Mountpoint:", mount.mountpoint),
+                ("File System:", mount.fstype),
+                ("Status:", None),
+                ("Total Size:", None),
+                ("Used Space:", None),
+                ("Free Space:", None),
+                ("Usage:", None),
+                ("Read:", None),
+                ("Write:", None)
+            ]
+            for label, value in details:
+                ctk.CTkLabel(self.disk_info_frame, text=label).grid(
                     row=row, column=0, sticky="w", padx=10, pady=2)
-                usage_percent = ctk.CTkLabel(disk_info_frame, text=f"{usage.percent}%")
-                usage_percent.grid(row=row, column=1, sticky="w", padx=10, pady=2)
-                row += 1
-                
-                # Usage progress bar
-                progress = ctk.CTkProgressBar(disk_info_frame)
-                progress.grid(row=row, column=0, columnspan=2, sticky="ew", padx=10, pady=(2, 10))
-                progress.set(usage.percent / 100)
-                row += 1
-                
-                # Separator
-                separator = ctk.CTkFrame(disk_info_frame, height=2, fg_color="gray")
-                separator.grid(row=row, column=0, columnspan=2, sticky="ew", padx=10, pady=10)
+                value_label = ctk.CTkLabel(self.disk_info_frame, text=value or "")
+                value_label.grid(row=row, column=1, sticky="w", padx=10, pady=2)
+                if value is None:
+                    self.bind_widget(f"{key}:{label.rstrip(':').lower()}", value_label)
                 row += 1
-                
-            except PermissionError:
-                # Skip disks that require special permissions
-                continue
+            
+            # Usage progress bar
+            progress = self.bind_widget(f"{key}:progress", ctk.CTkProgressBar(self.disk_info_frame))
+            progress.grid(row=row, column=0, columnspan=2, sticky="ew", padx=10, pady=(2, 10))
+            progress.set(0)
+            row += 1
+            
+            # Separator
+            separator = ctk.CTkFrame(self.disk_info_frame, height=2, fg_color="gray")
+            separator.grid(row=row, column=0, columnspan=2, sticky="ew", padx=10, pady=10)
+            row += 1
+    
+    def apply_disk_snapshot(self, snapshot):
+        self.disk_snapshot = snapshot
+        if self.current_view != "disks":
+            return
+        # Mounts come and go (USB sticks, network shares); only then is the
+        # view rebuilt, otherwise just the changed values are updated
+        layout = tuple(mount.mountpoint for mount in snapshot.mounts)
+        if layout != self.disk_layout:
+            self.disk_layout = layout
+            self.build_disk_rows(snapshot.mounts)
+        
+        for mount in snapshot.mounts:
+            key = f"disk:{mount.mountpoint}"
+            state_text, color = DISK_STATES.get(mount.state, (f"Error: {mount.state}", "red"))
+            status_label = self.view_widgets.get(f"{key}:status")
+            if status_label is not None and self.view_values.get(f"{key}:status") != state_text:
+                status_label.configure(text_color=color)
+            self.update_widget(f"{key}:status", state_text)
+            
+            usage = mount.usage
+            if usage is not None:
+                self.update_widget(f"{key}:total size", f"{usage.total / (1024**3):.2f} GB")
+                self.update_widget(f"{key}:used space", f"{usage.used / (1024**3):.2f} GB")
+                self.update_widget(f"{key}:free space", f"{usage.free / (1024**3):.2f} GB")
+                self.update_widget(f"{key}:usage", f"{usage.percent}%")
+                self.update_widget(f"{key}:progress", usage.percent / 100)
+            
+            rate = snapshot.rates.get(mount.disk)
+            if rate is not None:
+                self.update_widget(f"{key}:read", f"{format_rate(rate.read_bytes)} ({rate.read_ops:.0f} IOPS)")
+                self.update_widget(f"{key}:write", f"{format_rate(rate.write_bytes)} ({rate.write_ops:.0f} IOPS)")
+            else:
+                self.update_widget(f"{key}:read", "-")
+                self.update_widget(f"{key}:write", "-")
     
     def show_process_manager(self):
-        self.clear_content_frame()
-        self.title_label.configure(text="Process Manager")
+        self.show_view("processes", "Process Manager", self.build_process_manager)
         
+        # Show what we already know, then keep it updated from the sampler
+        # while this view is open
+        self.display_processes()
+        if not self.host.remote:
+            self.sampler.add("processes", self.process_cache.snapshot)
+    
+    def build_process_manager(self, frame):
         # Create process manager frame
-        process_frame = ctk.CTkFrame(self.content_frame)
+        process_frame = ctk.CTkFrame(frame)
         process_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
         process_frame.grid_columnconfigure(0, weight=1)
         process_frame.grid_rowconfigure(1, weight=1)
@@ -277,7 +548,7 @@ class SystemInfoApp(ctk.CTk):
         search_frame.grid_columnconfigure(1, weight=1)
         
         ctk.CTkLabel(search_frame, text="Search:").grid(row=0, column=0, padx=10, pady=10)
-        self.search_entry = ctk.CTkEntry(search_frame)
+        self.search_entry = ctk.CTkEntry(search_frame, placeholder_text="name, pid, user:root cpu>5 mem>=1 status:sleeping")
         self.search_entry.grid(row=0, column=1, padx=10, pady=10, sticky="ew")
         self.search_entry.bind("<KeyRelease>", self.filter_processes)
         
@@ -285,83 +556,50 @@ class SystemInfoApp(ctk.CTk):
         refresh_button = ctk.CTkButton(search_frame, text="Refresh", command=self.refresh_processes)
         refresh_button.grid(row=0, column=2, padx=10, pady=10)
         
-        # Process list frame
-        list_frame = ctk.CTkFrame(process_frame)
-        list_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=(0, 10))
-        list_frame.grid_columnconfigure(0, weight=1)
-        list_frame.grid_rowconfigure(0, weight=1)
-        
-        # Create process list with headers
-        headers = ["PID", "Name", "CPU %", "Memory %", "Status", "Actions"]
-        for col, header in enumerate(headers):
-            ctk.CTkLabel(list_frame, text=header, font=ctk.CTkFont(weight="bold")).grid(
-                row=0, column=col, padx=5, pady=5, sticky="w")
-        
-        # Create scrollable frame for processes
-        self.process_list_frame = ctk.CTkScrollableFrame(list_frame)
-        self.process_list_frame.grid(row=1, column=0, columnspan=len(headers), sticky="nsew", padx=5, pady=5)
-        self.process_list_frame.grid_columnconfigure(1, weight=1)
-        
-        # Populate process list
-        self.refresh_processes()
+        # Process table: only the rows on screen have widgets, which are
+        # recycled as the list is scrolled, filtered or sorted (click a heading)
+        self.process_table = VirtualTable(
+            process_frame,
+            columns=PROCESS_COLUMNS,
+            cells=process_cells,
+            action=lambda proc: self.end_process(proc.pid),
+            action_text="End Process"
+        )
+        self.process_table.grid(row=1, column=0, sticky="nsew", padx=10, pady=(0, 10))
+        # Sort by CPU usage (descending)
+        cpu_column = [heading for heading, _, _ in PROCESS_COLUMNS].index("CPU %")
+        self.process_table.sort_by(cpu_column, reverse=True)
     
     def refresh_processes(self):
-        # Clear existing process list
-        for widget in self.process_list_frame.winfo_children():
-            widget.destroy()
-        
-        # Get process list
-        self.process_list = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent', 'status']):
-            try:
-                self.process_list.append(proc.info)
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        
-        # Sort by CPU usage (descending)
-        self.process_list.sort(key=lambda x: x['cpu_percent'] or 0, reverse=True)
-        
-        # Display processes
-        self.display_processes()
+        # The sampler thread reads the process list; poll_samples() shows it.
+        # Agents send theirs on their own schedule.
+        if not self.host.remote:
+            self.sampler.refresh("processes")
     
     def display_processes(self):
-        # Filter processes based on search term
-        search_term = self.search_entry.get().lower()
-        filtered_processes = self.process_list
-        if search_term:
-            filtered_processes = [p for p in self.process_list if search_term in p['name'].lower()]
-        
-        # Display processes
-        for i, proc in enumerate(filtered_processes):
-            # PID
-            pid_label = ctk.CTkLabel(self.process_list_frame, text=str(proc['pid']))
-            pid_label.grid(row=i, column=0, padx=5, pady=2, sticky="w")
-            
-            # Name
-            name_label = ctk.CTkLabel(self.process_list_frame, text=proc['name'])
-            name_label.grid(row=i, column=1, padx=5, pady=2, sticky="w")
-            
-            # CPU %
-            cpu_label = ctk.CTkLabel(self.process_list_frame, text=f"{proc['cpu_percent'] or 0:.1f}%")
-            cpu_label.grid(row=i, column=2, padx=5, pady=2, sticky="w")
-            
-            # Memory %
-            mem_label = ctk.CTkLabel(self.process_list_frame, text=f"{proc['memory_percent'] or 0:.1f}%")
-            mem_label.grid(row=i, column=3, padx=5, pady=2, sticky="w")
-            
-            # Status
-            status_label = ctk.CTkLabel(self.process_list_frame, text=proc['status'])
-            status_label.grid(row=i, column=4, padx=5, pady=2, sticky="w")
-            
-            # End process button
-            end_button = ctk.CTkButton(self.process_list_frame, text="End Process", 
-                                      width=80, command=lambda pid=proc['pid']: self.end_process(pid))
-            end_button.grid(row=i, column=5, padx=5, pady=2)
+        if self.current_view != "processes":
+            return
+        
+        # Filter processes based on the search query
+        filtered_processes = self.host.search.search(self.search_entry.get())
+        
+        # The table sorts and draws only the rows that fit
+        self.process_table.set_rows(filtered_processes)
     
     def filter_processes(self, event):
+        # Wait for a pause in typing instead of searching on every key
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(SEARCH_DEBOUNCE_MS, self.run_search)
+    
+    def run_search(self):
+        self.search_job = None
         self.display_processes()
     
     def end_process(self, pid):
+        if self.host.remote:
+            messagebox.showerror("Error", f"Processes on {self.host.name} can't be ended from here")
+            return
         try:
             process = psutil.Process(pid)
             process.terminate()
@@ -374,36 +612,107 @@ class SystemInfoApp(ctk.CTk):
         except Exception as e:
             messagebox.showerror("Error", f"Failed to terminate process {pid}: {str(e)}")
     
-    def update_system_info(self):
+    def apply_system_snapshot(self, snapshot):
         # Update CPU usage
-        cpu_percent = psutil.cpu_percent()
-        self.cpu_usage_label.configure(text=f"{cpu_percent}%")
-        self.cpu_progress.set(cpu_percent / 100)
+        self.update_widget("cpu_percent", f"{snapshot.cpu_percent}%")
+        self.update_widget("cpu_progress", snapshot.cpu_percent / 100)
         
         # Update memory usage
-        mem = psutil.virtual_memory()
-        self.mem_usage_label.configure(text=f"{mem.percent}%")
-        self.mem_progress.set(mem.percent / 100)
+        self.update_widget("memory_percent", f"{snapshot.memory_percent}%")
+        self.update_widget("memory_progress", snapshot.memory_percent / 100)
+        self.update_widget("memory_total", f"{snapshot.memory_total / (1024**3):.2f} GB")
+        self.update_widget("memory_available", f"{snapshot.memory_available / (1024**3):.2f} GB")
+        self.update_widget("memory_used", f"{snapshot.memory_used / (1024**3):.2f} GB")
+    
+    def set_history_range(self, value):
+        self.history_range = value
+        self.update_history_view()
     
-    def start_update_thread(self):
-        def update_loop():
-            while not self.stop_thread:
-                try:
-                    self.update_system_info()
-                    time.sleep(2)
-                except:
-                    break
-        
-        self.update_thread = threading.Thread(target=update_loop, daemon=True)
-        self.update_thread.start()
+    def update_history_view(self):
+        # Each sparkline only draws the points added since it last drew
+        if self.current_view != "system":
+            return
+        history = self.host.history
+        system = self.host.system
+        core_count = len(system.per_cpu) if system is not None else 0
+        if core_count != self.core_count:
+            self.build_core_sparklines(core_count)
+        tier_index, kind = HISTORY_RANGES[self.history_range]
+        for name, sparkline in self.history_sparklines.items():
+            series = history.series.get(name)
+            if series is not None:
+                sparkline.show(series.tiers[tier_index], kind)
+            else:
+                sparkline.clear()
+        for name in ("cpu", "memory"):
+            series = history.series.get(name)
+            peak = f"peak {series.tiers[tier_index].peak():.0f}%" if series is not None else ""
+            self.update_widget(f"{name}_peak", peak)
+        top = history.top_processes()
+        for i, sparkline in enumerate(self.top_sparklines):
+            if i < len(top):
+                name, info = top[i]
+                self.update_widget(f"top{i}_name", f"{info.name} ({info.pid})")
+                self.update_widget(f"top{i}_cpu", f"{info.cpu_percent or 0:.1f}%")
+                sparkline.show(history.series[name].tiers[tier_index], kind)
+            else:
+                self.update_widget(f"top{i}_name", "")
+                self.update_widget(f"top{i}_cpu", "")
+                sparkline.clear()
+    
+    def apply_host_facts(self, facts):
+        # None while the host's facts haven't arrived yet
+        for _, key in HOST_FACTS:
+            self.update_widget(f"host_{key}", "..." if facts is None else getattr(facts, key))
+    
+    def start_sampler(self):
+        # psutil is only ever read on the sampler thread; widgets are only
+        # touched here, on the Tk thread
+        self.sampler.run_once("host", host_facts)
+        self.sampler.add("system", sample_system, SYSTEM_SAMPLE_INTERVAL)
+        self.sampler.add("processes", self.process_cache.snapshot, PROCESS_BACKGROUND_INTERVAL)
+        self.sampler.start()
+        self.poll_samples()
+    
+    def poll_samples(self):
+        # Every host is drained so their history keeps growing; only the
+        # selected one's snapshots reach the widgets
+        for host in self.hosts.values():
+            snapshots = host.poll()
+            snapshot = snapshots.get("disks")
+            if snapshot is not None:
+                self.apply_disk_snapshot(snapshot)
+            if host is not self.host:
+                continue
+            facts = snapshots.get("host")
+            if facts is not None:
+                self.apply_host_facts(facts)
+            snapshot = snapshots.get("system")
+            if snapshot is not None:
+                self.apply_system_snapshot(snapshot)
+            if "processes" in snapshots:
+                self.display_processes()
+            if snapshots:
+                self.update_history_view()
+        if self.host.search.pending:
+            self.host.search.index_pending()
+        if self.host.remote:
+            self.update_host_status()
+        self.poll_job = self.after(SAMPLE_POLL_MS, self.poll_samples)
     
     def on_closing(self):
-        self.stop_thread = True
-        if self.update_thread and self.update_thread.is_alive():
-            self.update_thread.join(timeout=1.0)
+        if self.poll_job is not None:
+            self.after_cancel(self.poll_job)
+            self.poll_job = None
+        self.sampler.stop()
+        for host in self.hosts.values():
+            if host.remote:
+                host.source.stop()
         self.destroy()
 
 if __name__ == "__main__":
-    app = SystemInfoApp()
+    parser = argparse.ArgumentParser(description="System information dashboard")
+    parser.add_argument("agents", nargs="*", help="menu_agent addresses to watch as well (host:port or unix:/path)")
+    app = SystemInfoApp(parser.parse_args().agents)
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
\ No newline at end of file
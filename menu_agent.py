@@ -0,0 +1,293 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from menu_processes import ProcessTable
+from menu_protocol import DEFAULT_PORT, encode_hello, encode_processes, encode_system, parse_address
+from menu_sampler import host_facts, sample_system
+
+# Headless collector for the dashboard: samples this machine with psutil and
+# streams the snapshots to every dashboard subscribed over a Unix or TCP
+# socket (see menu_protocol). No Tk and no customtkinter, so it runs on
+# servers without a display.
+
+AGENT_INTERVAL = 1.0
+AGENT_PROCESS_INTERVAL = 2.0
+# A subscriber whose socket takes no data for this long is dropped
+SEND_TIMEOUT = 5.0
+# Bytes of frames a subscriber may fall behind by before it is dropped (it
+# reconnects for keyframes); room for a few process keyframes
+MAX_BACKLOG = 8 * 1024 * 1024
+
+
+class Subscriber:
+    # One dashboard connection with its own writer thread, so a stalled
+    # dashboard only ever holds up itself: put() queues frames and returns
+    # at once, and a subscriber that gets too far behind is closed.
+    
+    def __init__(self, connection, peer, warn, max_backlog=MAX_BACKLOG):
+        self.connection = connection
+        self.peer = peer
+        self.warn = warn
+        self.max_backlog = max_backlog
+        self.frames = deque()
+        self.backlog = 0
+        self.closed = False
+        self._ready = threading.Condition()
+        threading.Thread(target=self._write, name="agent-subscriber", daemon=True).start()
+    
+    def put(self, data):
+        # False once the subscriber is gone
+        with self._ready:
+            if self.closed:
+                return False
+            if self.backlog + len(data) > self.max_backlog:
+                self._close(f"Subscriber dropped: {self.peer} is more than {self.max_backlog} bytes behind")
+                return False
+            self.frames.append(data)
+            self.backlog += len(data)
+            self._ready.notify()
+        return True
+    
+    def close(self):
+        with self._ready:
+            self._close()
+    
+    def _close(self, reason=None):
+        if self.closed:
+            return
+        self.closed = True
+        self._ready.notify()
+        if reason:
+            self.warn(reason)
+        # Wakes the writer if it is blocked in sendall(); it closes the socket
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def _write(self):
+        try:
+            while True:
+                with self._ready:
+                    while not self.frames and not self.closed:
+                        self._ready.wait()
+                    if self.closed:
+                        return
+                    data = self.frames.popleft()
+                try:
+                    self.connection.sendall(data)
+                except OSError as e:
+                    with self._ready:
+                        self._close(None if self.closed else f"Subscriber dropped: {self.peer}: {e}")
+                    return
+                with self._ready:
+                    self.backlog -= len(data)
+        finally:
+            self.connection.close()
+
+
+class Agent:
+    # Samples on one thread (the caller's, in run()) and hands every
+    # subscriber the same delta frames, so the cost per tick doesn't grow
+    # with the number of dashboards; a newcomer gets keyframes of the current
+    # state first. Nothing is sampled while nobody is subscribed.
+    
+    def __init__(self, addresses, interval=AGENT_INTERVAL, process_interval=AGENT_PROCESS_INTERVAL, log=None,
+                 warn=None):
+        self.addresses = addresses
+        self.interval = interval
+        self.process_interval = process_interval
+        self.log = log or (lambda message: None)
+        # Failures, so a logger can keep them at warning level
+        self.warn = warn or self.log
+        self.facts = None
+        self.table = ProcessTable()
+        # Last snapshots sent, which the next deltas are against
+        self.system = None
+        self.processes = None
+        self.servers = []
+        self.clients = []
+        self._joining = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+    
+    def listen(self):
+        self.facts = host_facts()
+        for text in self.addresses:
+            family, address = parse_address(text)
+            if family == socket.AF_UNIX:
+                # A socket file left behind by an agent that didn't exit
+                # cleanly would make bind() fail
+                try:
+                    if stat.S_ISSOCK(os.stat(address).st_mode):
+                        os.unlink(address)
+                except FileNotFoundError:
+                    pass
+            server = socket.socket(family, socket.SOCK_STREAM)
+            if family != socket.AF_UNIX:
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(address)
+            server.listen()
+            self.servers.append((server, family, address))
+            threading.Thread(target=self._accept, args=(server, family), name="agent-accept", daemon=True).start()
+    
+    def _accept(self, server, family):
+        while not self._stopping:
+            try:
+                connection, peer = server.accept()
+            except OSError:
+                # Closed by close()
+                return
+            connection.settimeout(SEND_TIMEOUT)
+            if family != socket.AF_UNIX:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            peer = peer or "local socket"
+            self.log(f"Subscriber connected: {peer}")
+            with self._lock:
+                self._joining.append((connection, peer))
+            self._wake.set()
+    
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+    
+    def close(self):
+        for server, family, address in self.servers:
+            server.close()
+            if family == socket.AF_UNIX:
+                try:
+                    os.unlink(address)
+                except OSError:
+                    pass
+        self.servers = []
+        for subscriber in self.clients:
+            subscriber.close()
+        self.clients = []
+    
+    def run(self):
+        due = 0.0
+        process_due = 0.0
+        while not self._stopping:
+            self._wake.clear()
+            with self._lock:
+                joining, self._joining = self._joining, []
+            now = time.monotonic()
+            if now >= due or (joining and self.processes is None):
+                due = now + self.interval
+                if self.clients or joining:
+                    processes_due = now >= process_due or self.processes is None
+                    if processes_due:
+                        process_due = now + self.process_interval
+                    self.tick(processes_due)
+                else:
+                    # Start over with keyframes when someone subscribes
+                    self.system = None
+                    self.processes = None
+            for connection, peer in joining:
+                self.prime(connection, peer)
+            self._wake.wait(max(due - time.monotonic(), 0.0))
+    
+    def tick(self, processes_due):
+        frames = []
+        try:
+            system = sample_system()
+            frames.append(encode_system(system, self.system))
+            self.system = system
+            if processes_due:
+                snapshot = self.table.snapshot()
+                previous = self.processes.processes if self.processes is not None else None
+                frames.append(encode_processes(snapshot, previous) or b"")
+                self.processes = snapshot
+        except (psutil.Error, OSError) as e:
+            # Try again next tick
+            self.warn(f"Sampling failed: {e}")
+        self.send(b"".join(frames))
+    
+    def prime(self, connection, peer):
+        # Hello and keyframes of the last snapshots, which the next tick's
+        # deltas follow on from
+        if self.system is None or self.processes is None:
+            connection.close()
+            return
+        subscriber = Subscriber(connection, peer, self.warn)
+        self.clients.append(subscriber)
+        self.send(
+            encode_hello(self.facts, self.interval) + encode_system(self.system) + encode_processes(self.processes),
+            [subscriber]
+        )
+    
+    def send(self, data, subscribers=None):
+        if not data:
+            return
+        for subscriber in list(self.clients if subscribers is None else subscribers):
+            # Gone, or too far behind; it reconnects for keyframes
+            if not subscriber.put(data) and subscriber in self.clients:
+                self.clients.remove(subscriber)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream this machine's system stats to the dashboard")
+    parser.add_argument(
+        "--listen", action="append",
+        help=f"unix:PATH or [HOST]:PORT to accept subscribers on, repeatable (default: 127.0.0.1:{DEFAULT_PORT})"
+    )
+    parser.add_argument("--interval", type=float, default=AGENT_INTERVAL,
+                        help="seconds between system samples (default: %(default)s)")
+    parser.add_argument("--process-interval", type=float, default=AGENT_PROCESS_INTERVAL,
+                        help="seconds between process list refreshes (default: %(default)s)")
+    parser.add_argument("--quiet", action="store_true", help="only log warnings and errors")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    logger = logging.getLogger("menu_agent")
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING if args.quiet else logging.INFO)
+    
+    agent = Agent(
+        args.listen or [f"127.0.0.1:{DEFAULT_PORT}"], max(args.interval, 0.1), max(args.process_interval, 0.1),
+        log=logger.info,
+        warn=logger.warning
+    )
+    try:
+        agent.listen()
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not listen: {e}")
+        agent.close()
+        return 1
+    
+    def request_stop(signum, frame):
+        agent.stop()
+    
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_stop)
+    
+    logger.info(f"Agent listening on {', '.join(agent.addresses)}")
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    agent.run()
+    agent.close()
+    elapsed = time.monotonic() - started
+    if elapsed > 0:
+        used = (time.process_time() - cpu_started) / elapsed * 100
+        logger.info(f"Agent stopped after {elapsed:.0f} s, using {used:.2f}% of a core")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
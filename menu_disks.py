@@ -0,0 +1,190 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import psutil
+
+# A mount whose disk_usage() hasn't returned after this long is flagged as
+# not responding (its probe is left running; nothing waits for it)
+MOUNT_TIMEOUT = 2.0
+# How long a mount's usage figures are reused before probing it again
+USAGE_TTL = 10.0
+DISK_WORKERS = 4
+# Extra workers started to replace ones stuck on hung mounts, at most
+MAX_DISK_WORKERS = 16
+# I/O rates are only worked out over at least this many seconds; a snapshot
+# taken sooner (one a finished probe asked for) reuses the last rates
+MIN_RATE_INTERVAL = 1.0
+
+# One mounted filesystem. `usage` is the last psutil.disk_usage() result
+# (None until one returned); `state` is "ok", "probing", "hung", "denied"
+# or an error message.
+MountInfo = namedtuple("MountInfo", ("device", "mountpoint", "fstype", "disk", "usage", "state", "checked"))
+# Throughput of one disk since the previous snapshot
+DiskRate = namedtuple("DiskRate", ("read_bytes", "write_bytes", "read_ops", "write_ops"))
+DiskSnapshot = namedtuple("DiskSnapshot", ("taken", "mounts", "rates"))
+
+
+def disk_name(device):
+    # psutil names disks in disk_io_counters() by their kernel name
+    # ("sda1", "dm-0"), partitions by their device path
+    return os.path.basename(os.path.realpath(device)) if device.startswith("/dev/") else device
+
+
+class ProbePool:
+    # A few daemon threads running disk_usage() calls. Daemon threads,
+    # because a call stuck on a dead NFS server never returns and must not
+    # keep the app from exiting; when one gets stuck a replacement worker is
+    # started so the other mounts keep being probed.
+    
+    def __init__(self, workers=DISK_WORKERS, max_workers=MAX_DISK_WORKERS):
+        self.max_workers = max_workers
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0
+        for _ in range(workers):
+            self._start_worker()
+    
+    def _start_worker(self):
+        with self._lock:
+            if self._workers >= self.max_workers:
+                return
+            self._workers += 1
+        threading.Thread(target=self._run, name="disk-probe", daemon=True).start()
+    
+    def submit(self, function, done):
+        self._queue.put((function, done))
+        with self._lock:
+            starve = self._idle == 0
+        if starve:
+            self._start_worker()
+    
+    def stuck(self):
+        # Called for each probe found hung; its worker is as good as gone
+        self._start_worker()
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            function, done = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            try:
+                result = function()
+            except Exception as e:
+                result = e
+            done(result)
+
+
+class DiskMonitor:
+    # Sampler source for the Disk Info view. Usage is probed per mount on a
+    # ProbePool with results cached for USAGE_TTL; a snapshot never waits
+    # for a probe, it reports what is known and flags mounts whose probe has
+    # been running longer than MOUNT_TIMEOUT. Such a probe is given up on,
+    # but the mount is only probed again once that call has returned, so a
+    # dead mount strands one worker, not one per retry. I/O rates come from
+    # the difference between successive disk_io_counters(perdisk=True) reads.
+    
+    def __init__(self, on_result=None, timeout=MOUNT_TIMEOUT, ttl=USAGE_TTL):
+        # on_result() is called from a probe thread when a probe finishes,
+        # e.g. to have the sampler take a fresh snapshot
+        self.on_result = on_result
+        self.timeout = timeout
+        self.ttl = ttl
+        self.pool = None
+        self._lock = threading.Lock()
+        self._usage = {}
+        self._inflight = {}
+        # Mounts whose probe was given up on and hasn't returned yet
+        self._abandoned = set()
+        self._counters = None
+        self._counters_taken = None
+        self._last_rates = {}
+    
+    def _probe(self, mountpoint):
+        started = time.monotonic()
+        self._inflight[mountpoint] = started
+        
+        def done(result):
+            with self._lock:
+                # A probe given up on as hung can still return after a
+                # newer one for the same mount started
+                if self._inflight.get(mountpoint) == started:
+                    del self._inflight[mountpoint]
+                # It answered, so the mount can be probed again
+                self._abandoned.discard(mountpoint)
+                if isinstance(result, PermissionError):
+                    state = "denied"
+                elif isinstance(result, Exception):
+                    state = str(result) or result.__class__.__name__
+                else:
+                    state = "ok"
+                usage = result if state == "ok" else self._usage.get(mountpoint, (None,))[0]
+                self._usage[mountpoint] = (usage, state, time.monotonic())
+            if self.on_result is not None:
+                self.on_result()
+        
+        self.pool.submit(lambda: psutil.disk_usage(mountpoint), done)
+    
+    def snapshot(self):
+        if self.pool is None:
+            self.pool = ProbePool()
+        now = time.monotonic()
+        mounts = []
+        with self._lock:
+            for partition in psutil.disk_partitions():
+                mountpoint = partition.mountpoint
+                usage, state, checked = self._usage.get(mountpoint, (None, "probing", 0.0))
+                started = self._inflight.get(mountpoint)
+                if mountpoint in self._abandoned:
+                    state = "hung"
+                elif started is None:
+                    if now - checked >= self.ttl:
+                        self._probe(mountpoint)
+                elif now - started >= self.timeout:
+                    # Its call stays stuck on a worker, which is replaced;
+                    # the mount waits for that call before it is tried again
+                    del self._inflight[mountpoint]
+                    self._abandoned.add(mountpoint)
+                    self.pool.stuck()
+                    state = "hung"
+                    checked = now
+                    self._usage[mountpoint] = (usage, state, checked)
+                mounts.append(MountInfo(
+                    partition.device, mountpoint, partition.fstype, disk_name(partition.device), usage, state, checked
+                ))
+        return DiskSnapshot(time.time(), tuple(mounts), self._rates())
+    
+    def _rates(self):
+        # A few milliseconds' worth of counter deltas would show as huge
+        # spikes, so too short an interval keeps the previous counters
+        taken = time.monotonic()
+        if self._counters is not None and taken - self._counters_taken < MIN_RATE_INTERVAL:
+            return self._last_rates
+        try:
+            counters = psutil.disk_io_counters(perdisk=True) or {}
+        except (OSError, RuntimeError):
+            counters = {}
+        previous, previous_taken = self._counters, self._counters_taken
+        self._counters, self._counters_taken = counters, taken
+        if previous is None:
+            return {}
+        elapsed = taken - previous_taken
+        rates = {}
+        for disk, now in counters.items():
+            before = previous.get(disk)
+            if before is None:
+                continue
+            # Counters can wrap or be reset; a negative delta reads as idle
+            rates[disk] = DiskRate(
+                max(now.read_bytes - before.read_bytes, 0) / elapsed,
+                max(now.write_bytes - before.write_bytes, 0) / elapsed,
+                max(now.read_count - before.read_count, 0) / elapsed,
+                max(now.write_count - before.write_count, 0) / elapsed
+            )
+        self._last_rates = rates
+        return rates
@@ -0,0 +1,132 @@
+from array import array
+
+# (seconds per point, points kept) of each resolution: 5 minutes of 1s
+# points, an hour of 10s points and a day of 1min points
+TIERS = ((1, 300), (10, 360), (60, 1440))
+# Processes with their own CPU history: the busiest few each sample, and at
+# most this many series kept overall (least recently busy ones go first)
+TOP_PROCESSES = 5
+MAX_PROCESS_SERIES = 15
+
+
+class Tier:
+    # Fixed-size ring of min/max/avg points at one resolution. Samples are
+    # folded into the current bucket and the bucket is written out when a
+    # sample for a later one arrives, so memory never grows with uptime.
+    # Buckets no sample fell into (a series sampled less often than `step`,
+    # like processes in the background) are filled with the next sample, so
+    # every point stands for `step` seconds.
+    
+    def __init__(self, step, capacity):
+        self.step = step
+        self.capacity = capacity
+        self.mins = array("f", bytes(4 * capacity))
+        self.maxs = array("f", bytes(4 * capacity))
+        self.avgs = array("f", bytes(4 * capacity))
+        self.next = 0
+        self.count = 0
+        # Points written so far, ever; lets readers tell what is new
+        self.appended = 0
+        self.bucket = None
+        self.low = self.high = self.total = 0.0
+        self.samples = 0
+    
+    def add(self, when, value):
+        bucket = int(when // self.step)
+        if bucket != self.bucket:
+            if self.samples:
+                self._write()
+                # CPU percentages are averages since the previous sample, so
+                # the new one holds for the whole gap
+                gap = min(bucket - self.bucket - 1, self.capacity)
+                if gap > 0:
+                    self.low = self.high = self.total = value
+                    self.samples = 1
+                    for _ in range(gap):
+                        self._write()
+            self.bucket = bucket
+            self.low = self.high = value
+            self.total = 0.0
+            self.samples = 0
+        self.low = min(self.low, value)
+        self.high = max(self.high, value)
+        self.total += value
+        self.samples += 1
+    
+    def _write(self):
+        index = self.next
+        self.mins[index] = self.low
+        self.maxs[index] = self.high
+        self.avgs[index] = self.total / self.samples
+        self.next = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.appended += 1
+    
+    def latest(self, count=None, kind="avg"):
+        # The newest `count` points of one kind, oldest first
+        values = {"avg": self.avgs, "min": self.mins, "max": self.maxs}[kind]
+        count = self.count if count is None else min(count, self.count)
+        start = (self.next - count) % self.capacity
+        if start + count <= self.capacity:
+            return values[start:start + count].tolist()
+        return values[start:].tolist() + values[:self.next].tolist()
+    
+    def peak(self):
+        return max(self.latest(kind="max"), default=0.0)
+
+
+class Series:
+    # One metric at every resolution in TIERS
+    
+    def __init__(self, tiers=TIERS):
+        self.tiers = [Tier(step, capacity) for step, capacity in tiers]
+        self.updated = 0.0
+    
+    def add(self, when, value):
+        for tier in self.tiers:
+            tier.add(when, value)
+        self.updated = when
+
+
+class History:
+    # CPU and memory history of the whole system, each core and the busiest
+    # processes, recorded from the sampler's snapshots on the Tk thread
+    
+    def __init__(self):
+        self.series = {}
+        self.processes = {}
+    
+    def record(self, name, when, value):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Series()
+        series.add(when, value)
+    
+    def record_system(self, snapshot):
+        when = snapshot.taken
+        self.record("cpu", when, snapshot.cpu_percent)
+        self.record("memory", when, snapshot.memory_percent)
+        for core, percent in enumerate(snapshot.per_cpu):
+            self.record(f"cpu{core}", when, percent)
+    
+    def record_processes(self, when, processes):
+        # `processes` is a menu_processes.ProcessSnapshot's dict
+        top = sorted(processes.values(), key=lambda info: info.cpu_percent or 0, reverse=True)[:TOP_PROCESSES]
+        for info in top:
+            name = f"process:{info.key[0]}:{info.key[1]}"
+            self.processes[name] = info
+            self.record(name, when, info.cpu_percent or 0)
+        if len(self.processes) > MAX_PROCESS_SERIES:
+            oldest = sorted(self.processes, key=lambda name: self.series[name].updated)
+            for name in oldest[:len(self.processes) - MAX_PROCESS_SERIES]:
+                del self.processes[name]
+                del self.series[name]
+    
+    def top_processes(self, count=TOP_PROCESSES):
+        # (series name, ProcessInfo) of the most recently busy processes
+        names = sorted(
+            self.processes,
+            key=lambda name: (self.series[name].updated, self.processes[name].cpu_percent or 0),
+            reverse=True
+        )
+        return [(name, self.processes[name]) for name in names[:count]]
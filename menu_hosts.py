@@ -0,0 +1,121 @@
+import queue
+import socket
+import threading
+
+from menu_history import History
+from menu_protocol import Decoder, ProtocolError, parse_address, read_frame
+from menu_search import ProcessIndex
+
+# Seconds to wait before reconnecting to an agent, doubling while it stays
+# down, up to the maximum
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+CONNECT_TIMEOUT = 5.0
+# An agent sends at least one frame a tick; one silent for this long is
+# treated as gone
+READ_TIMEOUT = 30.0
+
+
+class AgentClient:
+    # Subscription to one menu_agent. A reader thread decodes its frames and
+    # publishes the snapshots like menu_sampler.Sampler does, so the
+    # dashboard drains a remote host exactly like the local one. Reconnects
+    # on its own; `status` says how it's going.
+    
+    def __init__(self, address):
+        # Raises ValueError for an address that can't be parsed
+        self.address = address
+        self.family, self.target = parse_address(address)
+        self.status = "Connecting..."
+        self._queue = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._socket = None
+        self._thread = None
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"agent-{self.address}", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stopping.set()
+        connection = self._socket
+        if connection is not None:
+            # Wakes the reader thread out of its read
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def drain(self):
+        latest = {}
+        while True:
+            try:
+                name, snapshot = self._queue.get_nowait()
+            except queue.Empty:
+                return latest
+            latest[name] = snapshot
+    
+    def _run(self):
+        decoder = Decoder()
+        delay = RECONNECT_DELAY
+        while not self._stopping.is_set():
+            connection = socket.socket(self.family, socket.SOCK_STREAM)
+            self._socket = connection
+            try:
+                connection.settimeout(CONNECT_TIMEOUT)
+                connection.connect(self.target)
+                connection.settimeout(READ_TIMEOUT)
+                stream = connection.makefile("rb")
+                decoder.reset()
+                self.status = "Connected"
+                delay = RECONNECT_DELAY
+                while True:
+                    message = read_frame(stream)
+                    if message is None:
+                        raise ProtocolError("agent closed the connection")
+                    self._queue.put(decoder.decode(*message))
+            except (OSError, ProtocolError) as e:
+                if not self._stopping.is_set():
+                    self.status = f"Unreachable: {e}"
+            finally:
+                self._socket = None
+                connection.close()
+            self._stopping.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+class Host:
+    # One machine as the dashboard sees it: where its snapshots come from (a
+    # Sampler for this one, an AgentClient for the others) and everything
+    # kept from them, so switching between hosts loses no history
+    
+    def __init__(self, name, source, remote=False):
+        self.name = name
+        self.source = source
+        self.remote = remote
+        self.history = History()
+        self.search = ProcessIndex()
+        self.facts = None
+        self.system = None
+    
+    def poll(self):
+        # Drains the source and records what came in. A processes snapshot
+        # is only passed on when it changed something.
+        snapshots = self.source.drain()
+        facts = snapshots.get("host")
+        if facts is not None:
+            self.facts = facts
+        snapshot = snapshots.get("system")
+        if snapshot is not None:
+            self.system = snapshot
+            self.history.record_system(snapshot)
+        snapshot = snapshots.get("processes")
+        if snapshot is not None:
+            self.history.record_processes(snapshot.taken, snapshot.processes)
+            if snapshot.generation == self.search.generation:
+                del snapshots["processes"]
+            else:
+                self.search.update(snapshot)
+        return snapshots
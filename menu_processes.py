@@ -0,0 +1,102 @@
+import time
+from collections import namedtuple
+
+import psutil
+
+# One process as shown in the Process Manager. `key` is (pid, create_time),
+# which stays unique when the OS hands a dead process's pid to a new one.
+ProcessInfo = namedtuple("ProcessInfo", (
+    "key", "pid", "name", "username", "cmdline", "cpu_percent", "memory_percent", "status"
+))
+
+# What changed since the previous refresh: new and changed ProcessInfos and
+# the keys of processes that exited
+ProcessDiff = namedtuple("ProcessDiff", ("added", "removed", "updated"))
+
+# Everything the UI needs from one refresh. `processes` is a fresh dict the
+# sampler never touches again; `generation` only moves when something
+# changed, so a UI that skipped snapshots still knows whether to redraw.
+ProcessSnapshot = namedtuple("ProcessSnapshot", ("taken", "generation", "processes", "diff"))
+
+
+class ProcessEntry:
+    __slots__ = ("process", "info")
+    
+    def __init__(self, process, info):
+        self.process = process
+        self.info = info
+
+
+class ProcessTable:
+    # Persistent table of running processes. psutil.Process objects are kept
+    # between refreshes, so cpu_percent() measures the time since the last
+    # refresh instead of returning 0.0, and the attributes that never change
+    # (name, user, command line, create time) are read once per process
+    # rather than every time.
+    # Each refresh reports only what changed, rounded the way it is shown.
+    
+    def __init__(self):
+        self.entries = {}
+        self.generation = 0
+    
+    def _read(self, process, info):
+        # `info` with the changing attributes read afresh
+        values = process.as_dict(("cpu_percent", "memory_percent", "status"), ad_value=None)
+        cpu_percent = values["cpu_percent"]
+        memory_percent = values["memory_percent"]
+        return info._replace(
+            cpu_percent=None if cpu_percent is None else round(cpu_percent, 1),
+            memory_percent=None if memory_percent is None else round(memory_percent, 1),
+            status=values["status"]
+        )
+    
+    def _add(self, pid):
+        process = psutil.Process(pid)
+        values = process.as_dict(("create_time", "name", "username", "cmdline"), ad_value=None)
+        info = ProcessInfo(
+            (pid, values["create_time"]), pid, values["name"] or "", values["username"] or "",
+            " ".join(values["cmdline"] or ()), None, None, None
+        )
+        # The first cpu_percent() only starts the measurement, so the process
+        # shows 0.0 until the next refresh
+        return ProcessEntry(process, self._read(process, info))
+    
+    def refresh(self):
+        added = []
+        updated = []
+        removed = []
+        pids = psutil.pids()
+        for pid in pids:
+            entry = self.entries.get(pid)
+            if entry is not None and not entry.process.is_running():
+                # Exited, and the pid may already belong to a new process
+                removed.append(self.entries.pop(pid).info.key)
+                entry = None
+            try:
+                if entry is None:
+                    entry = self.entries[pid] = self._add(pid)
+                    added.append(entry.info)
+                    continue
+                info = self._read(entry.process, entry.info)
+            except psutil.NoSuchProcess:
+                # Exited while we were reading it
+                if entry is not None:
+                    removed.append(self.entries.pop(pid).info.key)
+                continue
+            if info != entry.info:
+                entry.info = info
+                updated.append(info)
+        
+        alive = set(pids)
+        for pid in [pid for pid in self.entries if pid not in alive]:
+            removed.append(self.entries.pop(pid).info.key)
+        
+        if added or removed or updated:
+            self.generation += 1
+        return ProcessDiff(added, removed, updated)
+    
+    def snapshot(self):
+        # Sampler source: refreshes and returns an immutable ProcessSnapshot
+        diff = self.refresh()
+        processes = {entry.info.key: entry.info for entry in self.entries.values()}
+        return ProcessSnapshot(time.time(), self.generation, processes, diff)
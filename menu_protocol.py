@@ -0,0 +1,303 @@
+import json
+import socket
+import struct
+
+from menu_processes import ProcessDiff, ProcessInfo, ProcessSnapshot
+from menu_sampler import HostFacts, SystemSnapshot
+
+# Wire format between menu_agent and the dashboard. Every message is a frame
+# of header + payload; after a HELLO with the host facts the agent sends one
+# keyframe of each kind and from then on only what changed.
+DEFAULT_PORT = 7311
+VERSION = 1
+MAGIC = b"SD"
+# Magic, protocol version, message type, payload length
+HEADER = struct.Struct("!2sBBI")
+HELLO = 1
+SYSTEM = 2
+PROCESSES = 3
+# Anything bigger is a corrupt stream, not a process list
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+# Percentages travel as tenths in an unsigned short, NO_VALUE meaning None
+NO_VALUE = 0xFFFF
+# Strings are length-prefixed UTF-8, cut to what the prefix can hold
+MAX_STRING = 0xFFFF
+
+# SYSTEM: taken, bit mask of the fields that follow (in SYSTEM_FIELDS order)
+SYSTEM_HEAD = struct.Struct("!dB")
+SYSTEM_FIELDS = ("cpu_percent", "memory_percent", "memory_total", "memory_available", "memory_used", "per_cpu")
+# PROCESSES: taken, flags, then that many added, updated and removed records
+PROCESS_HEAD = struct.Struct("!dBIII")
+KEYFRAME = 1
+# Added: pid, create time, cpu, memory, then status, name, user and command line
+ADDED = struct.Struct("!IdHH")
+# Updated: pid and a mask of cpu (1), memory (2) and status (4) that follow
+UPDATED = struct.Struct("!IB")
+REMOVED = struct.Struct("!Id")
+SHORT = struct.Struct("!H")
+LONG = struct.Struct("!Q")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_address(text):
+    # "unix:/run/agent.sock" or anything with a slash is a Unix socket,
+    # otherwise "host:port", "host" or ":port" over TCP
+    if text.startswith("unix:"):
+        return socket.AF_UNIX, text[5:]
+    if "/" in text:
+        return socket.AF_UNIX, text
+    host, _, port = text.rpartition(":") if ":" in text else (text, "", "")
+    return socket.AF_INET, (host.strip("[]") or "127.0.0.1", int(port) if port else DEFAULT_PORT)
+
+
+def frame(kind, payload):
+    return HEADER.pack(MAGIC, VERSION, kind, len(payload)) + payload
+
+
+def read_frame(stream):
+    # (kind, payload) of the next frame on a binary file object; None once
+    # the other end has closed the connection
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ProtocolError("connection closed mid-frame")
+    magic, version, kind, length = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError(f"not a version {VERSION} agent stream")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"frame of {length} bytes")
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ProtocolError("connection closed mid-frame")
+    return kind, payload
+
+
+def pack_percent(value):
+    return NO_VALUE if value is None else min(max(int(round(value * 10)), 0), NO_VALUE - 1)
+
+
+def unpack_percent(value):
+    return None if value == NO_VALUE else value / 10
+
+
+def pack_string(text):
+    data = (text or "").encode("utf-8", "replace")[:MAX_STRING]
+    return SHORT.pack(len(data)) + data
+
+
+def unpack_string(payload, offset):
+    (length,) = SHORT.unpack_from(payload, offset)
+    offset += SHORT.size
+    return payload[offset:offset + length].decode("utf-8", "replace"), offset + length
+
+
+def encode_hello(facts, interval):
+    return frame(HELLO, json.dumps({"facts": facts._asdict(), "interval": interval}).encode())
+
+
+def encode_system(snapshot, previous=None):
+    # Only the fields that differ from `previous` are sent; without one the
+    # frame is a keyframe with all of them
+    mask = 0
+    parts = []
+    for bit, field in enumerate(SYSTEM_FIELDS):
+        value = getattr(snapshot, field)
+        if previous is not None and getattr(previous, field) == value:
+            continue
+        mask |= 1 << bit
+        if field == "per_cpu":
+            parts.append(SHORT.pack(len(value)))
+            parts.append(struct.pack(f"!{len(value)}H", *map(pack_percent, value)))
+        elif field.endswith("_percent"):
+            parts.append(SHORT.pack(pack_percent(value)))
+        else:
+            parts.append(LONG.pack(value))
+    return frame(SYSTEM, SYSTEM_HEAD.pack(snapshot.taken, mask) + b"".join(parts))
+
+
+def encode_processes(snapshot, previous=None):
+    # A menu_processes.ProcessSnapshot as the difference from `previous` (the
+    # processes dict of the last snapshot sent); without one every process
+    # is sent as added, flagged as a keyframe. Returns None if nothing changed.
+    processes = snapshot.processes
+    if previous is None:
+        flags = KEYFRAME
+        added = list(processes.values())
+        updated = []
+        removed = []
+    else:
+        flags = 0
+        diff = snapshot.diff
+        added = diff.added
+        updated = [info for info in diff.updated if info.key in previous]
+        removed = diff.removed
+        if not (added or updated or removed):
+            return None
+    
+    parts = [PROCESS_HEAD.pack(snapshot.taken, flags, len(added), len(updated), len(removed))]
+    # Removed first, so a reused pid's old process is gone before the new
+    # one arrives
+    for key in removed:
+        parts.append(REMOVED.pack(key[0], key[1] or 0.0))
+    for info in added:
+        parts.append(ADDED.pack(
+            info.pid, info.key[1] or 0.0, pack_percent(info.cpu_percent), pack_percent(info.memory_percent)
+        ))
+        parts.append(pack_string(info.status))
+        parts.append(pack_string(info.name))
+        parts.append(pack_string(info.username))
+        parts.append(pack_string(info.cmdline))
+    for info in updated:
+        before = previous[info.key]
+        mask = 0
+        fields = []
+        if info.cpu_percent != before.cpu_percent:
+            mask |= 1
+            fields.append(SHORT.pack(pack_percent(info.cpu_percent)))
+        if info.memory_percent != before.memory_percent:
+            mask |= 2
+            fields.append(SHORT.pack(pack_percent(info.memory_percent)))
+        if info.status != before.status:
+            mask |= 4
+            fields.append(pack_string(info.status))
+        parts.append(UPDATED.pack(info.pid, mask))
+        parts.extend(fields)
+    return frame(PROCESSES, b"".join(parts))
+
+
+class Decoder:
+    # Rebuilds an agent's snapshots from its frames. Holds the state the
+    # deltas apply to, so it needs every frame of one connection in order;
+    # a new connection needs a new Decoder (or reset()).
+    
+    def __init__(self):
+        self.system = None
+        self.processes = {}
+        self.pids = {}
+        self.generation = 0
+        self.synced = False
+        self.interval = None
+    
+    def reset(self):
+        # For a new connection to the same agent: the processes are kept
+        # until its keyframe says which of them are gone
+        self.system = None
+        self.synced = False
+    
+    def decode(self, kind, payload):
+        # (source name, snapshot) like a menu_sampler.Sampler publishes
+        try:
+            if kind == HELLO:
+                hello = json.loads(payload)
+                self.interval = hello.get("interval")
+                return "host", HostFacts(**hello["facts"])
+            if kind == SYSTEM:
+                return "system", self._system(payload)
+            if kind == PROCESSES:
+                return "processes", self._processes(payload)
+        except (struct.error, ValueError, KeyError, TypeError) as e:
+            raise ProtocolError(f"bad frame: {e}") from e
+        raise ProtocolError(f"unknown message type {kind}")
+    
+    def _system(self, payload):
+        taken, mask = SYSTEM_HEAD.unpack_from(payload)
+        offset = SYSTEM_HEAD.size
+        values = {}
+        for bit, field in enumerate(SYSTEM_FIELDS):
+            if not mask & (1 << bit):
+                if self.system is None:
+                    raise ProtocolError("system delta without a keyframe")
+                values[field] = getattr(self.system, field)
+                continue
+            if field == "per_cpu":
+                (count,) = SHORT.unpack_from(payload, offset)
+                offset += SHORT.size
+                percents = struct.unpack_from(f"!{count}H", payload, offset)
+                offset += 2 * count
+                values[field] = tuple(map(unpack_percent, percents))
+            elif field.endswith("_percent"):
+                values[field] = unpack_percent(SHORT.unpack_from(payload, offset)[0])
+                offset += SHORT.size
+            else:
+                values[field] = LONG.unpack_from(payload, offset)[0]
+                offset += LONG.size
+        self.system = SystemSnapshot(taken, **values)
+        return self.system
+    
+    def _processes(self, payload):
+        taken, flags, added_count, updated_count, removed_count = PROCESS_HEAD.unpack_from(payload)
+        offset = PROCESS_HEAD.size
+        if flags & KEYFRAME:
+            old = self.processes
+            processes = {}
+            self.pids = {}
+            # Jump the generation, so ProcessIndex resyncs from the key
+            # sets instead of trusting a diff against what it last saw
+            self.generation += 1
+            self.synced = True
+        elif not self.synced:
+            raise ProtocolError("process delta without a keyframe")
+        else:
+            # Snapshots hand out their dict, so changes go to a copy
+            processes = dict(self.processes)
+        pids = self.pids
+        added = []
+        updated = []
+        removed = []
+        
+        for _ in range(removed_count):
+            pid, create_time = REMOVED.unpack_from(payload, offset)
+            offset += REMOVED.size
+            key = (pid, create_time)
+            if processes.pop(key, None) is not None:
+                removed.append(key)
+                if pids.get(pid) == key:
+                    del pids[pid]
+        
+        for _ in range(added_count):
+            pid, create_time, cpu_percent, memory_percent = ADDED.unpack_from(payload, offset)
+            offset += ADDED.size
+            status, offset = unpack_string(payload, offset)
+            name, offset = unpack_string(payload, offset)
+            username, offset = unpack_string(payload, offset)
+            cmdline, offset = unpack_string(payload, offset)
+            key = (pid, create_time)
+            info = ProcessInfo(
+                key, pid, name, username, cmdline,
+                unpack_percent(cpu_percent), unpack_percent(memory_percent), status or None
+            )
+            processes[key] = info
+            pids[pid] = key
+            added.append(info)
+        
+        for _ in range(updated_count):
+            pid, mask = UPDATED.unpack_from(payload, offset)
+            offset += UPDATED.size
+            changes = {}
+            if mask & 1:
+                changes["cpu_percent"] = unpack_percent(SHORT.unpack_from(payload, offset)[0])
+                offset += SHORT.size
+            if mask & 2:
+                changes["memory_percent"] = unpack_percent(SHORT.unpack_from(payload, offset)[0])
+                offset += SHORT.size
+            if mask & 4:
+                status, offset = unpack_string(payload, offset)
+                changes["status"] = status or None
+            key = pids.get(pid)
+            if key is None:
+                continue
+            info = processes[key] = processes[key]._replace(**changes)
+            updated.append(info)
+        
+        if flags & KEYFRAME:
+            # What the keyframe no longer has went away while we weren't
+            # looking
+            removed = [key for key in old if key not in processes]
+        self.processes = processes
+        self.generation += 1
+        return ProcessSnapshot(taken, self.generation, processes, ProcessDiff(added, removed, updated))
@@ -0,0 +1,136 @@
+import platform
+import queue
+import socket
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import psutil
+
+# Seconds between samples of a source, unless it was added with its own
+SAMPLE_INTERVAL = 2.0
+
+# Whole-system figures from one sample. Snapshots are tuples, so the Tk
+# thread can hold on to one while the sampler is building the next.
+SystemSnapshot = namedtuple("SystemSnapshot", (
+    "taken", "cpu_percent", "per_cpu", "memory_percent", "memory_total", "memory_available", "memory_used"
+))
+
+# Facts about the host that don't change while the dashboard runs
+HostFacts = namedtuple("HostFacts", (
+    "system", "node", "release", "version", "machine", "processor", "boot_time", "ip_address"
+))
+
+
+def host_facts():
+    # Slow (uname shells out on some platforms, and a misconfigured DNS can
+    # keep gethostbyname() waiting for seconds), so run it with run_once()
+    uname = platform.uname()
+    boot_time = datetime.fromtimestamp(psutil.boot_time()).strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        ip_address = socket.gethostbyname(socket.gethostname())
+    except OSError:
+        ip_address = "unknown"
+    return HostFacts(
+        uname.system, uname.node, uname.release, uname.version, uname.machine, uname.processor, boot_time, ip_address
+    )
+
+
+def sample_system():
+    mem = psutil.virtual_memory()
+    return SystemSnapshot(
+        time.time(), psutil.cpu_percent(), tuple(psutil.cpu_percent(percpu=True)),
+        mem.percent, mem.total, mem.available, mem.used
+    )
+
+
+class Sampler:
+    # Runs psutil collection on a background thread and publishes immutable
+    # snapshots through a queue. The thread never touches a widget; the Tk
+    # thread calls drain() from an after() loop and gets the newest snapshot
+    # of each source, so a UI that fell behind skips straight to current
+    # values instead of replaying every sample.
+    
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+    
+    def add(self, name, sample, interval=None):
+        # `sample` is called on the sampler thread and returns a snapshot
+        with self._lock:
+            self._sources[name] = [sample, interval or self.interval, 0.0]
+        self._wake.set()
+    
+    def remove(self, name):
+        with self._lock:
+            self._sources.pop(name, None)
+    
+    def refresh(self, name):
+        # Samples `name` on the next pass instead of waiting for its interval
+        with self._lock:
+            source = self._sources.get(name)
+            if source is not None:
+                source[2] = 0.0
+        self._wake.set()
+    
+    def run_once(self, name, sample):
+        # Runs a slow one-off `sample` on its own thread, so it never holds
+        # up the periodic sources; its result is drained like any other
+        def run():
+            try:
+                snapshot = sample()
+            except (psutil.Error, OSError):
+                return
+            self._queue.put((name, snapshot))
+        
+        threading.Thread(target=run, name=f"sampler-{name}", daemon=True).start()
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=1.0):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def drain(self):
+        latest = {}
+        while True:
+            try:
+                name, snapshot = self._queue.get_nowait()
+            except queue.Empty:
+                return latest
+            latest[name] = snapshot
+    
+    def _run(self):
+        while not self._stopping:
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = [(name, source) for name, source in self._sources.items() if source[2] <= now]
+                for _, source in due:
+                    source[2] = now + source[1]
+            for name, source in due:
+                try:
+                    snapshot = source[0]()
+                except (psutil.Error, OSError):
+                    # Try again next interval; one failed read shouldn't
+                    # stop every other source
+                    continue
+                self._queue.put((name, snapshot))
+            
+            with self._lock:
+                next_due = min((source[2] for source in self._sources.values()), default=now + self.interval)
+            self._wake.wait(max(next_due - time.monotonic(), 0.0))
@@ -0,0 +1,190 @@
+import operator
+import re
+import time
+
+# Fields a query can name, e.g. "user:root cpu>5 name:python"
+TEXT_FIELDS = {"name": "name", "user": "username", "cmd": "cmdline"}
+NUMBER_FIELDS = {"pid": "pid", "cpu": "cpu_percent", "mem": "memory_percent"}
+OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+    ":": operator.eq
+}
+TERM = re.compile(r"^(\w+)(>=|<=|>|<|=|:)(.*)$")
+# Seconds of trigram indexing done per call of index_pending()
+INDEX_BUDGET = 0.008
+
+
+def parse_query(text):
+    # Splits a query into terms, all of which must match:
+    #   ("text", value)                   - pid, name, user or command line contains value
+    #   ("text", value, attribute)        - that one attribute contains value
+    #   ("status", value)                 - status is value
+    #   ("number", attribute, op, value)  - numeric comparison
+    # Anything that doesn't parse as a field term is plain text.
+    terms = []
+    for word in text.lower().split():
+        match = TERM.match(word)
+        if match is not None and match.group(3):
+            field, op, value = match.groups()
+            if field in TEXT_FIELDS and op == ":":
+                terms.append(("text", value, TEXT_FIELDS[field]))
+                continue
+            if field == "status" and op in (":", "="):
+                terms.append(("status", value))
+                continue
+            if field in NUMBER_FIELDS:
+                try:
+                    terms.append(("number", NUMBER_FIELDS[field], op, float(value)))
+                    continue
+                except ValueError:
+                    pass
+        terms.append(("text", word))
+    return terms
+
+
+def narrows(old, new):
+    # True if every process matching `new` also matches `old`, i.e. `new` is
+    # `old` with more terms, or with a text term that got longer
+    if len(new) < len(old):
+        return False
+    for index, term in enumerate(old):
+        other = new[index]
+        if other == term:
+            continue
+        # Only the last term typed can have changed, and only a contains
+        # match gets narrower as it gets longer ("cpu>5" -> "cpu>50" doesn't)
+        if index != len(old) - 1 or term[0] != "text" or other[0] != "text" or term[2:] != other[2:]:
+            return False
+        if term[1] not in other[1]:
+            return False
+    return True
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProcessIndex:
+    # Search index over the process list: a trigram index of each process's
+    # pid, name, user and command line, kept in step with the snapshot diffs
+    # instead of being rebuilt, plus the last query's result so a query that
+    # only grows while you type is answered from that result, not the index.
+    # New processes are indexed a few milliseconds at a time (index_pending)
+    # so a first snapshot of thousands never stalls the UI; until then they
+    # are simply checked one by one.
+    
+    def __init__(self):
+        self.records = {}
+        self.texts = {}
+        self.grams = {}
+        self.pending = set()
+        self.generation = None
+        self.last_terms = None
+        self.last_keys = None
+    
+    def _add(self, info):
+        self.texts[info.key] = f"{info.pid} {info.name} {info.username} {info.cmdline}".lower()
+        self.pending.add(info.key)
+    
+    def _remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        if key in self.pending:
+            self.pending.discard(key)
+            return
+        for gram in trigrams(text):
+            keys = self.grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.grams[gram]
+    
+    def index_pending(self, budget=INDEX_BUDGET):
+        # Returns True while there is more to index
+        deadline = time.perf_counter() + budget
+        grams = self.grams
+        while self.pending and time.perf_counter() < deadline:
+            for _ in range(20):
+                if not self.pending:
+                    break
+                key = self.pending.pop()
+                for gram in trigrams(self.texts[key]):
+                    keys = grams.get(gram)
+                    if keys is None:
+                        keys = grams[gram] = set()
+                    keys.add(key)
+        return bool(self.pending)
+    
+    def update(self, snapshot):
+        # Applies a menu_processes.ProcessSnapshot. Its diff is only enough
+        # if it directly follows the last snapshot we saw; after skipped
+        # snapshots the index is brought in line with the key sets instead.
+        processes = snapshot.processes
+        if self.generation is not None and snapshot.generation == self.generation + 1:
+            for key in snapshot.diff.removed:
+                self._remove(key)
+            for info in snapshot.diff.added:
+                self._add(info)
+        else:
+            for key in [key for key in self.texts if key not in processes]:
+                self._remove(key)
+            for key, info in processes.items():
+                if key not in self.texts:
+                    self._add(info)
+        self.records = processes
+        self.generation = snapshot.generation
+        self.last_terms = None
+        self.last_keys = None
+    
+    def search(self, text):
+        terms = parse_query(text)
+        if not terms:
+            self.last_terms = terms
+            self.last_keys = None
+            return list(self.records.values())
+        
+        if self.last_terms and self.last_keys is not None and narrows(self.last_terms, terms):
+            candidates = self.last_keys
+        else:
+            candidates = None
+            # Start from the rarest trigram of any text term
+            for term in terms:
+                if term[0] != "text" or len(term[1]) < 3:
+                    continue
+                for gram in trigrams(term[1]):
+                    keys = self.grams.get(gram, ())
+                    if candidates is None or len(keys) < len(candidates):
+                        candidates = keys
+            if candidates is None:
+                candidates = self.records.keys()
+            elif self.pending:
+                candidates = list(candidates) + list(self.pending)
+        
+        keys = [key for key in candidates if key in self.records and self.matches(key, terms)]
+        self.last_terms = terms
+        self.last_keys = keys
+        return [self.records[key] for key in keys]
+    
+    def matches(self, key, terms):
+        info = self.records[key]
+        for term in terms:
+            kind = term[0]
+            if kind == "text":
+                if len(term) == 2:
+                    if term[1] not in self.texts[key]:
+                        return False
+                elif term[1] not in str(getattr(info, term[2]) or "").lower():
+                    return False
+            elif kind == "status":
+                if (info.status or "").lower() != term[1]:
+                    return False
+            else:
+                value = getattr(info, term[1])
+                if value is None or not OPERATORS[term[2]](value, term[3]):
+                    return False
+        return True
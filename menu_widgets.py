@@ -0,0 +1,254 @@
+from collections import deque
+
+import customtkinter as ctk
+
+ASCENDING = " ▲"
+DESCENDING = " ▼"
+
+
+class VirtualTable(ctk.CTkFrame):
+    # Sortable table that only has widgets for the rows that fit on screen.
+    # The pool of row widgets is created once per height and re-filled as you
+    # scroll, filter or re-sort, and a cell is only reconfigured when its text
+    # changed, so ten thousand records cost no more to show than thirty.
+    #
+    # `columns` is a list of (heading, width, sort_key) where sort_key(record)
+    # returns the value the column sorts by; `cells(record)` returns the
+    # texts of one row. With `action`, each row ends in a button that calls
+    # action(record). `body_height` is the height of the rows area; the
+    # table can't take it from its content since it has none to spare.
+    
+    def __init__(self, master, columns, cells, action=None, action_text="", row_height=30, body_height=400,
+                 **kwargs):
+        super().__init__(master, **kwargs)
+        self.columns = columns
+        self.cells = cells
+        self.action = action
+        self.action_text = action_text
+        self.row_height = row_height
+        self.records = []
+        self.rows = []
+        self.sort_column = None
+        self.sort_reverse = False
+        self.offset = 0
+        self.pool = []
+        self.shown = []
+        
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+        
+        self.header = ctk.CTkFrame(self, fg_color="transparent")
+        self.header.grid(row=0, column=0, sticky="ew")
+        self.headings = []
+        for column, (heading, width, _) in enumerate(columns):
+            button = ctk.CTkButton(self.header, text=heading, width=width, anchor="w", fg_color="transparent",
+                                   font=ctk.CTkFont(weight="bold"),
+                                   command=lambda column=column: self.sort_by(column))
+            button.grid(row=0, column=column, padx=5, pady=5, sticky="w")
+            self.headings.append(button)
+            self.header.grid_columnconfigure(column, minsize=width + 10)
+        
+        self.body = ctk.CTkFrame(self, fg_color="transparent", height=body_height)
+        self.body.grid(row=1, column=0, sticky="nsew")
+        # The pool is sized from the body's height, so the body must not grow
+        # to fit the pool
+        self.body.grid_propagate(False)
+        for column, (_, width, _) in enumerate(columns):
+            self.body.grid_columnconfigure(column, minsize=width + 10)
+        
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+        
+        self.body.bind("<Configure>", self.on_resize)
+        for widget in (self, self.body):
+            self.bind_scroll(widget)
+    
+    @property
+    def visible_rows(self):
+        return len(self.pool)
+    
+    def bind_scroll(self, widget):
+        widget.bind("<MouseWheel>", self.on_mousewheel)
+        widget.bind("<Button-4>", lambda event: self.scroll_by(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll_by(1))
+    
+    def set_rows(self, records):
+        self.records = records
+        self.rows = self.sorted(records)
+        self.offset = min(self.offset, self.max_offset())
+        self.render()
+    
+    def sorted(self, records):
+        if self.sort_column is None:
+            return list(records)
+        sort_key = self.columns[self.sort_column][2]
+        return sorted(records, key=sort_key, reverse=self.sort_reverse)
+    
+    def sort_by(self, column, reverse=None):
+        # Clicking the sorted column again flips its direction
+        if reverse is None:
+            reverse = not self.sort_reverse if column == self.sort_column else False
+        self.sort_column = column
+        self.sort_reverse = reverse
+        for index, button in enumerate(self.headings):
+            text = self.columns[index][0]
+            if index == column:
+                text += DESCENDING if reverse else ASCENDING
+            button.configure(text=text)
+        self.rows = self.sorted(self.records)
+        self.render()
+    
+    def max_offset(self):
+        return max(len(self.rows) - self.visible_rows, 0)
+    
+    def scroll_by(self, rows):
+        offset = max(0, min(self.offset + rows, self.max_offset()))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+    
+    def on_mousewheel(self, event):
+        # Windows/macOS report wheel deltas in multiples of 120 (or 1 on macOS)
+        step = -1 if event.delta > 0 else 1
+        self.scroll_by(step * max(1, abs(event.delta) // 120))
+    
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = max(0, min(int(float(value) * len(self.rows)), self.max_offset()))
+            self.render()
+        elif action == "scroll":
+            amount = int(value) * (self.visible_rows if unit == "pages" else 1)
+            self.scroll_by(amount)
+    
+    def on_resize(self, event):
+        wanted = max(1, event.height // self.row_height)
+        if wanted == len(self.pool):
+            return
+        while len(self.pool) < wanted:
+            slot = len(self.pool)
+            widgets = []
+            for _, width, _ in self.columns:
+                label = ctk.CTkLabel(self.body, text="", width=width, anchor="w", height=self.row_height - 6)
+                self.bind_scroll(label)
+                widgets.append(label)
+            if self.action is not None:
+                button = ctk.CTkButton(self.body, text=self.action_text, width=80, height=self.row_height - 6,
+                                       command=lambda slot=slot: self.on_action(slot))
+                self.bind_scroll(button)
+                widgets.append(button)
+            self.pool.append(widgets)
+            self.shown.append(None)
+        while len(self.pool) > wanted:
+            for widget in self.pool.pop():
+                widget.destroy()
+            self.shown.pop()
+        self.offset = min(self.offset, self.max_offset())
+        self.render()
+    
+    def on_action(self, slot):
+        position = self.offset + slot
+        if position < len(self.rows):
+            self.action(self.rows[position])
+    
+    def render(self):
+        columns = len(self.columns)
+        for slot, widgets in enumerate(self.pool):
+            position = self.offset + slot
+            shown = self.shown[slot]
+            if position >= len(self.rows):
+                if shown is not None:
+                    for widget in widgets:
+                        widget.grid_remove()
+                    self.shown[slot] = None
+                continue
+            texts = self.cells(self.rows[position])
+            if shown is None:
+                for column, widget in enumerate(widgets):
+                    widget.grid(row=slot, column=column, padx=5, pady=2, sticky="w")
+                shown = ()
+            # Reconfiguring a CTk widget redraws it, so only touch the cells
+            # whose text changed
+            for column in range(columns):
+                if column >= len(shown) or shown[column] != texts[column]:
+                    widgets[column].configure(text=texts[column])
+            self.shown[slot] = texts
+        
+        total = len(self.rows)
+        if total == 0 or total <= self.visible_rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.visible_rows) / total)
+
+
+class Sparkline(ctk.CTkCanvas):
+    # Line chart of one menu_history.Tier. New points are drawn as one new
+    # line segment each; once the chart is full everything shifts left by a
+    # step and the oldest segment is deleted. What is already on the canvas
+    # is only redrawn when the size, the tier or the kind of point changes.
+    
+    def __init__(self, master, maximum=100.0, color="#3a7ebf", height=40, **kwargs):
+        mode = 0 if ctk.get_appearance_mode() == "Light" else 1
+        background = ctk.ThemeManager.theme["CTkFrame"]["top_fg_color"][mode]
+        super().__init__(master, height=height, highlightthickness=0, bg=background, **kwargs)
+        self.maximum = maximum
+        self.color = color
+        self.tier = None
+        self.kind = "avg"
+        self.points = 2
+        self.seen = 0
+        self.segments = deque()
+        self.last = None
+        self.count = 0
+        self.bind("<Configure>", lambda event: self.redraw())
+    
+    def show(self, tier, kind="avg"):
+        if tier is not self.tier or kind != self.kind:
+            self.tier = tier
+            self.kind = kind
+            self.points = max(tier.capacity, 2)
+            self.redraw()
+            return
+        new = tier.appended - self.seen
+        if new <= 0:
+            return
+        if new >= self.points:
+            self.redraw()
+            return
+        for value in tier.latest(new, kind):
+            self.append(value)
+        self.seen = tier.appended
+    
+    def clear(self):
+        # Nothing to show, e.g. a host that hasn't sent this series yet
+        self.tier = None
+        self.redraw()
+    
+    def redraw(self):
+        self.delete("all")
+        self.segments.clear()
+        self.last = None
+        self.count = 0
+        if self.tier is None:
+            return
+        for value in self.tier.latest(self.points, self.kind):
+            self.append(value)
+        self.seen = self.tier.appended
+    
+    def append(self, value):
+        height = self.winfo_height()
+        y = height - 1 - min(max(value, 0.0), self.maximum) / self.maximum * (height - 2)
+        if self.last is None:
+            self.last = (0.0, y)
+            self.count = 1
+            return
+        step = self.winfo_width() / (self.points - 1)
+        x = self.last[0] + step
+        if self.count >= self.points:
+            # Full: slide the chart left and drop the segment that fell off
+            self.move("segment", -step, 0)
+            self.delete(self.segments.popleft())
+            x -= step
+        else:
+            self.count += 1
+        self.segments.append(self.create_line(x - step, self.last[1], x, y, fill=self.color, tags="segment"))
+        self.last = (x, y)
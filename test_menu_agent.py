@@ -0,0 +1,153 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from menu_agent import Agent, Subscriber
+from menu_processes import ProcessDiff, ProcessInfo, ProcessSnapshot
+from menu_protocol import PROCESSES, Decoder, ProtocolError, encode_processes, encode_system, read_frame
+from menu_sampler import SystemSnapshot
+
+# Agent -> dashboard round trips: what the Decoder rebuilds from the frames
+# must be what the agent encoded, across deltas, reused pids and reconnects.
+# Run with: python -m unittest test_menu_agent
+
+
+def process(pid, created, name, cpu_percent=0.0):
+    return ProcessInfo((pid, created), pid, name, "user", f"/usr/bin/{name} --flag", cpu_percent, 1.5, "running")
+
+
+def snapshot(taken, processes, added=(), removed=(), updated=()):
+    return ProcessSnapshot(
+        taken, 0, {info.key: info for info in processes}, ProcessDiff(list(added), list(removed), list(updated))
+    )
+
+
+def system(taken, cpu_percent=12.5):
+    return SystemSnapshot(taken, cpu_percent, (10.0, 15.0), 40.0, 8 << 30, 5 << 30, 3 << 30)
+
+
+def decode(decoder, data):
+    return decoder.decode(*read_frame(io.BytesIO(data)))[1]
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_deltas_reused_pid_and_reconnect(self):
+        decoder = Decoder()
+        self.assertEqual(decode(decoder, encode_system(system(1.0))), system(1.0))
+        self.assertEqual(decode(decoder, encode_system(system(2.0, 80.0), system(1.0))), system(2.0, 80.0))
+        
+        old = process(100, 1.0, "old")
+        other = process(200, 2.0, "other")
+        first = snapshot(1.0, [old, other])
+        self.assertEqual(decode(decoder, encode_processes(first)).processes, first.processes)
+        
+        # pid 100 exits and goes to a new process within one refresh
+        new = process(100, 5.0, "new", 3.0)
+        busier = other._replace(cpu_percent=50.0)
+        second = snapshot(2.0, [new, busier], added=[new], removed=[old.key], updated=[busier])
+        decoded = decode(decoder, encode_processes(second, first.processes))
+        self.assertEqual(decoded.processes, second.processes)
+        self.assertEqual(decoded.diff.removed, [old.key])
+        
+        # Updates for that pid now apply to the new process
+        newer = new._replace(cpu_percent=7.5, status="sleeping")
+        third = snapshot(3.0, [newer, busier], updated=[newer])
+        self.assertEqual(decode(decoder, encode_processes(third, second.processes)).processes, third.processes)
+        
+        # Reconnected: deltas are refused until the keyframes arrive, and
+        # the process keyframe drops what exited while disconnected
+        decoder.reset()
+        with self.assertRaises(ProtocolError):
+            decode(decoder, encode_system(system(4.0, 20.0), system(3.0)))
+        fourth = snapshot(4.0, [newer._replace(cpu_percent=1.0)], updated=[newer], removed=[other.key])
+        with self.assertRaises(ProtocolError):
+            decode(decoder, encode_processes(fourth, third.processes))
+        self.assertEqual(decode(decoder, encode_system(system(4.0, 20.0))), system(4.0, 20.0))
+        decoded = decode(decoder, encode_processes(fourth))
+        self.assertEqual(decoded.processes, fourth.processes)
+        self.assertEqual(decoded.diff.removed, [other.key])
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix sockets")
+class AgentTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "agent.sock")
+        self.agent = Agent([f"unix:{self.path}"], interval=0.1, process_interval=0.2)
+        self.agent.listen()
+        self.thread = threading.Thread(target=self.agent.run, daemon=True)
+        self.thread.start()
+    
+    def tearDown(self):
+        self.agent.stop()
+        self.thread.join(5)
+        self.agent.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def subscribe(self, decoder):
+        # Connects like menu_hosts.AgentClient and reads up to the first
+        # process snapshot, which has to be a keyframe
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(10)
+        connection.connect(self.path)
+        stream = connection.makefile("rb")
+        decoder.reset()
+        names = []
+        while True:
+            kind, payload = read_frame(stream)
+            name, decoded = decoder.decode(kind, payload)
+            names.append(name)
+            if kind == PROCESSES:
+                self.assertEqual(names, ["host", "system", "processes"])
+                return connection, stream, decoded
+    
+    def test_keyframes_after_reconnect(self):
+        decoder = Decoder()
+        connection, stream, first = self.subscribe(decoder)
+        self.assertIn(os.getpid(), {key[0] for key in first.processes})
+        for _ in range(5):
+            decoder.decode(*read_frame(stream))
+        connection.close()
+        
+        connection, stream, second = self.subscribe(decoder)
+        self.assertIn(os.getpid(), {key[0] for key in second.processes})
+        self.assertEqual(decoder.processes, second.processes)
+        connection.close()
+    
+    def test_stalled_subscriber_does_not_hold_up_others(self):
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(self.path)
+        connection, stream, _ = self.subscribe(Decoder())
+        started = time.monotonic()
+        for _ in range(10):
+            read_frame(stream)
+        self.assertLess(time.monotonic() - started, 5)
+        connection.close()
+        stalled.close()
+
+
+class SubscriberTest(unittest.TestCase):
+    def test_overflow_drops_without_blocking(self):
+        ours, theirs = socket.socketpair()
+        warnings = []
+        subscriber = Subscriber(ours, "test", warnings.append, max_backlog=256 * 1024)
+        chunk = b"x" * (64 * 1024)
+        started = time.monotonic()
+        # The other end never reads: the socket buffer fills, then the backlog
+        for _ in range(1000):
+            if not subscriber.put(chunk):
+                break
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(subscriber.closed)
+        self.assertFalse(subscriber.put(chunk))
+        self.assertTrue(warnings)
+        theirs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()